@@ -3,11 +3,25 @@ import os
 from ultralytics import YOLO
 import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import clock
 import controller
+import tracing
+from box_utils import nms
+from screen_fingerprint import fingerprint, decode_fingerprint, is_similar
+from nav_graph import NavigationGraph, BACK, HOME, tap
+from app_readiness import foreground, wait_for_app_ready, LAUNCH_METRICS
+
+# 检测结果按类别做非极大值抑制的交并比阈值，与ultralytics默认的iou一致；
+# 不同类别的目标互不抑制，重叠的不同类别目标仍然都会被点击
+YOLO_OVERLAP_THRESH = 0.7
+
+# 进程内共享的导航图，test_detection结束时保存
+NAV_GRAPH = NavigationGraph(os.path.join("output", "nav_graph.json"))
 
 def compare_screenshots(img1: np.ndarray, img2: np.ndarray, threshold: float = 0.95) -> bool:
     """
-    比较两个截图是否相似
+    比较两个截图是否相似：比较去掉状态栏后的感知哈希和缩略图SSIM，时钟等变化不影响结果
     Args:
         img1: 第一个截图
         img2: 第二个截图
@@ -16,56 +30,74 @@ def compare_screenshots(img1: np.ndarray, img2: np.ndarray, threshold: float = 0
         bool: 是否相似
     """
     try:
-        # 确保两个图片尺寸相同
-        if img1.shape != img2.shape:
-            return False
-        
-        # 计算图片相似度
-        similarity = cv2.matchTemplate(img1, img2, cv2.TM_CCOEFF_NORMED)[0][0]
-        return similarity >= threshold
+        return is_similar(fingerprint(img1), fingerprint(img2), threshold)
         
     except Exception as e:
         print(f"比较截图失败: {str(e)}")
         return False
 
-def ensure_back_to_initial_page(initial_img: np.ndarray, device_id: str = None, max_attempts: int = 5):
+@tracing.traced()
+def ensure_back_to_initial_page(initial_img: np.ndarray, device_id: str = None, max_attempts: int = 5,
+                                nav_graph: NavigationGraph = None):
     """
-    确保返回到初始页面
+    确保返回到初始页面：当前页面在导航图中且有到初始页面的路径时按最短路径操作，否则按返回键
     Args:
-        initial_img: 初始页面的截图
+        initial_img: 初始页面的截图，或其指纹(fingerprint()的返回值)
         device_id: 设备ID
         max_attempts: 最大尝试次数
+        nav_graph: 导航图，默认使用NAV_GRAPH；每次截图和操作都会记录到图中
     Returns:
         bool: 是否成功返回初始页面
     """
+    graph = NAV_GRAPH if nav_graph is None else nav_graph
+    # 初始页面的指纹只计算一次
+    initial_fp = initial_img if isinstance(initial_img, tuple) else fingerprint(initial_img)
+    target = graph.locate(initial_fp)
     for i in range(max_attempts):
         # 获取当前页面截图
         current_screenshot_data = controller.capture_phone_screen(device_id)
         if current_screenshot_data is None:
             continue
             
-        # 转换为numpy数组
-        nparr = np.frombuffer(current_screenshot_data, np.uint8)
-        current_img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if current_img is None:
+        # 以低分辨率灰度解码并计算指纹，不需要完整解码
+        with tracing.span("decode_fingerprint", "decode"):
+            current_fp = decode_fingerprint(current_screenshot_data)
+        if current_fp is None:
             continue
         
-        # 比较当前页面与初始页面
-        if compare_screenshots(initial_img, current_img):
+        # 记录当前页面(同时记下上一次操作的跳转)，并与初始页面比较
+        node = graph.observe(current_fp)
+        if is_similar(initial_fp, current_fp):
             print("已返回初始页面")
             return True
+        
+        path = graph.shortest_path(node, target)
+        if path:
+            # 已知路径：连续执行整条路径，只在最后截图确认
+            print(f"第 {i+1} 次尝试返回: 按导航图执行 {len(path)} 步")
+            for action, expected in path:
+                graph.perform(action, device_id, expected)
+                tracing.sleep(1, "等待导航")
+            graph.stats['path_moves'] += len(path)
+            continue
             
-        # 如果不相同，执行返回操作
+        # 未知页面，执行返回操作
         print(f"第 {i+1} 次尝试返回...")
-        controller.press_back(device_id)
-        time.sleep(1)
+        graph.perform(BACK, device_id)
+        graph.stats['fallback_moves'] += 1
+        tracing.sleep(1, "等待返回")
     
     print(f"未能在 {max_attempts} 次尝试内返回初始页面")
     return False
 
-def test_detection():
+@tracing.traced()
+def test_detection(raise_errors=False):
     """
     按置信度顺序点击检测到的所有目标
+    Args:
+        raise_errors: 截图、模型加载或检测失败时抛出异常，供任务队列重试；默认只打印错误
+    Returns:
+        dict: {'targets': 点击的目标数, 'elapsed': 耗时(秒)}；失败且raise_errors为False时返回None
     """
     try:
         # 创建output文件夹
@@ -73,29 +105,58 @@ def test_detection():
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        # 加载模型
-        model = YOLO("best.pt")
+        start = time.perf_counter()
+        timings = {}
+        
+        def load_model():
+            load_start = time.perf_counter()
+            with tracing.span("load_model", "yolo"):
+                model = YOLO("best.pt")
+            timings['加载模型'] = time.perf_counter() - load_start
+            return model
+        
+        # 加载模型与截图互不依赖，在后台线程中加载；结果图片也在后台保存，不阻塞点击
+        executor = ThreadPoolExecutor(max_workers=2)
+        model_future = executor.submit(load_model)
         
         # 捕获初始页面截图
+        stage_start = time.perf_counter()
         initial_screenshot_data = controller.capture_phone_screen()
+        timings['截图'] = time.perf_counter() - stage_start
         if initial_screenshot_data is None:
-            print("截图失败，退出检测")
-            return
+            executor.shutdown(wait=False)
+            raise Exception("截图失败，退出检测")
             
         # 将初始截图数据转换为numpy数组
+        stage_start = time.perf_counter()
         initial_nparr = np.frombuffer(initial_screenshot_data, np.uint8)
-        initial_img = cv2.imdecode(initial_nparr, cv2.IMREAD_COLOR)
+        with tracing.span("decode", "decode"):
+            initial_img = cv2.imdecode(initial_nparr, cv2.IMREAD_COLOR)
+        timings['解码'] = time.perf_counter() - stage_start
         if initial_img is None:
-            print("无法解析截图数据")
-            return
+            executor.shutdown(wait=False)
+            raise Exception("无法解析截图数据")
+        
+        # 绘制检测框之前记下初始页面的指纹，用于每次点击后返回
+        initial_fp = fingerprint(initial_img)
+        
+        with tracing.span("wait_model", "yolo"):
+            model = model_future.result()
                 
         # 运行检测
-        results = model(initial_img)
+        stage_start = time.perf_counter()
+        with tracing.span("yolo", "yolo"):
+            results = model(initial_img)
+        timings['检测'] = time.perf_counter() - stage_start
+        
+        # 各阶段耗时之和与实际耗时之差即为并行节省的时间
+        elapsed = time.perf_counter() - start
+        print("阶段耗时: " + ", ".join(f"{name} {seconds:.2f} 秒" for name, seconds in timings.items()) +
+              f"; 实际 {elapsed:.2f} 秒, 并行节省 {max(0.0, sum(timings.values()) - elapsed):.2f} 秒")
         
         # 存储所有检测结果
         detected_objects = []
         
-        # 在图片上绘制检测结果
         for r in results:
             boxes = r.boxes
             for box in boxes:
@@ -110,25 +171,31 @@ def test_detection():
                     'confidence': conf,
                     'class': cls
                 })
-                
-                # 绘制边界框
-                cv2.rectangle(initial_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                
-                # 添加标签
-                label = f"Type {cls} ({conf:.2f})"
-                (label_w, label_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-                cv2.rectangle(initial_img, (x1, y1-label_h-10), (x1+label_w, y1), (0, 255, 0), -1)
-                cv2.putText(initial_img, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+        
+        # 同一类别内去重(使用共用的box_utils.nms)，结果按置信度从高到低排列
+        pick = nms([obj['position'] for obj in detected_objects],
+                   [obj['confidence'] for obj in detected_objects], YOLO_OVERLAP_THRESH,
+                   classes=[obj['class'] for obj in detected_objects])
+        detected_objects = [detected_objects[k] for k in pick]
+        
+        # 在图片上绘制检测结果
+        for obj in detected_objects:
+            x1, y1, x2, y2 = obj['position']
+            
+            # 绘制边界框
+            cv2.rectangle(initial_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            
+            # 添加标签
+            label = f"Type {obj['class']} ({obj['confidence']:.2f})"
+            (label_w, label_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+            cv2.rectangle(initial_img, (x1, y1-label_h-10), (x1+label_w, y1), (0, 255, 0), -1)
+            cv2.putText(initial_img, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
         
         if detected_objects:
             # 只在检测到目标时保存结果图片
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             output_path = os.path.join(output_dir, f"detected_{timestamp}.png")
-            cv2.imwrite(output_path, initial_img)
-            print(f"检测结果已保存: {output_path}")
-            
-            # 按置信度排序
-            detected_objects.sort(key=lambda x: x['confidence'], reverse=True)
+            save_future = executor.submit(cv2.imwrite, output_path, initial_img)
             
             # 依次点击每个目标
             for i, obj in enumerate(detected_objects, 1):
@@ -137,22 +204,49 @@ def test_detection():
                 center_y = int((y1 + y2) / 2)
                 
                 print(f"\n点击第 {i} 个目标 (置信度: {obj['confidence']:.2f})")
-                controller.click_position(center_x, center_y)
-                print("等待2秒...")
-                time.sleep(2)
-                
-                # 执行返回主页操作
-                controller.press_home()
-                print("等待2秒...")
-                time.sleep(2)
+                # 每个目标的事件带上目标编号，trace中可以按目标筛选
+                with tracing.tags(app=f"target_{i}"), tracing.span("target", "flow", x=center_x, y=center_y):
+                    # 点击记录到导航图中，返回时可以直接使用已知的路径
+                    NAV_GRAPH.observe(initial_fp)
+                    before = foreground()
+                    tap_time = clock.now()
+                    NAV_GRAPH.perform(tap(center_x, center_y))
+                    # 页面内的点击不一定切换窗口：0.3秒内前台状态没有任何变化就只等画面稳定，
+                    # 不再轮询满2秒(原固定等待时间)
+                    opened = wait_for_app_ready(previous=before, since=tap_time, focus_timeout=2.0,
+                                                focus_grace=0.3, metrics=LAUNCH_METRICS)
+                    if opened['fingerprint'] is not None:
+                        NAV_GRAPH.observe(opened['fingerprint'])
+                    
+                    # 与原流程一样按主页键返回：初始页面是桌面时一步即可回到，比逐步返回少截图和等待；
+                    # 等待画面稳定时已经截图，直接用最后一帧确认，不额外截图。
+                    # 主页键回不到初始页面(如初始页面在应用内)时才按导航图路径或返回键逐步返回
+                    before = foreground()
+                    NAV_GRAPH.perform(HOME)
+                    ready = wait_for_app_ready(previous=before, focus_grace=0.3)
+                    if ready['fingerprint'] is not None:
+                        NAV_GRAPH.observe(ready['fingerprint'])
+                    if ready['fingerprint'] is None or not is_similar(initial_fp, ready['fingerprint']):
+                        ensure_back_to_initial_page(initial_fp)
             
             print(f"\n完成所有目标的点击操作！")
             print(f"共点击了 {len(detected_objects)} 个目标")
+            print(f"导航图: {len(NAV_GRAPH.nodes)} 个页面, 按路径操作 {NAV_GRAPH.stats['path_moves']} 次, "
+                  f"盲目返回 {NAV_GRAPH.stats['fallback_moves']} 次")
+            NAV_GRAPH.save()
+            LAUNCH_METRICS.save()
+            if save_future.result():
+                print(f"检测结果已保存: {output_path}")
         else:
             print("未检测到任何目标")
+        executor.shutdown()
+        return {'targets': len(detected_objects), 'elapsed': time.perf_counter() - start}
             
     except Exception as e:
         print(f"检测过程发生错误: {str(e)}")
+        if raise_errors:
+            raise
+        return None
 
 if __name__ == "__main__":
     test_detection() 
\ No newline at end of file
@@ -6,19 +6,27 @@ from typing import List, Dict, Optional
 import time
 import subprocess
 import os
+import controller
+import tracing
+from box_utils import nms
+from pipeline import FramePrefetcher
 
 class AppUIDetector:
-    def __init__(self, model_path: str = "best.pt", conf_threshold: float = 0.3):
+    def __init__(self, model_path: str = "best.pt", conf_threshold: float = 0.3, overlap_thresh: float = 0.7):
         """
         初始化UI检测器
         Args:
             model_path: YOLO模型路径
             conf_threshold: 置信度阈值
+            overlap_thresh: 同一类别内非极大值抑制的交并比阈值，默认与ultralytics一致；不同类别的元素互不抑制
         """
         self.model = YOLO(model_path)
         self.conf_threshold = conf_threshold
+        self.overlap_thresh = overlap_thresh
         self.click_count = 0
         self.max_clicks = 5
+        # 截图预取器，enable_prefetch()后启用
+        self.prefetcher = None
         
         # 创建imgs文件夹
         self.img_dir = "imgs"
@@ -42,19 +50,22 @@ class AppUIDetector:
                     subprocess.run([adb_command, "shell", "rm", "/sdcard/screen.png"])
                     
                     # 截图
-                    result = subprocess.run([adb_command, "shell", "screencap", "-p", "/sdcard/screen.png"], 
-                                         check=True, capture_output=True)
+                    with tracing.span("capture", "adb"):
+                        result = subprocess.run([adb_command, "shell", "screencap", "-p", "/sdcard/screen.png"], 
+                                             check=True, capture_output=True)
                     if result.returncode != 0:
                         raise Exception(f"截图失败: {result.stderr}")
                     
                     # 拉取文件
-                    result = subprocess.run([adb_command, "pull", "/sdcard/screen.png", "temp_screen.png"],
-                                         check=True, capture_output=True)
+                    with tracing.span("pull", "adb"):
+                        result = subprocess.run([adb_command, "pull", "/sdcard/screen.png", "temp_screen.png"],
+                                             check=True, capture_output=True)
                     if result.returncode != 0:
                         raise Exception(f"拉取文件失败: {result.stderr}")
                     
                     # 读取截图
-                    screenshot = cv2.imread("temp_screen.png")
+                    with tracing.span("decode", "decode"):
+                        screenshot = cv2.imread("temp_screen.png")
                     if screenshot is None or screenshot.size == 0:
                         raise Exception("读取截图失败")
                     
@@ -80,7 +91,7 @@ class AppUIDetector:
                     print(f"第 {attempt+1} 次尝试失败: {str(e)}")
                     if attempt < max_retries - 1:
                         print("等待1秒后重试...")
-                        time.sleep(1)
+                        tracing.sleep(1, "截图重试")
                     else:
                         raise Exception(f"截图失败，已重试 {max_retries} 次")
                         
@@ -88,6 +99,41 @@ class AppUIDetector:
             print(f"获取手机截图失败: {str(e)}")
             return None
 
+    def enable_prefetch(self, device_id: str = None):
+        """
+        开启截图预取：点击后等待界面响应的同时在后台截图和解码，下一次检测不必再等截图
+        Args:
+            device_id: 设备ID（可选）
+        """
+        if self.prefetcher is None:
+            self.prefetcher = FramePrefetcher(lambda: controller.capture_phone_screen(device_id),
+                                              self._decode_screenshot)
+
+    def close(self):
+        """
+        关闭截图预取并打印各阶段耗时
+        """
+        if self.prefetcher is not None:
+            self.prefetcher.print_report()
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def _decode_screenshot(self, data: bytes) -> Optional[np.ndarray]:
+        """
+        解码预取的截图并保存到imgs文件夹(在预取线程中执行)
+        """
+        with tracing.span("decode", "decode"):
+            screenshot = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if screenshot is None or screenshot.shape[0] < 100 or screenshot.shape[1] < 100:
+            print("预取的截图无效")
+            return None
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        img_name = f"screenshot_{self.click_count+1}_{timestamp}.png"
+        img_path = os.path.join(self.img_dir, img_name)
+        cv2.imwrite(img_path, screenshot)
+        print(f"截图已保存: {img_path}")
+        return screenshot
+
     def click_element(self, element: Dict) -> bool:
         """
         点击UI元素
@@ -105,13 +151,18 @@ class AppUIDetector:
             print(f"元素类型: {element['type']}")
             print(f"置信度: {element['confidence']:.4f}")
             
-            subprocess.run(["adb", "shell", "input", "tap", str(center_x), str(center_y)])
+            with tracing.span("tap", "adb", x=center_x, y=center_y):
+                subprocess.run(["adb", "shell", "input", "tap", str(center_x), str(center_y)])
             
             self.click_count += 1
             print(f"点击成功！剩余点击次数：{self.max_clicks - self.click_count}")
             
+            if self.prefetcher is not None:
+                # 点击前截取的帧已过时，预约一帧在等待结束时就绪
+                self.prefetcher.invalidate()
+                self.prefetcher.schedule(2)
             print("等待2秒...")
-            time.sleep(2)
+            tracing.sleep(2, "等待界面响应")
             return True
         except Exception as e:
             print(f"点击失败，详细错误: {str(e)}")
@@ -122,7 +173,11 @@ class AppUIDetector:
         检测UI元素
         """
         if screenshot is None:
-            screenshot = self.capture_phone_screen()
+            if self.prefetcher is not None:
+                frame = self.prefetcher.get()
+                screenshot = frame['prepared'] if frame is not None else None
+            else:
+                screenshot = self.capture_phone_screen()
             if screenshot is None:
                 return []
         
@@ -132,8 +187,11 @@ class AppUIDetector:
         new_w = (w // 32) * 32
         resized = cv2.resize(screenshot, (new_w, new_h))
         
-        results = self.model(resized)
-        return self._parse_results(results)
+        with tracing.span("yolo", "yolo") as span:
+            results = self.model(resized)
+            elements = self._parse_results(results)
+            span.set(elements=len(elements))
+        return elements
         
     def _parse_results(self, results) -> List[Dict]:
         """
@@ -156,8 +214,11 @@ class AppUIDetector:
                     'position': (x1, y1, x2, y2),
                     'confidence': conf
                 })
-                
-        return elements
+        
+        # 同一类别内去重(使用共用的box_utils.nms)，结果按置信度从高到低排列
+        pick = nms([e['position'] for e in elements], [e['confidence'] for e in elements],
+                   self.overlap_thresh, classes=[e['type'] for e in elements])
+        return [elements[k] for k in pick]
 
     def find_element_by_type(self, element_type: int) -> Optional[Dict]:
         """
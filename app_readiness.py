@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import time
+import clock
+import controller
+import tracing
+from screen_fingerprint import decode_fingerprint, same_screen
+# 应用启动就绪检测：通过controller.dumpsys_foreground()(常驻的adb shell)轮询当前焦点窗口和前台Activity，
+# 目标应用一到前台立即返回，再等画面稳定(首帧渲染完成)；记录每个应用从点击到前台、到首帧稳定的耗时
+
+DEFAULT_METRICS_PATH = os.path.join("output", "launch_metrics.json")
+
+_COMPONENT = r"\s([A-Za-z0-9_.]+)/([A-Za-z0-9_.$]+)"
+_FOCUS_RE = re.compile(r"mCurrentFocus=Window\{[^}]*?" + _COMPONENT)
+_FOCUSED_APP_RE = re.compile(r"mFocusedApp=.*?" + _COMPONENT)
+_RESUMED_RE = re.compile(r"(?:mResumedActivity|topResumedActivity)[:=].*?" + _COMPONENT)
+# 启动窗口(Splash Screen)已获得焦点但应用还未绘制自己的界面
+_SPLASH_RE = re.compile(r"mCurrentFocus=Window\{[^}]*?Splash Screen ([A-Za-z0-9_.]+)")
+
+
+def parse_foreground(output: str) -> dict:
+    """
+    解析dumpsys输出
+    Args:
+        output: controller.dumpsys_foreground()的输出
+    Returns:
+        dict: {'window': (包名, Activity)或None, 'focused_app': ..., 'resumed': ..., 'splash': 包名或None}
+    """
+    def component(pattern):
+        match = pattern.search(output)
+        return (match.group(1), match.group(2)) if match else None
+
+    splash = _SPLASH_RE.search(output)
+    return {
+        'window': component(_FOCUS_RE),
+        'focused_app': component(_FOCUSED_APP_RE),
+        'resumed': component(_RESUMED_RE),
+        'splash': splash.group(1) if splash else None
+    }
+
+
+def foreground(device_id: str = None) -> dict:
+    """
+    查询当前前台应用
+    Returns:
+        dict: 见parse_foreground；增加'package'(前台应用的包名)；查询失败时返回None
+    """
+    output = controller.dumpsys_foreground(device_id)
+    if output is None:
+        return None
+    state = parse_foreground(output)
+    # 焦点窗口可能是弹窗或状态栏(没有组件名)，此时以获得焦点的应用或前台Activity为准
+    source = state['window'] or state['focused_app'] or state['resumed']
+    state['package'] = source[0] if source else None
+    return state
+
+
+def _in_front(state: dict, package: str, previous: dict) -> bool:
+    """
+    判断目标应用是否已在前台：焦点窗口属于目标应用(或与点击前不同的应用/Activity)，且不是启动窗口
+    """
+    if state is None or state['window'] is None or state['splash']:
+        return False
+    # 前台Activity已切换但焦点窗口仍停留在旧应用时，还没有真正显示
+    if state['resumed'] is not None and state['resumed'][0] != state['window'][0]:
+        return False
+    if package:
+        return state['window'][0] == package
+    return previous is None or state['window'] != previous.get('window')
+
+
+def _same_state(state: dict, previous: dict) -> bool:
+    """
+    前台状态(焦点窗口、获得焦点的应用、前台Activity)是否与点击前完全相同
+    """
+    return all(state.get(key) == previous.get(key) for key in ('window', 'focused_app', 'resumed', 'splash'))
+
+
+def _capture_fingerprint(device_id: str = None):
+    data = controller.capture_phone_screen(device_id)
+    return decode_fingerprint(data) if data is not None else None
+
+
+def wait_for_app_ready(package: str = None, previous: dict = None, since: float = None,
+                       focus_timeout: float = 5.0, focus_grace: float = None, poll_interval: float = 0.1,
+                       stable_frames: int = 2, render_timeout: float = 3.0,
+                       next_frame=None, device_id: str = None, metrics=None) -> dict:
+    """
+    等待应用启动就绪，替代点击后固定等待：
+    1. 轮询焦点窗口和前台Activity，目标应用到前台即进入下一步(超时或adb不可用时直接进入下一步，
+       单次查询失败时继续轮询)；
+    2. 连续截图，画面连续stable_frames次不变即认为首帧已渲染完成
+    Args:
+        package: 目标应用包名；不知道包名时(如点击桌面图标)以焦点窗口与点击前不同为准
+        previous: 点击前的foreground()结果
+        since: 点击的时间(clock.now())，默认为调用时
+        focus_timeout: 等待应用到前台的最长时间(秒)
+        focus_grace: 提供时，点击后经过该时间(秒)前台状态仍与previous完全相同，即认为这次点击不切换窗口
+                     (如应用内的点击)，直接进入画面稳定判断，不再等满focus_timeout
+        poll_interval: 轮询间隔(秒)
+        stable_frames: 画面需要连续不变的次数
+        render_timeout: 等待画面稳定的最长时间(秒)
+        next_frame: 获取下一帧指纹的函数，如使用截图预取器；默认直接截图
+        device_id: 设备ID
+        metrics: LaunchMetrics，提供时记录本次启动耗时
+    Returns:
+        dict: {'package', 'activity', 'in_front': 是否检测到应用到前台, 'stable': 画面是否稳定,
+               'focus_seconds': 点击到前台的耗时, 'ready_seconds': 点击到画面稳定的耗时, 'polls', 'frames',
+               'fingerprint': 最后一帧的指纹(调用方可直接用它判断当前页面，不必再截图)}
+    """
+    since = clock.now() if since is None else since
+    if next_frame is None:
+        next_frame = lambda: _capture_fingerprint(device_id)
+    result = {'package': None, 'activity': None, 'in_front': False, 'stable': False,
+              'focus_seconds': None, 'ready_seconds': None, 'polls': 0, 'frames': 0, 'fingerprint': None}
+    with tracing.span("wait_for_app_ready", "wait", package=package) as span:
+        # 第一步：焦点窗口
+        deadline = clock.now() + focus_timeout
+        while clock.now() < deadline:
+            state = foreground(device_id)
+            result['polls'] += 1
+            if state is None:
+                # adb不可用时直接进入下一步；单次查询超时等临时失败继续轮询
+                if not controller.shell_available(device_id):
+                    break
+                tracing.sleep(poll_interval, "等待应用到前台")
+                continue
+            if _in_front(state, package, previous):
+                result['package'], result['activity'] = state['window']
+                result['in_front'] = True
+                result['focus_seconds'] = clock.now() - since
+                tracing.instant("app_in_front", "wait", package=result['package'])
+                break
+            if (focus_grace is not None and previous is not None and _same_state(state, previous)
+                    and clock.now() - since >= focus_grace):
+                tracing.instant("focus_unchanged", "wait")
+                break
+            tracing.sleep(poll_interval, "等待应用到前台")
+
+        # 第二步：画面稳定
+        deadline = clock.now() + render_timeout
+        last_fp, unchanged = None, 0
+        while clock.now() < deadline:
+            fp = next_frame()
+            result['frames'] += 1
+            if fp is not None:
+                result['fingerprint'] = fp
+            if fp is not None and last_fp is not None and same_screen(fp, last_fp):
+                unchanged += 1
+                if unchanged >= stable_frames - 1:
+                    result['stable'] = True
+                    break
+            else:
+                unchanged = 0
+            last_fp = fp
+            tracing.sleep(poll_interval, "等待画面稳定")
+        result['ready_seconds'] = clock.now() - since
+        span.set(**{k: v for k, v in result.items() if k not in ('activity', 'fingerprint')})
+
+    if metrics is not None and result['package']:
+        metrics.record(result['package'], result)
+    return result
+
+
+class LaunchMetrics:
+    def __init__(self, path: str = DEFAULT_METRICS_PATH, keep: int = 50):
+        """
+        每个应用的启动耗时统计
+        Args:
+            path: 持久化文件，存在时加载
+            keep: 每个应用保留最近多少次记录
+        """
+        self.path = path
+        self.keep = keep
+        # 包名 -> [{'focus': 秒, 'ready': 秒, 'time': 时间戳}, ...]
+        self.samples = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.samples = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取启动耗时统计失败: {str(e)}")
+
+    def record(self, package: str, result: dict):
+        """
+        记录一次启动
+        Args:
+            package: 包名
+            result: wait_for_app_ready()的返回值
+        """
+        samples = self.samples.setdefault(package, [])
+        samples.append({'focus': result['focus_seconds'], 'ready': result['ready_seconds'],
+                        'time': time.time()})
+        del samples[:-self.keep]
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: {包名: {'launches', 'focus_avg', 'focus_max', 'ready_avg', 'ready_p50', 'ready_max'}}
+        """
+        summary = {}
+        for package, samples in self.samples.items():
+            focus = [s['focus'] for s in samples if s['focus'] is not None]
+            ready = sorted(s['ready'] for s in samples if s['ready'] is not None)
+            summary[package] = {
+                'launches': len(samples),
+                'focus_avg': sum(focus) / len(focus) if focus else None,
+                'focus_max': max(focus) if focus else None,
+                'ready_avg': sum(ready) / len(ready) if ready else None,
+                'ready_p50': ready[len(ready) // 2] if ready else None,
+                'ready_max': ready[-1] if ready else None
+            }
+        return summary
+
+    def print_summary(self):
+        for package, stats in self.summary().items():
+            focus = f"{stats['focus_avg']:.2f}" if stats['focus_avg'] is not None else "-"
+            ready = f"{stats['ready_avg']:.2f}" if stats['ready_avg'] is not None else "-"
+            print(f"{package}: 启动 {stats['launches']} 次, 到前台平均 {focus} 秒, 画面稳定平均 {ready} 秒")
+
+    def save(self, path: str = None):
+        path = path or self.path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.samples, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+# 进程内共享的启动耗时统计
+LAUNCH_METRICS = LaunchMetrics()
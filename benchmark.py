@@ -0,0 +1,400 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+from box_utils import filter_contained_boxes, convert_to_xyxy, nms
+from keyword_index import match_ocr_results, STARTUP_KEYWORDS
+# 性能基准测试：使用合成的手机截图、图标和文字框，不需要连接手机或下载模型
+# 结果保存为JSON，可与基线比较，超过回归阈值时以非零状态退出，用于拦截变慢的改动
+
+# 默认的结果文件和基线文件
+DEFAULT_OUTPUT = "output/benchmark.json"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# 合成截图的尺寸(与常见手机一致)
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 2400
+
+
+def filter_nested_boxes_reference(boxes):
+    """
+    逐对比较的嵌套框过滤(原grounding_dino.filter_nested_boxes实现)，作为正确性和性能的对照
+    """
+    if len(boxes) == 0:
+        return boxes
+
+    boxes = np.array(boxes)
+    filtered_indices = []
+
+    for i in range(len(boxes)):
+        is_container = False
+        box1 = boxes[i]
+        area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+
+        for j in range(len(boxes)):
+            if i != j:
+                box2 = boxes[j]
+                area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+
+                # 检查box1是否包含box2
+                if (box1[0] <= box2[0] and box1[1] <= box2[1] and
+                    box1[2] >= box2[2] and box1[3] >= box2[3] and
+                    area1 > area2):  # 确保大框被过滤
+                    is_container = True
+                    break
+
+        if not is_container:
+            filtered_indices.append(i)
+
+    return boxes[filtered_indices]
+
+
+def make_icon_boxes(count, width=1080, height=2400, seed=0):
+    """
+    生成类似桌面/应用商店页面的检测框：网格排列的图标，部分图标带有包含它的外框(图标+文字)
+    Args:
+        count: 框的数量
+        width: 屏幕宽度
+        height: 屏幕高度
+        seed: 随机种子
+    Returns:
+        np.ndarray: Nx4的(x1,y1,x2,y2)数组
+    """
+    rng = np.random.default_rng(seed)
+    boxes = []
+    while len(boxes) < count:
+        x = rng.uniform(0, width - 120)
+        y = rng.uniform(0, height - 160)
+        size = rng.uniform(60, 110)
+        boxes.append([x, y, x + size, y + size])
+        if rng.random() < 0.3 and len(boxes) < count:
+            # 图标+文字的外框
+            boxes.append([x - 8, y - 8, x + size + 8, y + size + 40])
+        if rng.random() < 0.05 and len(boxes) < count:
+            # 与已有框完全重合的重复框
+            boxes.append(list(boxes[-1]))
+    return np.array(boxes[:count])
+
+
+def _best_time(func, repeat):
+    """
+    多次运行取最短耗时(秒)
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_filter_nested_boxes(sizes=(10, 100, 1000, 10000), reference_limit=1000, repeat=3):
+    """
+    对比排序扫描与逐对比较两种嵌套框过滤的耗时，并校验结果一致
+    Args:
+        sizes: 框的数量
+        reference_limit: 超过该数量时不再运行逐对比较(耗时过长)
+        repeat: 每项重复次数
+    Returns:
+        list: 每项为{'boxes': 数量, 'sweep_ms': 耗时, 'reference_ms': 耗时或None, 'same': 结果是否一致}
+    """
+    results = []
+    for size in sizes:
+        boxes = make_icon_boxes(size, seed=size)
+        sweep_time, sweep_result = _best_time(lambda: filter_contained_boxes(boxes), repeat)
+        record = {'boxes': size, 'sweep_ms': sweep_time * 1000,
+                  'reference_ms': None, 'same': None}
+        if size <= reference_limit:
+            ref_time, ref_result = _best_time(lambda: filter_nested_boxes_reference(boxes), 1)
+            record['reference_ms'] = ref_time * 1000
+            record['same'] = bool(np.array_equal(sweep_result, ref_result))
+        results.append(record)
+    return results
+
+
+def draw_close_icon(img, x, y, size, color=(80, 80, 80)):
+    """
+    在图片上画一个圆圈叉号样式的关闭按钮
+    """
+    cx, cy, r = x + size // 2, y + size // 2, size // 2
+    cv2.circle(img, (cx, cy), r, color, 2)
+    cv2.line(img, (x + size // 4, y + size // 4), (x + 3 * size // 4, y + 3 * size // 4), color, 3)
+    cv2.line(img, (x + 3 * size // 4, y + size // 4), (x + size // 4, y + 3 * size // 4), color, 3)
+
+
+def make_close_template(size=50):
+    """
+    生成关闭按钮模板
+    """
+    template = np.full((size + 10, size + 10, 3), 240, np.uint8)
+    draw_close_icon(template, 5, 5, size)
+    return template
+
+
+def make_screen(seed=0, blocks=30, icons=3):
+    """
+    生成手机尺寸的合成截图：随机色块模拟界面元素，再放置若干不同尺寸的关闭按钮
+    Args:
+        seed: 随机种子
+        blocks: 色块数量
+        icons: 关闭按钮数量
+    Returns:
+        np.ndarray: BGR图片
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((SCREEN_HEIGHT, SCREEN_WIDTH, 3), 240, np.uint8)
+    for _ in range(blocks):
+        x = int(rng.integers(0, SCREEN_WIDTH - 80))
+        y = int(rng.integers(0, SCREEN_HEIGHT - 80))
+        w = int(rng.integers(20, 200))
+        h = int(rng.integers(20, 100))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(img, (x, y), (x + w, y + h), color, -1)
+    for _ in range(icons):
+        size = int(rng.integers(30, 70))
+        draw_close_icon(img, int(rng.integers(0, SCREEN_WIDTH - size)),
+                        int(rng.integers(0, SCREEN_HEIGHT - size)), size)
+    return img
+
+
+def make_ocr_results(count, seed=0):
+    """
+    生成CnOcr格式的合成识别结果，包含关键词、带错字的关键词和普通文字
+    Args:
+        count: 文字框数量
+        seed: 随机种子
+    Returns:
+        list: 每项为{'text': str, 'position': 四个角点}
+    """
+    rng = np.random.default_rng(seed)
+    texts = ["跳过", "跳过 5", "跳迥", "同意并继续", "始终充许", "确定", "取消", "设置",
+             "我的", "首页", "消息", "推荐", "热门", "不同意", "立即下载", "查看详情"]
+    results = []
+    for _ in range(count):
+        x = float(rng.uniform(0, SCREEN_WIDTH - 200))
+        y = float(rng.uniform(0, SCREEN_HEIGHT - 60))
+        w = float(rng.uniform(40, 200))
+        h = float(rng.uniform(20, 60))
+        results.append({
+            'text': texts[int(rng.integers(0, len(texts)))],
+            'position': [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+        })
+    return results
+
+
+def _benchmarks():
+    """
+    定义所有基准测试项
+    Returns:
+        list: 每项为(名称, 准备函数, 重复次数)，准备函数返回被计时的无参函数；
+              依赖缺失时准备函数抛出ImportError，该项被跳过
+    """
+    def template_exhaustive():
+        import test_cross
+        screen, template = make_screen(1), make_close_template()
+        return lambda: test_cross.find_template_matches(screen, template)
+
+    def template_pyramid():
+        import test_cross
+        screen, template = make_screen(1), make_close_template()
+        return lambda: test_cross.find_template_matches(screen, template, mode="pyramid")
+
+    def template_bank():
+        import test_cross
+        screen = make_screen(1)
+        bank = test_cross.TemplateBank({'large': make_close_template(50),
+                                        'small': make_close_template(30)})
+        return lambda: bank.match(screen)
+
+    def nms_dense():
+        rng = np.random.default_rng(0)
+        xy = rng.uniform(0, 1000, (5000, 2))
+        boxes = np.hstack([xy, xy + rng.uniform(20, 80, (5000, 2))])
+        scores = rng.random(5000)
+        return lambda: nms(boxes, scores, 0.3)
+
+    def non_max_suppression_dense():
+        import test_cross
+        rng = np.random.default_rng(0)
+        xy = rng.integers(0, 1000, (5000, 2))
+        boxes = np.hstack([xy, xy + 50]).tolist()
+        scores = rng.random(5000)
+        return lambda: test_cross.non_max_suppression(boxes, scores=scores)
+
+    def filter_nested_1000():
+        boxes = make_icon_boxes(1000, seed=1000)
+        return lambda: filter_contained_boxes(boxes)
+
+    def filter_nested_10000():
+        boxes = make_icon_boxes(10000, seed=10000)
+        return lambda: filter_contained_boxes(boxes)
+
+    def convert_xyxy():
+        boxes = np.random.default_rng(0).random((1000, 4))
+        return lambda: convert_to_xyxy(boxes, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    def compare_screenshots():
+        # 与appQuery.compare_screenshots相同的比较；不导入appQuery，避免依赖ultralytics
+        from screen_fingerprint import fingerprint, is_similar
+        img1 = make_screen(2)
+        img2 = img1.copy()
+        return lambda: is_similar(fingerprint(img1), fingerprint(img2), 0.95)
+
+    def screen_fingerprint_compare():
+        from screen_fingerprint import decode_fingerprint, fingerprint, is_similar
+        initial_fp = fingerprint(make_screen(2))
+        data = cv2.imencode(".png", make_screen(2))[1].tobytes()
+        # ensure_back_to_initial_page每次尝试的开销：低分辨率解码、计算指纹并比较
+        return lambda: is_similar(initial_fp, decode_fingerprint(data))
+
+    def text_matching():
+        results = make_ocr_results(300)
+        return lambda: match_ocr_results(results, STARTUP_KEYWORDS, max_distance=1)
+
+    def text_matching_many_keywords():
+        results = make_ocr_results(300)
+        keywords = STARTUP_KEYWORDS + [f"关键词{i}按钮" for i in range(300)]
+        return lambda: match_ocr_results(results, keywords, max_distance=1)
+
+    return [
+        ("template_exhaustive", template_exhaustive, 3),
+        ("template_pyramid", template_pyramid, 3),
+        ("template_bank", template_bank, 3),
+        ("nms_dense_5000", nms_dense, 5),
+        ("non_max_suppression_5000", non_max_suppression_dense, 5),
+        ("filter_nested_1000", filter_nested_1000, 5),
+        ("filter_nested_10000", filter_nested_10000, 3),
+        ("convert_to_xyxy_1000", convert_xyxy, 20),
+        ("compare_screenshots", compare_screenshots, 10),
+        ("screen_fingerprint_compare", screen_fingerprint_compare, 10),
+        ("text_matching_300", text_matching, 10),
+        ("text_matching_300x300", text_matching_many_keywords, 10),
+    ]
+
+
+def run_benchmarks(only=None):
+    """
+    运行基准测试
+    Args:
+        only: 只运行名称包含这些字符串的测试项
+    Returns:
+        dict: {'meta': 环境信息, 'results': {名称: {'ms': 最短耗时, 'repeat': 次数}},
+               'skipped': {名称: 缺少的依赖}}
+    """
+    results = {}
+    skipped = {}
+    for name, setup, repeat in _benchmarks():
+        if only and not any(key in name for key in only):
+            continue
+        try:
+            func = setup()
+        except ImportError as e:
+            print(f"{name:<28} 跳过(缺少依赖: {str(e)})")
+            skipped[name] = str(e)
+            continue
+        func()  # 预热，排除首次调用的缓存建立等开销
+        best, _ = _best_time(func, repeat)
+        results[name] = {'ms': best * 1000, 'repeat': repeat}
+        print(f"{name:<28} {best * 1000:10.3f} ms")
+    return {
+        'meta': {
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'results': results,
+        'skipped': skipped
+    }
+
+
+def compare_with_baseline(current, baseline, threshold=0.2):
+    """
+    与基线比较，找出变慢超过阈值的测试项
+    Args:
+        current: 本次结果(run_benchmarks的返回值)
+        baseline: 基线结果
+        threshold: 允许的相对变慢比例，0.2表示慢20%以内不算回归
+    Returns:
+        list: 回归项，每项为{'name', 'baseline_ms', 'current_ms', 'ratio'}
+    """
+    regressions = []
+    for name, record in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None or base['ms'] <= 0:
+            continue
+        ratio = record['ms'] / base['ms']
+        status = "回归" if ratio > 1 + threshold else "正常"
+        print(f"{name:<28} 基线 {base['ms']:10.3f} ms  本次 {record['ms']:10.3f} ms  {ratio:6.2f}x  {status}")
+        if ratio > 1 + threshold:
+            regressions.append({'name': name, 'baseline_ms': base['ms'],
+                                'current_ms': record['ms'], 'ratio': ratio})
+    return regressions
+
+
+def _save_json(data, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="视觉热点路径的性能基准测试")
+    parser.add_argument("--only", nargs="*", help="只运行名称包含这些字符串的测试项")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="结果JSON文件")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线JSON文件")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="回归阈值(相对变慢比例)")
+    parser.add_argument("--ci", action="store_true", default=bool(os.environ.get("CI")),
+                        help="CI模式(设置了环境变量CI时默认开启)：没有基线文件或基线中的测试项未运行时视为失败")
+    parser.add_argument("--nested-scaling", action="store_true",
+                        help="只运行嵌套框过滤在不同框数下的对比")
+    args = parser.parse_args(argv)
+
+    if args.nested_scaling:
+        print("嵌套框过滤:")
+        for r in bench_filter_nested_boxes():
+            ref = f"{r['reference_ms']:.2f} ms" if r['reference_ms'] is not None else "跳过"
+            print(f"{r['boxes']:>6} 个框  排序扫描: {r['sweep_ms']:.2f} ms  逐对比较: {ref}  结果一致: {r['same']}")
+        return 0
+
+    current = run_benchmarks(args.only)
+    _save_json(current, args.output)
+    print(f"结果已保存: {args.output}")
+
+    if args.save_baseline:
+        _save_json(current, args.baseline)
+        print(f"基线已保存: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"没有找到基线文件 {args.baseline}，使用 --save-baseline 生成")
+        # CI中没有基线时不能放行，否则回归检查形同虚设
+        return 1 if args.ci else 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(current, baseline, args.threshold)
+    if regressions:
+        print(f"发现 {len(regressions)} 项性能回归")
+        return 1
+    if args.ci:
+        # 基线中有、本次却没有运行(如缺少依赖被跳过)的测试项同样视为失败
+        missing = [name for name in baseline.get('results', {})
+                   if name not in current['results'] and not (args.only and not any(key in name for key in args.only))]
+        if missing:
+            print(f"基线中的 {len(missing)} 项没有运行: {', '.join(missing)}")
+            return 1
+    print("没有发现性能回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import numpy as np
+# 检测框通用工具：各检测器(模板匹配、YOLO、GroundingDINO)共用的非极大值抑制等操作
+
+
+def convert_to_xyxy(boxes, img_width, img_height):
+    """
+    将[center_x, center_y, width, height]格式转换为[x1, y1, x2, y2]格式
+    """
+    boxes = np.array(boxes)
+    boxes_xyxy = np.zeros_like(boxes)
+    
+    # 转换到像素坐标
+    boxes_xyxy[:, 0] = (boxes[:, 0] - boxes[:, 2]/2) * img_width  # x1
+    boxes_xyxy[:, 1] = (boxes[:, 1] - boxes[:, 3]/2) * img_height # y1
+    boxes_xyxy[:, 2] = (boxes[:, 0] + boxes[:, 2]/2) * img_width  # x2
+    boxes_xyxy[:, 3] = (boxes[:, 1] + boxes[:, 3]/2) * img_height # y2
+    
+    return boxes_xyxy
+
+
+def nms(boxes, scores, overlap_thresh=0.3, classes=None, metric="iou", max_output=None):
+    """
+    按得分从高到低的非极大值抑制
+    Args:
+        boxes: 边界框，格式为[[x1,y1,x2,y2],...]或Nx4数组
+        scores: 每个框的得分
+        overlap_thresh: 重叠阈值，超过阈值的低分框被抑制
+        classes: 每个框的类别，提供时只在同类别内抑制
+        metric: "iou"为交并比；"overlap"为交集占被比较框自身面积的比例，
+                可以抑制落在高分框内部的小框
+        max_output: 最多保留的框数
+    Returns:
+        np.ndarray: 保留下来的框的下标，按得分从高到低排列
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if classes is not None:
+        # 不同类别的框平移到互不重叠的区域，一次计算即可完成分类别抑制
+        classes = np.asarray(classes).reshape(-1)
+        _, class_ids = np.unique(classes, return_inverse=True)
+        offset = boxes.max() - boxes.min() + 1
+        boxes = boxes + (class_ids * offset)[:, None]
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    # 稳定排序保证得分相同时结果确定
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if max_output is not None and len(keep) >= max_output:
+            break
+        rest = order[1:]
+
+        w = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        h = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = w * h
+        if metric == "overlap":
+            denom = areas[rest]
+        else:
+            denom = areas[i] + areas[rest] - inter
+        overlap = np.divide(inter, denom, out=np.zeros_like(inter), where=denom > 0)
+
+        order = rest[overlap <= overlap_thresh]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def filter_contained_boxes(boxes, tolerance=0.0):
+    """
+    过滤掉包含其他框的大框：先按x1排序，每个框只与x1落在其横向范围内的框比较
+    Args:
+        boxes: 边界框，格式为[[x1,y1,x2,y2],...]或Nx4数组
+        tolerance: 包含判断的容差(像素)，大框四边各放宽tolerance后仍包含小框即视为包含
+    Returns:
+        np.ndarray: 过滤后的框，保持原有顺序；与逐对比较的结果一致，
+                    面积相等的框互不过滤
+    """
+    if len(boxes) == 0:
+        return boxes
+
+    boxes = np.array(boxes)
+    n = len(boxes)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+
+    order = np.argsort(x1, kind="stable")
+    sorted_x1 = x1[order]
+    # 被包含的框满足 x1_i - tol <= x1_j <= x2_j <= x2_i + tol，只需检查这一段
+    lo = np.searchsorted(sorted_x1, x1 - tolerance, side="left")
+    hi = np.searchsorted(sorted_x1, x2 + tolerance, side="right")
+
+    is_container = np.zeros(n, dtype=bool)
+    for i in range(n):
+        if hi[i] - lo[i] <= 1:
+            continue
+        cand = order[lo[i]:hi[i]]
+        inside = ((y1[i] - tolerance <= y1[cand]) &
+                  (x2[i] + tolerance >= x2[cand]) &
+                  (y2[i] + tolerance >= y2[cand]) &
+                  (x1[i] - tolerance <= x1[cand]) &
+                  (areas[i] > areas[cand]))  # 面积严格更大才算包含，同时排除自身
+        is_container[i] = inside.any()
+
+    return boxes[~is_container]
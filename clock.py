@@ -0,0 +1,64 @@
+import threading
+import time
+# 流程计时时钟：等待界面响应、轮询超时、画面静止时长等与设备交互相关的计时和等待都经过这里；
+# 会话回放时安装虚拟时钟，等待不再实际发生，时间只随等待推进，回放结果与机器快慢无关
+
+
+class VirtualClock:
+    def __init__(self, start: float = 0.0):
+        """
+        虚拟时钟：now()返回的时间只在sleep()时推进
+        Args:
+            start: 起始时间(秒)
+        """
+        self._now = start
+        self._lock = threading.Lock()
+        # 累计跳过的等待时间(秒)
+        self.slept = 0.0
+
+    def now(self) -> float:
+        return self._now
+
+    def sleep(self, seconds: float):
+        seconds = max(0.0, seconds)
+        with self._lock:
+            self._now += seconds
+            self.slept += seconds
+
+
+# 当前安装的虚拟时钟，None表示使用真实时间
+_virtual = None
+
+
+def now() -> float:
+    """
+    当前时间(秒)，与time.perf_counter()一样只用于计算时间差
+    """
+    virtual = _virtual
+    return time.perf_counter() if virtual is None else virtual.now()
+
+
+def sleep(seconds: float):
+    """
+    等待指定时间；安装虚拟时钟时立即返回并推进虚拟时间
+    """
+    virtual = _virtual
+    if virtual is None:
+        time.sleep(seconds)
+    else:
+        virtual.sleep(seconds)
+
+
+def is_virtual() -> bool:
+    return _virtual is not None
+
+
+def install(virtual: VirtualClock = None):
+    """
+    安装虚拟时钟(None恢复真实时间)
+    Returns:
+        之前安装的虚拟时钟，用于恢复
+    """
+    global _virtual
+    previous, _virtual = _virtual, virtual
+    return previous
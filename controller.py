@@ -1,7 +1,21 @@
+import queue
 import subprocess
+import threading
 import time
+import uuid
+import tracing
 #通过adb对手机执行的各种操作
 
+def adb_prefix(device_id: str = None) -> list:
+    """
+    adb命令的前缀参数，指定设备时加上-s
+    Args:
+        device_id: 设备ID（可选），不指定时adb使用ANDROID_SERIAL或唯一连接的设备
+    Returns:
+        list: 如["adb", "-s", "emulator-5554"]
+    """
+    return ["adb", "-s", device_id] if device_id else ["adb"]
+
 def capture_phone_screen(device_id: str = None) -> bytes:
     """
     捕获手机屏幕并返回图片数据
@@ -11,13 +25,13 @@ def capture_phone_screen(device_id: str = None) -> bytes:
         bytes: 截图数据
     """
     try:
-        adb_command = "adb"
-        if device_id:
-            adb_command += f" -s {device_id}"
+        adb_command = adb_prefix(device_id)
         
         # 直接获取截图数据
-        result = subprocess.run([adb_command, "exec-out", "screencap", "-p"], 
-                             capture_output=True)
+        with tracing.span("capture", "adb") as span:
+            result = subprocess.run(adb_command + ["exec-out", "screencap", "-p"], 
+                                 capture_output=True)
+            span.set(bytes=len(result.stdout))
         if result.returncode != 0:
             raise Exception(f"截图失败: {result.stderr}")
         
@@ -32,11 +46,10 @@ def click_position(x: int, y: int, device_id: str = None):
     点击指定坐标
     """
     try:
-        adb_command = "adb"
-        if device_id:
-            adb_command += f" -s {device_id}"
+        adb_command = adb_prefix(device_id)
             
-        subprocess.run([adb_command, "shell", "input", "tap", str(x), str(y)])
+        with tracing.span("tap", "adb", x=x, y=y):
+            subprocess.run(adb_command + ["shell", "input", "tap", str(x), str(y)])
         print(f"点击坐标: ({x}, {y})")
         return True
     except Exception as e:
@@ -50,11 +63,10 @@ def press_home(device_id: str = None):
         device_id: 设备ID（可选）
     """
     try:
-        adb_command = "adb"
-        if device_id:
-            adb_command += f" -s {device_id}"
+        adb_command = adb_prefix(device_id)
             
-        subprocess.run([adb_command, "shell", "input", "keyevent", "KEYCODE_HOME"])
+        with tracing.span("keyevent", "adb", key="KEYCODE_HOME"):
+            subprocess.run(adb_command + ["shell", "input", "keyevent", "KEYCODE_HOME"])
         print("执行返回主页操作")
         return True
     except Exception as e:
@@ -68,11 +80,10 @@ def press_back(device_id: str = None):
         device_id: 设备ID（可选）
     """
     try:
-        adb_command = "adb"
-        if device_id:
-            adb_command += f" -s {device_id}"
+        adb_command = adb_prefix(device_id)
             
-        subprocess.run([adb_command, "shell", "input", "keyevent", "KEYCODE_BACK"])
+        with tracing.span("keyevent", "adb", key="KEYCODE_BACK"):
+            subprocess.run(adb_command + ["shell", "input", "keyevent", "KEYCODE_BACK"])
         print("执行返回操作")
         return True
     except Exception as e:
@@ -86,11 +97,10 @@ def press_recent(device_id: str = None):
         device_id: 设备ID（可选）
     """
     try:
-        adb_command = "adb"
-        if device_id:
-            adb_command += f" -s {device_id}"
+        adb_command = adb_prefix(device_id)
             
-        subprocess.run([adb_command, "shell", "input", "keyevent", "KEYCODE_APP_SWITCH"])
+        with tracing.span("keyevent", "adb", key="KEYCODE_APP_SWITCH"):
+            subprocess.run(adb_command + ["shell", "input", "keyevent", "KEYCODE_APP_SWITCH"])
         print("执行显示最近任务操作")
         return True
     except Exception as e:
@@ -106,16 +116,183 @@ def click_position(x: int, y: int, device_id: str = None):
         device_id: 设备ID（可选）
     """
     try:
-        adb_command = "adb"
-        if device_id:
-            adb_command += f" -s {device_id}"
+        adb_command = adb_prefix(device_id)
             
-        subprocess.run([adb_command, "shell", "input", "tap", str(x), str(y)])
+        with tracing.span("tap", "adb", x=x, y=y):
+            subprocess.run(adb_command + ["shell", "input", "tap", str(x), str(y)])
         print(f"点击坐标: ({x}, {y})")
         return True
     except Exception as e:
         print(f"点击失败: {str(e)}")
         return False
+
+
+def launch_app(package: str, device_id: str = None):
+    """
+    启动应用(通过monkey发送启动器Intent，不需要知道启动Activity)
+    Args:
+        package: 应用包名
+        device_id: 设备ID（可选）
+    """
+    try:
+        adb_command = adb_prefix(device_id)
+            
+        with tracing.span("launch_app", "adb", package=package):
+            result = subprocess.run(adb_command + ["shell", "monkey", "-p", package,
+                                                   "-c", "android.intent.category.LAUNCHER", "1"],
+                                    capture_output=True)
+        if result.returncode != 0:
+            raise Exception(result.stderr.decode("utf-8", "ignore"))
+        print(f"启动应用: {package}")
+        return True
+    except Exception as e:
+        print(f"启动应用失败: {str(e)}")
+        return False
+
+
+# adb shell没有可用设备时的错误信息
+_NO_DEVICE_ERRORS = ("no devices", "device not found", "device offline", "unauthorized")
+# 一次查询焦点窗口和前台Activity；在设备上过滤，只传回几行
+FOREGROUND_COMMAND = ("dumpsys window | grep -E 'mCurrentFocus|mFocusedApp'; "
+                      "dumpsys activity activities | grep -E 'mResumedActivity|topResumedActivity'")
+
+
+class AdbShell:
+    def __init__(self, device_id: str = None):
+        """
+        常驻的adb shell会话：每次查询不再启动新的adb进程，轮询一次只需几十毫秒
+        Args:
+            device_id: 设备ID（可选）
+        """
+        self.device_id = device_id
+        self._proc = None
+        self._lines = None
+        self._lock = threading.Lock()
+        # adb不可用(没有安装adb或没有连接设备)时不再反复尝试
+        self.available = True
+
+    def _start(self):
+        self._proc = subprocess.Popen(adb_prefix(self.device_id) + ["shell"],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self._proc, self._lines),
+                         name="adb-shell", daemon=True).start()
+
+    @staticmethod
+    def _read(proc, lines):
+        for line in iter(proc.stdout.readline, b""):
+            lines.put(line.decode("utf-8", "ignore").rstrip("\r\n"))
+        lines.put(None)
+
+    def run(self, command: str, timeout: float = 5.0):
+        """
+        在会话中执行命令
+        Args:
+            command: shell命令
+            timeout: 超时(秒)，超时后重启会话
+        Returns:
+            str: 命令输出；失败时返回None
+        """
+        if not self.available:
+            return None
+        with self._lock:
+            try:
+                if self._proc is None or self._proc.poll() is not None:
+                    self._start()
+                # 以唯一标记判断命令输出结束
+                marker = f"__END_{uuid.uuid4().hex}__"
+                try:
+                    self._proc.stdin.write(f"{command}; echo {marker}\n".encode("utf-8"))
+                    self._proc.stdin.flush()
+                except BrokenPipeError:
+                    # shell已经退出(如没有连接设备)
+                    return self._exited([], drained=False)
+                output = []
+                deadline = time.perf_counter() + timeout
+                while True:
+                    line = self._lines.get(timeout=max(0.0, deadline - time.perf_counter()))
+                    if line is None:
+                        return self._exited(output, drained=True)
+                    if line == marker:
+                        return "\n".join(output)
+                    output.append(line)
+            except FileNotFoundError:
+                print("未找到adb，不再查询")
+                self.available = False
+                return None
+            except Exception as e:
+                print(f"adb shell命令失败: {str(e) or '超时'}")
+                self.close()
+                return None
+
+    def _exited(self, output: list, drained: bool):
+        """
+        shell意外退出：没有可用设备时标记为不可用，之后不再启动adb进程；其他原因下次查询时重启
+        """
+        if not drained:
+            # 读出退出前的输出(错误信息)
+            try:
+                while True:
+                    line = self._lines.get(timeout=1.0)
+                    if line is None:
+                        break
+                    output.append(line)
+            except queue.Empty:
+                pass
+        self._proc = None
+        message = " ".join(output)
+        if any(error in message for error in _NO_DEVICE_ERRORS):
+            print(f"adb没有可用的设备，不再查询: {message}")
+            self.available = False
+            return None
+        raise Exception(f"adb shell已退出: {message}")
+
+    def close(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+            self._proc = None
+
+
+_SHELLS = {}
+_SHELLS_LOCK = threading.Lock()
+
+
+def get_shell(device_id: str = None) -> AdbShell:
+    """
+    获取设备的常驻shell会话，同一设备在进程内共用一个
+    """
+    with _SHELLS_LOCK:
+        if device_id not in _SHELLS:
+            _SHELLS[device_id] = AdbShell(device_id)
+        return _SHELLS[device_id]
+
+
+def dumpsys_foreground(device_id: str = None) -> str:
+    """
+    通过常驻的adb shell查询焦点窗口和前台Activity(由app_readiness.parse_foreground解析)；
+    与截图和点击一样经过controller，会话录制和回放可以替换它
+    Args:
+        device_id: 设备ID（可选）
+    Returns:
+        str: dumpsys输出；查询失败时返回None
+    """
+    with tracing.span("dumpsys", "adb"):
+        return get_shell(device_id).run(FOREGROUND_COMMAND)
+
+
+def shell_available(device_id: str = None) -> bool:
+    """
+    常驻adb shell是否可用：没有安装adb或没有连接设备后返回False，调用方不必再等待查询结果
+    Args:
+        device_id: 设备ID（可选）
+    """
+    return get_shell(device_id).available
+
+
 '''
 下面的代码是对上面函数的测试
 '''
@@ -128,17 +305,17 @@ def test_operations():
         # 返回主页
         press_home()
         print("等待2秒...")
-        time.sleep(2)
+        tracing.sleep(2)
         
         # 显示最近任务
         press_recent()
         print("等待2秒...")
-        time.sleep(2)
+        tracing.sleep(2)
         
         # 返回
         press_back()
         print("等待2秒...")
-        time.sleep(2)
+        tracing.sleep(2)
         
         print("操作测试完成")
         
@@ -146,4 +323,4 @@ def test_operations():
         print(f"测试过程发生错误: {str(e)}")
 
 if __name__ == "__main__":
-    test_operations()
\ No newline at end of file
+    test_operations()
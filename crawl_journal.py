@@ -0,0 +1,184 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+# 图标遍历日志：用SQLite记录每次遍历的检测结果和每个目标的访问状态、耗时，进程中断后可以从第一个未完成的目标继续
+
+DEFAULT_JOURNAL_PATH = os.path.join("output", "crawl_journal.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawls (
+    crawl_id TEXT PRIMARY KEY,
+    device_id TEXT,
+    boxes TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    crawl_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    duration REAL,
+    outcome TEXT,
+    PRIMARY KEY (crawl_id, idx)
+);
+"""
+
+
+class CrawlJournal:
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH, crawl_id: str = "default",
+                 device_id: str = None, max_attempts: int = 2):
+        """
+        打开(或新建)遍历日志
+        Args:
+            path: SQLite数据库文件
+            crawl_id: 遍历任务名称，多台设备共用一个数据库时各自使用不同的名称
+            device_id: 设备ID，仅作记录
+            max_attempts: 每个目标最多尝试的次数，反复导致中断的目标达到次数后不再重试
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.crawl_id = crawl_id
+        self.device_id = device_id
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # 每次写入都立即提交，进程崩溃时已记录的状态不会丢失
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def detections(self):
+        """
+        获取本次遍历已保存的检测框
+        Returns:
+            list: [[x1,y1,x2,y2],...]；尚未开始遍历时返回None
+        """
+        rows = self._execute("SELECT boxes FROM crawls WHERE crawl_id=?", (self.crawl_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def start(self, boxes):
+        """
+        开始新的遍历：保存检测框并为每个框建立待访问记录，同名的旧记录被覆盖
+        Args:
+            boxes: 过滤后的检测框 [[x1,y1,x2,y2],...]
+        """
+        boxes = [[float(v) for v in box[:4]] for box in boxes]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM targets WHERE crawl_id=?", (self.crawl_id,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO crawls (crawl_id, device_id, boxes, created, finished) "
+                    "VALUES (?, ?, ?, ?, NULL)",
+                    (self.crawl_id, self.device_id, json.dumps(boxes), time.time()))
+                self._conn.executemany(
+                    "INSERT INTO targets (crawl_id, idx, x, y) VALUES (?, ?, ?, ?)",
+                    [(self.crawl_id, idx, int((box[0] + box[2]) / 2), int((box[1] + box[3]) / 2))
+                     for idx, box in enumerate(boxes)])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def pending(self) -> list:
+        """
+        获取尚未完成的目标下标，按遍历顺序排列；上次中断时正在访问的目标也包含在内
+        """
+        # 多次访问都导致中断的目标记为失败，避免恢复后反复卡在同一个目标上
+        self._execute(
+            "UPDATE targets SET status='failed', outcome=? WHERE crawl_id=? "
+            "AND status='running' AND attempts>=?",
+            (json.dumps({'error': "多次访问均未完成"}, ensure_ascii=False),
+             self.crawl_id, self.max_attempts))
+        rows = self._execute(
+            "SELECT idx FROM targets WHERE crawl_id=? AND status NOT IN ('done', 'failed') "
+            "AND attempts < ? ORDER BY idx", (self.crawl_id, self.max_attempts))
+        return [row[0] for row in rows]
+
+    def mark_started(self, idx: int):
+        """
+        记录开始访问某个目标
+        """
+        self._execute(
+            "UPDATE targets SET status='running', attempts=attempts+1, started=? "
+            "WHERE crawl_id=? AND idx=?", (time.time(), self.crawl_id, idx))
+
+    def _finish(self, idx: int, status: str, duration: float, outcome):
+        self._execute(
+            "UPDATE targets SET status=?, finished=?, duration=?, outcome=? "
+            "WHERE crawl_id=? AND idx=?",
+            (status, time.time(), duration,
+             json.dumps(outcome, ensure_ascii=False) if outcome is not None else None,
+             self.crawl_id, idx))
+
+    def mark_done(self, idx: int, duration: float, outcome=None):
+        """
+        记录目标访问完成
+        Args:
+            idx: 目标下标
+            duration: 访问耗时(秒)
+            outcome: 访问结果(可JSON序列化)，例如启动项处理的统计
+        """
+        self._finish(idx, 'done', duration, outcome)
+
+    def mark_failed(self, idx: int, duration: float, error: str):
+        """
+        记录目标访问失败，失败的目标在恢复时不再重试
+        """
+        self._finish(idx, 'failed', duration, {'error': error})
+
+    def finish(self):
+        """
+        记录整个遍历完成
+        """
+        self._execute("UPDATE crawls SET finished=? WHERE crawl_id=?", (time.time(), self.crawl_id))
+
+    def is_complete(self) -> bool:
+        rows = self._execute("SELECT finished FROM crawls WHERE crawl_id=?", (self.crawl_id,))
+        return bool(rows) and rows[0][0] is not None
+
+    def reset(self):
+        """
+        删除本次遍历的全部记录，下次遍历重新检测
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM targets WHERE crawl_id=?", (self.crawl_id,))
+            self._conn.execute("DELETE FROM crawls WHERE crawl_id=?", (self.crawl_id,))
+
+    def summary(self) -> dict:
+        """
+        统计各状态的目标数和访问耗时
+        Returns:
+            dict: {'total', 'done', 'failed', 'pending', 'total_seconds', 'avg_seconds'}
+        """
+        rows = self._execute(
+            "SELECT status, COUNT(*), COALESCE(SUM(duration), 0) FROM targets "
+            "WHERE crawl_id=? GROUP BY status", (self.crawl_id,))
+        counts = {status: (count, seconds) for status, count, seconds in rows}
+        done = counts.get('done', (0, 0.0))
+        failed = counts.get('failed', (0, 0.0))
+        total = sum(count for count, _ in counts.values())
+        seconds = done[1] + failed[1]
+        visited = done[0] + failed[0]
+        return {
+            'total': total,
+            'done': done[0],
+            'failed': failed[0],
+            'pending': total - visited,
+            'total_seconds': seconds,
+            'avg_seconds': seconds / visited if visited else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,420 @@
+import argparse
+import io
+import ipaddress
+import json
+import os
+import queue
+import secrets
+import socket
+import struct
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import cv2
+import numpy as np
+from box_utils import convert_to_xyxy
+# GroundingDINO常驻推理服务：模型只加载一次，多个客户端(多台设备的进程)通过本地端口提交图片和提示词，
+# 服务端把同时到达的请求合并成一批推理。
+# 消息为JSON头+原始图片字节，不使用pickle，连接方无法借消息在服务端执行代码；
+# 连接认证密钥为每台机器随机生成的密钥文件(仅当前用户可读)
+
+DEFAULT_ADDRESS = ("127.0.0.1", 6010)
+# 客户端通过该环境变量指定服务地址，格式为host:port；设为"off"时不使用服务
+SERVER_ENV = "GDINO_SERVER"
+# 通过该环境变量显式指定认证密钥；监听非本机地址时必须显式指定
+AUTHKEY_ENV = "GDINO_AUTHKEY"
+DEFAULT_AUTHKEY_PATH = os.path.join(os.path.expanduser("~"), ".appauto", "gdino_authkey")
+# 单条消息的大小上限，超出时断开连接
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+def read_authkey(path: str = DEFAULT_AUTHKEY_PATH) -> bytes:
+    """
+    只读地获取认证密钥(客户端使用)：优先使用环境变量GDINO_AUTHKEY，否则读取密钥文件，不创建任何文件
+    Args:
+        path: 密钥文件
+    Returns:
+        bytes: 密钥；没有密钥(服务从未在本机启动过)时返回None
+    """
+    value = os.environ.get(AUTHKEY_ENV)
+    if value:
+        return value.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_authkey(path: str = DEFAULT_AUTHKEY_PATH) -> bytes:
+    """
+    获取认证密钥(服务端使用)：同read_authkey，密钥文件不存在时随机生成(权限0600)
+    Args:
+        path: 密钥文件
+    Returns:
+        bytes: 密钥
+    """
+    for _ in range(2):
+        key = read_authkey(path)
+        if key:
+            return key
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        key = secrets.token_hex(32).encode("ascii")
+        try:
+            # O_EXCL：多个进程同时生成时只有一个写入，其余进程重新读取
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            continue
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+    raise Exception(f"无法读取认证密钥文件: {path}")
+
+
+def is_loopback(host: str) -> bool:
+    """
+    判断监听地址是否只允许本机连接
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def send_message(conn, header: dict, payload: bytes = b""):
+    """
+    发送一条消息：4字节头长度 + JSON头 + 原始字节
+    """
+    head = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    conn.send_bytes(struct.pack("!I", len(head)) + head + payload)
+
+
+def recv_message(conn):
+    """
+    接收一条消息
+    Returns:
+        tuple: (头dict, 原始字节)
+    Raises:
+        EOFError: 连接已关闭
+        ValueError: 消息格式错误
+    """
+    data = conn.recv_bytes(MAX_MESSAGE_BYTES)
+    if len(data) < 4:
+        raise ValueError("消息过短")
+    (length,) = struct.unpack("!I", data[:4])
+    header = json.loads(data[4:4 + length].decode("utf-8"))
+    if not isinstance(header, dict):
+        raise ValueError("消息头格式错误")
+    return header, data[4 + length:]
+
+
+def _to_list(value):
+    """
+    将tensor/ndarray等转换为普通列表
+    """
+    if value is None:
+        return None
+    if hasattr(value, "detach"):
+        value = value.detach().cpu().numpy()
+    return np.asarray(value).tolist()
+
+
+def parse_output(output, img_width, img_height):
+    """
+    将管道输出转换为像素坐标的检测结果
+    Args:
+        output: grounding-dino-task管道输出
+        img_width: 图片宽度
+        img_height: 图片高度
+    Returns:
+        dict: {'boxes': [[x1,y1,x2,y2],...], 'scores': [...], 'phrases': [...]}
+    """
+    boxes = np.array(_to_list(output['boxes']), dtype=np.float64).reshape(-1, 4)
+    scores = _to_list(output.get('scores', output.get('logits')))
+    phrases = output.get('phrases', output.get('labels'))
+    return {
+        'boxes': convert_to_xyxy(boxes, img_width, img_height).tolist() if len(boxes) else [],
+        'scores': scores if scores is not None else [],
+        'phrases': list(phrases) if phrases is not None else []
+    }
+
+
+class DinoServer:
+    def __init__(self, address=DEFAULT_ADDRESS, authkey: bytes = None,
+                 max_batch: int = 4, max_wait: float = 0.05):
+        """
+        初始化推理服务
+        Args:
+            address: 监听地址(host, port)
+            authkey: 连接认证密钥，默认为load_authkey()
+            max_batch: 每批最多合并的请求数
+            max_wait: 第一个请求到达后最多等待多久凑批(秒)，限制批处理带来的额外延迟
+        """
+        self.address = address
+        self.authkey = authkey or load_authkey()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._pipe = None
+        self._batch_supported = True
+        self.stats = {'requests': 0, 'batches': 0, 'inference_seconds': 0.0}
+
+    def _infer(self, batch):
+        """
+        对一批请求执行推理，结果写回每个请求
+        """
+        # 延迟导入，只有服务端需要加载模型
+        from grounding_dino import load_pipeline, run_grounding_dino
+        if self._pipe is None:
+            self._pipe = load_pipeline()
+
+        start = time.perf_counter()
+        outputs = None
+        if len(batch) > 1 and self._batch_supported:
+            # 管道支持列表输入时整批推理
+            try:
+                inputs = [{
+                    "IMAGE_PATH": io.BytesIO(req['image']),
+                    "TEXT_PROMPT": req['prompt'],
+                    "BOX_TRESHOLD": req['box_threshold'],
+                    "TEXT_TRESHOLD": req['text_threshold']
+                } for req, _ in batch]
+                outputs = self._pipe(inputs, batch_size=len(inputs))
+                if not isinstance(outputs, list) or len(outputs) != len(batch):
+                    # 管道不支持列表输入，之后不再尝试整批推理
+                    print("管道不支持批量输入，改为逐个推理")
+                    self._batch_supported = False
+                    outputs = None
+            except Exception as e:
+                # 可能只是其中一张图片有问题，本批逐个推理，之后的批次仍尝试整批推理
+                print(f"批量推理失败，本批改为逐个推理: {str(e)}")
+                outputs = None
+
+        for k, (req, reply) in enumerate(batch):
+            try:
+                if outputs is not None:
+                    output = outputs[k]
+                else:
+                    img = cv2.imdecode(np.frombuffer(req['image'], np.uint8), cv2.IMREAD_COLOR)
+                    if img is None:
+                        raise Exception("图片解码失败")
+                    output = run_grounding_dino(self._pipe, img, req['prompt'],
+                                                req['box_threshold'], req['text_threshold'],
+                                                req['image'])
+                reply['result'] = parse_output(output, req['width'], req['height'])
+            except Exception as e:
+                reply['result'] = {'error': str(e)}
+            reply['event'].set()
+
+        self.stats['batches'] += 1
+        self.stats['requests'] += len(batch)
+        self.stats['inference_seconds'] += time.perf_counter() - start
+
+    def _batch_loop(self):
+        """
+        收集请求：第一个请求到达后最多等待max_wait秒或凑满max_batch个后一起推理
+        """
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._infer(batch)
+
+    def _handle(self, conn):
+        """
+        处理单个客户端连接，连接可以复用发送多个请求
+        """
+        try:
+            while True:
+                try:
+                    req, image = recv_message(conn)
+                except EOFError:
+                    break
+                except (OSError, ValueError, struct.error) as e:
+                    print(f"收到无法解析的消息，断开连接: {str(e)}")
+                    break
+                if req.get('type') == 'stats':
+                    send_message(conn, dict(self.stats))
+                    continue
+                req['image'] = image
+                reply = {'event': threading.Event()}
+                self._requests.put((req, reply))
+                reply['event'].wait()
+                send_message(conn, reply['result'])
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        """
+        加载模型并开始接受请求
+        """
+        from grounding_dino import load_pipeline
+        print("加载GroundingDINO模型...")
+        self._pipe = load_pipeline()
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"推理服务已启动: {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    # 认证失败或连接中途断开，不影响其他客户端
+                    print(f"拒绝连接: {str(e)}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+class DinoClient:
+    def __init__(self, address=DEFAULT_ADDRESS, authkey: bytes = None):
+        """
+        连接推理服务
+        Args:
+            address: 服务地址(host, port)
+            authkey: 连接认证密钥，默认为read_authkey()
+        Raises:
+            FileNotFoundError: 没有认证密钥，说明本机没有启动过服务
+        """
+        authkey = authkey or read_authkey()
+        if authkey is None:
+            raise FileNotFoundError(f"没有认证密钥(环境变量{AUTHKEY_ENV}或{DEFAULT_AUTHKEY_PATH})，推理服务未启动")
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def detect(self, img, text_prompt="icon", box_threshold=0.25, text_threshold=0.25,
+               image_data=None):
+        """
+        提交一次检测请求
+        Args:
+            img: numpy数组格式的图片
+            text_prompt: 文本提示
+            box_threshold: 框置信度阈值
+            text_threshold: 文本置信度阈值
+            image_data: 已编码的图片数据，提供时直接发送，省去编码
+        Returns:
+            dict: {'boxes': 像素坐标的[[x1,y1,x2,y2],...], 'scores': [...], 'phrases': [...]}
+        Raises:
+            OSError/EOFError: 与服务的连接中断
+            Exception: 服务端处理本次请求出错(如图片无法解码)，连接仍可继续使用
+        """
+        if image_data is None:
+            ok, buf = cv2.imencode(".bmp", img)
+            if not ok:
+                raise Exception("图片编码失败")
+            image_data = buf.tobytes()
+        request = {
+            'width': img.shape[1],
+            'height': img.shape[0],
+            'prompt': text_prompt,
+            'box_threshold': box_threshold,
+            'text_threshold': text_threshold
+        }
+        with self._lock:
+            send_message(self._conn, request, bytes(image_data))
+            result, _ = recv_message(self._conn)
+        if 'error' in result:
+            raise Exception(f"推理服务出错: {result['error']}")
+        return result
+
+    def stats(self) -> dict:
+        """
+        获取服务端的请求数、批次数和推理耗时
+        """
+        with self._lock:
+            send_message(self._conn, {'type': 'stats'})
+            return recv_message(self._conn)[0]
+
+    def close(self):
+        self._conn.close()
+
+
+# 进程内共享的客户端；False表示已通过环境变量关闭
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+# 连接失败后的重试时间和当前退避间隔(秒)
+_RETRY_AT = 0.0
+_RETRY_BACKOFF = 5.0
+_RETRY_MIN = 5.0
+_RETRY_MAX = 300.0
+
+
+def _server_address():
+    value = os.environ.get(SERVER_ENV)
+    if not value:
+        return DEFAULT_ADDRESS
+    if value.lower() == "off":
+        return None
+    host, _, port = value.rpartition(":")
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+def get_client():
+    """
+    获取连接到推理服务的客户端，服务不可用时返回None；
+    连接失败后按退避间隔(5秒起，逐次加倍到5分钟)重新尝试，服务重启后可以自动恢复
+    """
+    global _CLIENT, _RETRY_AT, _RETRY_BACKOFF
+    with _CLIENT_LOCK:
+        if _CLIENT is None and time.monotonic() >= _RETRY_AT:
+            address = _server_address()
+            if address is None:
+                _CLIENT = False
+            else:
+                try:
+                    _CLIENT = DinoClient(address)
+                    _RETRY_BACKOFF = _RETRY_MIN
+                    print(f"已连接推理服务: {address[0]}:{address[1]}")
+                except (OSError, EOFError, AuthenticationError) as e:
+                    print(f"无法连接推理服务，{_RETRY_BACKOFF:.0f}秒后重试: {str(e)}")
+                    _RETRY_AT = time.monotonic() + _RETRY_BACKOFF
+                    _RETRY_BACKOFF = min(_RETRY_BACKOFF * 2, _RETRY_MAX)
+        return _CLIENT or None
+
+
+def reset_client():
+    """
+    连接中断时丢弃当前客户端，退避一段时间后get_client会重新连接
+    """
+    global _CLIENT, _RETRY_AT
+    with _CLIENT_LOCK:
+        if _CLIENT:
+            try:
+                _CLIENT.close()
+            except OSError:
+                pass
+            _CLIENT = None
+            _RETRY_AT = time.monotonic() + _RETRY_BACKOFF
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GroundingDINO常驻推理服务")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--max-batch", type=int, default=4)
+    parser.add_argument("--max-wait", type=float, default=0.05, help="凑批的最长等待时间(秒)")
+    parser.add_argument("--authkey-file", help="认证密钥文件，默认使用环境变量GDINO_AUTHKEY或"
+                                               "~/.appauto/gdino_authkey(不存在时随机生成)")
+    args = parser.parse_args()
+    explicit = args.authkey_file is not None or bool(os.environ.get(AUTHKEY_ENV))
+    if not is_loopback(args.host) and not explicit:
+        # 监听其他机器可以访问的地址时，要求显式提供密钥并在客户端配置同一个密钥
+        parser.error("监听非本机地址时必须通过 --authkey-file 或环境变量GDINO_AUTHKEY 指定认证密钥")
+    if args.authkey_file is not None:
+        with open(args.authkey_file, "rb") as f:
+            authkey = f.read().strip()
+        if not authkey:
+            parser.error(f"认证密钥文件为空: {args.authkey_file}")
+    else:
+        authkey = load_authkey()
+    DinoServer((args.host, args.port), authkey=authkey, max_batch=args.max_batch,
+               max_wait=args.max_wait).serve_forever()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import threading
+import cv2
+import numpy as np
+import tracing
+# 截图数据集的帧存储：把解码后的图片依次写入一个uint8数据文件，另存偏移和尺寸索引；
+# 读取时以内存映射方式访问，重复实验不必再解码PNG，多个进程读取同一数据集时共享页缓存
+
+DATA_NAME = "frames.u8"
+INDEX_NAME = "index.json"
+
+
+class FrameStore:
+    def __init__(self, root: str):
+        """
+        打开(或新建)帧存储
+        Args:
+            root: 存储目录，其中包含数据文件frames.u8和索引index.json
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.data_path = os.path.join(root, DATA_NAME)
+        self.index_path = os.path.join(root, INDEX_NAME)
+        # 名称 -> {'offset', 'shape', 'size', 'mtime_ns'}，size和mtime_ns为源文件的大小和修改时间
+        self.index = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取帧索引失败，重新建立: {str(e)}")
+                self.index = {}
+        if not os.path.exists(self.data_path):
+            open(self.data_path, "wb").close()
+        self._map = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def names(self) -> list:
+        return list(self.index)
+
+    def _mapped(self, end: int):
+        """
+        获取覆盖到end字节的内存映射，追加数据后重新映射
+        """
+        with self._lock:
+            if self._map is None or len(self._map) < end:
+                self._map = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+            return self._map
+
+    def get(self, name: str, copy: bool = False) -> np.ndarray:
+        """
+        读取一帧
+        Args:
+            name: 帧名称(通常为源文件名)
+            copy: 是否返回可写的副本；默认返回只读的内存映射视图
+        Returns:
+            np.ndarray: 图片，不存在时返回None
+        """
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        shape = tuple(entry['shape'])
+        size = int(np.prod(shape))
+        data = self._mapped(entry['offset'] + size)
+        img = data[entry['offset']:entry['offset'] + size].reshape(shape)
+        return np.array(img) if copy else img
+
+    def append(self, name: str, img: np.ndarray, source_path: str = None):
+        """
+        追加一帧；同名帧已存在时索引指向新数据(旧数据保留在文件中，直到compact)
+        Args:
+            name: 帧名称
+            img: uint8图片
+            source_path: 源文件路径，记录其大小和修改时间，用于判断是否需要更新
+        """
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        with open(self.data_path, "ab") as f:
+            offset = f.tell()
+            f.write(img.tobytes())
+        entry = {'offset': offset, 'shape': list(img.shape)}
+        if source_path is not None:
+            stat = os.stat(source_path)
+            entry['size'] = stat.st_size
+            entry['mtime_ns'] = stat.st_mtime_ns
+        self.index[name] = entry
+
+    def is_current(self, name: str, source_path: str) -> bool:
+        """
+        判断存储中的帧是否与源文件一致(大小和修改时间都未变化)
+        """
+        entry = self.index.get(name)
+        if entry is None:
+            return False
+        stat = os.stat(source_path)
+        return entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns
+
+    def save(self):
+        """
+        写入索引
+        """
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def sync(self, input_dir: str, image_files=None, save_every: int = 50) -> int:
+        """
+        把目录中新增或变化的图片解码后加入存储
+        Args:
+            input_dir: 图片目录
+            image_files: 需要同步的文件名，默认为目录中的所有图片
+            save_every: 每加入多少帧写一次索引，中断后已写入的帧不会丢失
+        Returns:
+            int: 新解码加入的帧数
+        """
+        if image_files is None:
+            image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
+            image_files = sorted(f for f in os.listdir(input_dir)
+                                 if any(f.lower().endswith(ext) for ext in image_extensions))
+        added = 0
+        try:
+            for image_file in image_files:
+                input_path = os.path.join(input_dir, image_file)
+                if self.is_current(image_file, input_path):
+                    continue
+                img = cv2.imread(input_path)
+                if img is None:
+                    print(f"无法读取图片: {input_path}")
+                    continue
+                self.append(image_file, img, input_path)
+                added += 1
+                if added % save_every == 0:
+                    self.save()
+        finally:
+            if added:
+                self.save()
+        return added
+
+    def compact(self):
+        """
+        重写数据文件，去掉被替换的旧帧占用的空间
+        """
+        tmp_path = self.data_path + ".tmp"
+        index = {}
+        with open(tmp_path, "wb") as f:
+            for name, entry in self.index.items():
+                img = self.get(name)
+                index[name] = dict(entry, offset=f.tell())
+                f.write(img.tobytes())
+        with self._lock:
+            self._map = None
+        os.replace(tmp_path, self.data_path)
+        self.index = index
+        self.save()
+
+
+def iter_frames(input_dir: str, image_files, frame_store: str = None):
+    """
+    依次读取图片：指定帧存储时先把新增或变化的图片加入存储，之后从存储中读取，不再解码
+    Args:
+        input_dir: 图片目录
+        image_files: 文件名列表
+        frame_store: 帧存储目录，None表示直接用cv2.imread读取
+    Yields:
+        tuple: (文件名, 文件路径, 可写的图片)，读取失败时图片为None
+    """
+    store = None
+    if frame_store:
+        store = FrameStore(frame_store)
+        added = store.sync(input_dir, image_files)
+        print(f"帧存储: {frame_store}，新解码 {added} 帧，共 {len(store)} 帧")
+    for image_file in image_files:
+        input_path = os.path.join(input_dir, image_file)
+        with tracing.span("read_frame", "decode", image=image_file):
+            if store is not None:
+                img = store.get(image_file, copy=True)
+            else:
+                img = cv2.imread(input_path)
+        yield image_file, input_path, img
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把截图目录打包为帧存储")
+    parser.add_argument("input_dir", help="图片目录，如imgs/ads")
+    parser.add_argument("store", help="帧存储目录，如imgs/ads.frames")
+    parser.add_argument("--compact", action="store_true", help="同步后整理数据文件")
+    args = parser.parse_args()
+    store = FrameStore(args.store)
+    added = store.sync(args.input_dir)
+    if args.compact:
+        store.compact()
+    print(f"新解码 {added} 帧，共 {len(store)} 帧")
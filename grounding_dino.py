@@ -2,142 +2,177 @@ import cv2
 import numpy as np
 from modelscope.pipelines import pipeline
 from modelscope.hub.snapshot_download import snapshot_download
+import clock
 import controller
+import tracing
 import time
 import os
+import io
+import tempfile
+import hashlib
+import threading
 from test_cnocr import detect_text_buttons
+from keyword_index import STARTUP_KEYWORDS
+from box_utils import filter_contained_boxes, nms
+# 保留grounding_dino.convert_to_xyxy，兼容从本模块导入的调用方(实现位于box_utils.py)
+from box_utils import convert_to_xyxy
+from layout_cache import LayoutCache
+from crawl_journal import CrawlJournal
+from screen_fingerprint import decode_fingerprint, same_screen
+from pipeline import FramePrefetcher
+from app_readiness import foreground, wait_for_app_ready, LAUNCH_METRICS
 
-def convert_to_xyxy(boxes, img_width, img_height):
-    """
-    将[center_x, center_y, width, height]格式转换为[x1, y1, x2, y2]格式
-    """
-    boxes = np.array(boxes)
-    boxes_xyxy = np.zeros_like(boxes)
-    
-    # 转换到像素坐标
-    boxes_xyxy[:, 0] = (boxes[:, 0] - boxes[:, 2]/2) * img_width  # x1
-    boxes_xyxy[:, 1] = (boxes[:, 1] - boxes[:, 3]/2) * img_height # y1
-    boxes_xyxy[:, 2] = (boxes[:, 0] + boxes[:, 2]/2) * img_width  # x2
-    boxes_xyxy[:, 3] = (boxes[:, 1] + boxes[:, 3]/2) * img_height # y2
-    
-    return boxes_xyxy
-
-def filter_nested_boxes(boxes):
+def filter_nested_boxes(boxes, tolerance=0.0):
     """
     过滤掉包含其他框的大框
     boxes: 边界框列表，格式为 [[x1,y1,x2,y2],...]
+    tolerance: 包含判断的容差(像素)
     返回: 过滤后的框
     """
-    if len(boxes) == 0:
-        return boxes
-    
-    boxes = np.array(boxes)
-    filtered_indices = []
-    
-    for i in range(len(boxes)):
-        is_container = False
-        box1 = boxes[i]
-        area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
-        
-        for j in range(len(boxes)):
-            if i != j:
-                box2 = boxes[j]
-                area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
-                
-                # 检查box1是否包含box2
-                if (box1[0] <= box2[0] and box1[1] <= box2[1] and 
-                    box1[2] >= box2[2] and box1[3] >= box2[3] and
-                    area1 > area2):  # 确保大框被过滤
-                    is_container = True
-                    break
-        
-        if not is_container:
-            filtered_indices.append(i)
-    
-    return boxes[filtered_indices]
+    # 排序后只比较横向范围内的框，避免逐对比较
+    return filter_contained_boxes(boxes, tolerance)
 
-def handle_app_startup(max_attempts=10, interval=3):
+# 容错匹配的置信度低于该值的文字不点击：错一个字的三字关键词(0.67)不够可靠
+STARTUP_MIN_SCORE = 0.75
+
+def startup_prefetcher():
+    """
+    创建启动项处理使用的截图预取器，截图和指纹计算在后台线程中进行
+    """
+    # 以1/4分辨率的灰度图计算指纹，画面未变化时不必完整解码和OCR
+    return FramePrefetcher(controller.capture_phone_screen, decode_fingerprint)
+
+@tracing.traced()
+def handle_app_startup(max_attempts=10, interval=3, min_interval=0.5, settle_time=2.0, timeout=60,
+                       prefetcher=None):
     """
     处理应用启动后的各种弹窗和操作
     包括：开屏广告、登录提示、权限请求等
+    只在画面变化时运行OCR：点击后以min_interval快速轮询，画面静止时间隔逐次加倍到interval；
+    画面静止且没有按钮的时间达到settle_time后才认为处理完成，避免开屏广告加载期间提前退出。
+    OCR进行时下一帧已在后台截取，点击后截取中的旧帧被丢弃
     Args:
-        max_attempts: 最大尝试次数，防止无限循环
-        interval: 每次检测的间隔时间(秒)
+        max_attempts: 最多运行OCR的次数，防止无限循环
+        interval: 最长的轮询间隔(秒)
+        min_interval: 点击或画面变化后的轮询间隔(秒)
+        settle_time: 画面静止且无按钮多久后结束(秒)
+        timeout: 总的处理时间上限(秒)
+        prefetcher: 截图预取器(startup_prefetcher())，调用方可提前预约第一帧；默认新建一个
+    Returns:
+        dict: {'frames': 截图次数, 'ocr_runs': OCR次数, 'clicks': 点击次数,
+               'elapsed': 耗时(秒), 'settled': 是否正常结束}；处理出错时增加'error'
     """
+    stats = {'frames': 0, 'ocr_runs': 0, 'clicks': 0, 'elapsed': 0.0, 'settled': False}
+    start = clock.now()
+    own_prefetcher = prefetcher is None
+    if own_prefetcher:
+        prefetcher = startup_prefetcher()
     try:
-        attempt = 0
-        while attempt < max_attempts:
-            print(f"\n第 {attempt + 1} 次检测...")
-            
-            # 获取屏幕截图
-            screenshot_data = controller.capture_phone_screen()
-            if screenshot_data is None:
+        poll = min_interval
+        last_fp = None
+        # 画面最近一次变化(或点击)的时间
+        changed_at = clock.now()
+        while stats['ocr_runs'] < max_attempts and clock.now() - start < timeout:
+            # 获取屏幕截图(已预约时等待预取的帧)
+            frame = prefetcher.get()
+            if frame is None or frame['data'] is None:
                 print("截图失败，等待后重试")
-                time.sleep(interval)
-                attempt += 1
+                prefetcher.schedule(poll)
                 continue
-                
-            # 转换截图数据
-            nparr = np.frombuffer(screenshot_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            if img is None:
+            stats['frames'] += 1
+            
+            fp = frame['prepared']
+            if fp is None:
                 print("图片解析失败，等待后重试")
-                time.sleep(interval)
-                attempt += 1
+                prefetcher.schedule(poll)
                 continue
-                
-            # 检测文字按钮
-            keywords = [
-                "跳过.*",
-                "确认",
-                "始终允许",
-                "同意.*继续",
-                "确定",
-                "是",
-                "进入",
-                "X",
-                "同意"
-            ]
-            text_buttons = detect_text_buttons(img, keywords)
+            now = clock.now()
             
-            # 如果没有检测到任何按钮，说明处理完成
-            if not text_buttons:
-                print("未检测到需要处理的按钮，处理完成")
-                break
+            if same_screen(fp, last_fp):
+                # 画面静止：没有按钮且静止足够久即处理完成，否则逐步放慢轮询
+                if now - changed_at >= settle_time:
+                    print("画面已稳定且未检测到需要处理的按钮，处理完成")
+                    stats['settled'] = True
+                    break
+                poll = min(poll * 2, interval)
+                prefetcher.schedule(min(poll, settle_time - (now - changed_at)))
+                continue
+            
+            # 画面变化(如开屏广告加载)时快速轮询，下一帧在OCR期间截取
+            poll = min_interval
+            prefetcher.schedule(poll)
             
-            # 点击检测到的按钮
+            # 检测文字按钮
+            last_fp = fp
+            changed_at = now
+            with tracing.span("decode", "decode"):
+                img = cv2.imdecode(np.frombuffer(frame['data'], np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                print("图片解析失败，等待后重试")
+                continue
+            stats['ocr_runs'] += 1
+            print(f"\n第 {stats['ocr_runs']} 次检测...")
+            # 容忍长关键词的一个OCR错字(如"始终充许")，避免误识别导致多轮空转；
+            # 短关键词和'.*'前的部分只做精确匹配，置信度不够的不点击，避免点到普通文字或"不同意"
+            text_buttons = detect_text_buttons(img, STARTUP_KEYWORDS, max_distance=1)
             for button in text_buttons:
-                x1, y1, x2, y2 = button['position']
-                center_x = int((x1 + x2) / 2)
-                center_y = int((y1 + y2) / 2)
-                
-                print(f"点击文字按钮: {button['text']}")
-                controller.click_position(center_x, center_y)
-                time.sleep(1)  # 短暂等待按钮响应
+                if button['score'] < STARTUP_MIN_SCORE:
+                    print(f"忽略置信度不足的文字: {button['text']} (置信度: {button['score']:.2f})")
+            text_buttons = [b for b in text_buttons if b['score'] >= STARTUP_MIN_SCORE]
             
-            # 等待一段时间后进行下一次检测
-            print(f"等待 {interval} 秒后进行下一次检测...")
-            time.sleep(interval)
-            attempt += 1
+            if text_buttons:
+                # 点击检测到的按钮
+                for button in text_buttons:
+                    x1, y1, x2, y2 = button['position']
+                    center_x = int((x1 + x2) / 2)
+                    center_y = int((y1 + y2) / 2)
+                    
+                    print(f"点击文字按钮: {button['text']} (置信度: {button['score']:.2f})")
+                    controller.click_position(center_x, center_y)
+                    stats['clicks'] += 1
+                    tracing.sleep(min_interval, "等待按钮响应")
+                # 点击前截取的帧已过时；点击后即使画面看起来没变也重新检测一次，确认按钮已经消失
+                prefetcher.invalidate()
+                prefetcher.schedule(min_interval)
+                last_fp = None
+                changed_at = clock.now()
         
-        if attempt >= max_attempts:
+        if stats['settled']:
+            print("完成启动项处理")
+        elif stats['ocr_runs'] >= max_attempts:
             print(f"达到最大尝试次数 {max_attempts}，停止处理")
         else:
-            print("完成启动项处理")
+            print(f"启动项处理超时({timeout}秒)，停止处理")
         
     except Exception as e:
         print(f"处理启动项时发生错误: {str(e)}")
+        stats['error'] = str(e)
+    finally:
+        if own_prefetcher:
+            prefetcher.close()
+    
+    stats['elapsed'] = clock.now() - start
+    print(f"启动项处理耗时 {stats['elapsed']:.1f} 秒: 截图 {stats['frames']} 次, "
+          f"OCR {stats['ocr_runs']} 次, 点击 {stats['clicks']} 次")
+    return stats
 
-def click_detected_boxes(filtered_boxes):
+@tracing.traced()
+def click_detected_boxes(filtered_boxes, journal=None):
     """
     按照位置顺序点击检测到的框
     Args:
         filtered_boxes: 过滤后的检测框列表 [[x1,y1,x2,y2],...]
+        journal: 遍历日志(CrawlJournal)，提供时记录每个目标的访问结果，
+                 中断后重新运行会跳过已完成的目标
     """
+    prefetcher = None
     try:
         if len(filtered_boxes) == 0:
             print("没有检测到可点击的目标")
             return
+        
+        if journal is not None and journal.detections() is None:
+            journal.start(filtered_boxes)
             
         # 计算所有框的中心点
         center_points = []
@@ -155,107 +190,535 @@ def click_detected_boxes(filtered_boxes):
         # 按照顺序点击比较难实现，因为同一列的x坐标可能不一样
         #center_points.sort(key=lambda p: (p['x'], p['y']))
         
+        # 有遍历日志时只访问未完成的目标
+        indices = range(len(center_points))
+        if journal is not None:
+            indices = [idx for idx in journal.pending() if idx < len(center_points)]
+            skipped = len(center_points) - len(indices)
+            if skipped:
+                print(f"从遍历日志恢复，跳过已处理的 {skipped} 个目标")
+        
+        # 截图预取：就绪检测和启动项处理共用，截图和指纹计算在后台线程中进行
+        prefetcher = startup_prefetcher()
+        next_frame = lambda: (prefetcher.get() or {}).get('prepared')
+        # 点击前的前台应用(桌面)，用于判断应用是否已启动、是否已回到桌面
+        launcher = foreground()
+        
         # 依次点击每个目标
-        for i, point in enumerate(center_points, 1):
-            print(f"\n点击第 {i} 个目标")
+        for idx in indices:
+            point = center_points[idx]
+            print(f"\n点击第 {idx + 1} 个目标")
             print(f"坐标: ({point['x']}, {point['y']})")
-            
-            # 执行点击
-            controller.click_position(point['x'], point['y'])
-            print("等待2秒...")
-            time.sleep(2)
-            
-            # 处理应用启动相关操作
-            handle_app_startup()
-            
-            # 返回主页
-            controller.press_home()
-            print("等待2秒...")
-            time.sleep(2)
+            # 每个目标的事件带上目标编号，trace中可以按目标筛选
+            with tracing.tags(app=f"target_{idx + 1}"), tracing.span("target", "flow", x=point['x'], y=point['y']):
+                if journal is not None:
+                    journal.mark_started(idx)
+                start = clock.now()
+                
+                try:
+                    # 执行点击，等待应用到前台且首帧画面稳定
+                    tap_time = clock.now()
+                    controller.click_position(point['x'], point['y'])
+                    prefetcher.invalidate()
+                    launch = wait_for_app_ready(previous=launcher, since=tap_time,
+                                                next_frame=next_frame, metrics=LAUNCH_METRICS)
+                    print(f"应用就绪: {launch['package'] or '未知'}，耗时 {launch['ready_seconds']:.2f} 秒")
+                    
+                    # 处理应用启动相关操作
+                    outcome = handle_app_startup(prefetcher=prefetcher)
+                    outcome['launch'] = launch
+                    
+                    # 返回主页，等待桌面回到前台
+                    controller.press_home()
+                    prefetcher.invalidate()
+                    wait_for_app_ready(package=launcher['package'] if launcher else None,
+                                       next_frame=next_frame)
+                except Exception as e:
+                    if journal is None:
+                        raise
+                    print(f"第 {idx + 1} 个目标处理失败: {str(e)}")
+                    journal.mark_failed(idx, clock.now() - start, str(e))
+                    controller.press_home()
+                    prefetcher.invalidate()
+                    continue
+                
+                if journal is not None:
+                    journal.mark_done(idx, clock.now() - start, outcome)
         
         print(f"\n完成所有目标的点击操作！")
-        print(f"共点击了 {len(center_points)} 个目标")
+        print(f"共点击了 {len(indices)} 个目标")
+        prefetcher.print_report()
+        LAUNCH_METRICS.print_summary()
+        LAUNCH_METRICS.save()
+        if journal is not None:
+            journal.finish()
+            summary = journal.summary()
+            print(f"遍历日志: 完成 {summary['done']} 个, 失败 {summary['failed']} 个, "
+                  f"平均每个目标 {summary['avg_seconds']:.1f} 秒")
         
     except Exception as e:
         print(f"点击操作发生错误: {str(e)}")
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
 
-def detect_icons():
+def _temp_dir():
     """
-    使用controller截图并检测图标
+    临时文件目录：优先使用内存文件系统/dev/shm，避免真实的磁盘读写
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+# GroundingDINO管道是否接受文件对象作为IMAGE_PATH，None表示尚未尝试
+_FILE_OBJECT_INPUT = None
+
+def run_grounding_dino(pipe, img, text_prompt="icon", box_threshold=0.25,
+                       text_threshold=0.25, image_data=None):
     """
+    对内存中的图片运行GroundingDINO，不再经过output目录中转
+    Args:
+        pipe: grounding-dino-task管道
+        img: numpy数组格式的图片
+        text_prompt: 文本提示
+        box_threshold: 框置信度阈值
+        text_threshold: 文本置信度阈值
+        image_data: 已编码的图片数据(如截图得到的PNG)，提供时直接使用，省去再次编码
+    Returns:
+        dict: 管道输出
+    """
+    global _FILE_OBJECT_INPUT
+    
+    if image_data is None:
+        # BMP不压缩，编码开销远小于PNG
+        with tracing.span("encode", "decode"):
+            ok, buf = cv2.imencode(".bmp", img)
+        if not ok:
+            raise Exception("图片编码失败")
+        image_data = buf.tobytes()
+    
+    inputs = {
+        "TEXT_PROMPT": text_prompt,
+        "BOX_TRESHOLD": box_threshold,
+        "TEXT_TRESHOLD": text_threshold
+    }
+    
+    # 管道内部用PIL打开IMAGE_PATH，PIL同样接受文件对象
+    if _FILE_OBJECT_INPUT is not False:
+        try:
+            with tracing.span("grounding_dino", "dino", prompt=text_prompt):
+                output = pipe(dict(inputs, IMAGE_PATH=io.BytesIO(image_data)))
+            _FILE_OBJECT_INPUT = True
+            return output
+        except (AttributeError, TypeError, ValueError, OSError) as e:
+            if _FILE_OBJECT_INPUT:
+                raise
+            print(f"管道不支持内存图片输入，改用临时文件: {str(e)}")
+            _FILE_OBJECT_INPUT = False
+    
+    # 回退：写入内存文件系统中的临时文件
+    fd, input_path = tempfile.mkstemp(suffix=".png", dir=_temp_dir())
     try:
-        # 创建output文件夹
-        output_dir = "output"
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            
-        # 使用controller截图
-        screenshot_data = controller.capture_phone_screen()
-        if screenshot_data is None:
-            print("截图失败")
-            return []
-            
-        # 将截图数据转换为numpy数组
-        nparr = np.frombuffer(screenshot_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-            print("无法解析截图数据")
-            return []
-            
-        # 保存截图用于GroundingDINO输入
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        input_path = os.path.join(output_dir, f"screenshot_{timestamp}.png")
-        cv2.imwrite(input_path, img)
-        
-        # 加载模型
-        model_dir = snapshot_download('AI-ModelScope/GroundingDINO')
-        pipe = pipeline('grounding-dino-task', model=model_dir)
-        
-        # 设置输入
-        inputs = {
-            "IMAGE_PATH": input_path,
-            "TEXT_PROMPT": "icon",
-            "BOX_TRESHOLD": 0.25,
-            "TEXT_TRESHOLD": 0.25
-        }
+        with os.fdopen(fd, "wb") as f:
+            f.write(image_data)
+        with tracing.span("grounding_dino", "dino", prompt=text_prompt):
+            return pipe(dict(inputs, IMAGE_PATH=input_path))
+    finally:
+        if os.path.exists(input_path):
+            os.remove(input_path)
+
+# 内容参与模型版本计算的小文件(配置、词表等)的大小上限；更大的文件(权重)只取大小和修改时间
+_REVISION_HASH_LIMIT = 4 * 1024 * 1024
+
+def model_revision(model_dir):
+    """
+    计算模型目录的版本：快照路径在权重或分词器更新后不变，不能作为版本；
+    这里对目录中所有文件的相对路径、大小和修改时间，以及配置、词表等小文件的内容求哈希
+    Args:
+        model_dir: 模型目录
+    Returns:
+        str: 版本哈希
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            rel_path = os.path.relpath(path, model_dir).replace(os.sep, "/")
+            digest.update(f"{rel_path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+            if stat.st_size <= _REVISION_HASH_LIMIT:
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+class PromptEmbeddingCache:
+    def __init__(self, revision, path=None):
+        """
+        文本提示编码缓存：提示词是固定的小词表，同一提示词的文本编码结果可以直接复用
+        Args:
+            revision: 模型版本，作为缓存键的一部分，模型更新后旧缓存自动失效
+            path: 持久化文件，提供时启动即加载，新编码的提示词会写回文件
+        """
+        self.revision = revision
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+        self.lookup_seconds = 0.0
+        if path and os.path.exists(path):
+            self._load()
+    
+    @staticmethod
+    def _key_part(value):
+        """
+        文本编码器的输入(input_ids、attention_mask等)完全由提示词决定，用其内容作为缓存键
+        """
+        if hasattr(value, "detach"):
+            array = value.detach().cpu().numpy()
+            return hashlib.sha1(array.tobytes() + str(array.shape).encode()).hexdigest()
+        return repr(value)
+    
+    def _key(self, args, kwargs):
+        parts = [self._key_part(v) for v in args]
+        parts += [f"{k}={self._key_part(kwargs[k])}" for k in sorted(kwargs)]
+        return f"{self.revision}|" + "|".join(parts)
+    
+    def _load(self):
+        import torch
+        try:
+            data = torch.load(self.path, map_location="cpu")
+            if data.get('revision') == self.revision:
+                self._entries = {k: {'last_hidden_state': v} for k, v in data['entries'].items()}
+                print(f"已加载 {len(self._entries)} 个提示词编码缓存")
+        except Exception as e:
+            print(f"读取提示词编码缓存失败: {str(e)}")
+    
+    def _save(self):
+        import torch
+        entries = {k: v['last_hidden_state'].detach().cpu() for k, v in self._entries.items()}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        torch.save({'revision': self.revision, 'entries': entries}, tmp_path)
+        os.replace(tmp_path, self.path)
+    
+    def install(self, pipe):
+        """
+        包装管道中模型的文本编码器(GroundingDINO的bert)，命中缓存时跳过文本编码
+        Returns:
+            bool: 是否找到并包装了文本编码器
+        """
+        encoder = None
+        for holder in (getattr(pipe, "model", None), getattr(getattr(pipe, "model", None), "model", None)):
+            if holder is not None and hasattr(holder, "bert"):
+                encoder = holder.bert
+                break
+        if encoder is None:
+            print("未找到文本编码器，提示词编码缓存未启用")
+            return False
         
-        # 运行检测
-        output = pipe(inputs)
+        original_forward = encoder.forward
         
-        img_height, img_width = img.shape[:2]
+        def cached_forward(*args, **kwargs):
+            start = time.perf_counter()
+            key = self._key(args, kwargs)
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                device = None
+                for value in list(args) + list(kwargs.values()):
+                    if hasattr(value, "device"):
+                        device = value.device
+                        break
+                hidden = entry['last_hidden_state']
+                if device is not None and hidden.device != device:
+                    # 从文件加载的缓存在CPU上，第一次命中时移到模型所在设备
+                    hidden = hidden.to(device)
+                    entry['last_hidden_state'] = hidden
+                with self._lock:
+                    self.hits += 1
+                    self.lookup_seconds += time.perf_counter() - start
+                return {'last_hidden_state': hidden}
+            
+            output = original_forward(*args, **kwargs)
+            with self._lock:
+                self.misses += 1
+                self.encode_seconds += time.perf_counter() - start
+                self._entries[key] = {'last_hidden_state': output['last_hidden_state'].detach()}
+                if self.path:
+                    self._save()
+            return output
         
-        # 转换框的格式
-        boxes_xyxy = convert_to_xyxy(output['boxes'], img_width, img_height)
+        encoder.forward = cached_forward
+        return True
+    
+    def report(self) -> dict:
+        """
+        统计缓存命中情况，以及按平均编码耗时估算的节省时间
+        """
+        avg_encode = self.encode_seconds / self.misses if self.misses else 0.0
+        avg_lookup = self.lookup_seconds / self.hits if self.hits else 0.0
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'avg_encode_ms': avg_encode * 1000,
+            'avg_hit_ms': avg_lookup * 1000,
+            'saved_ms_per_call': max(0.0, avg_encode - avg_lookup) * 1000,
+            'saved_seconds': max(0.0, avg_encode - avg_lookup) * self.hits
+        }
+
+# 进程内缓存的GroundingDINO管道和提示词编码缓存，只加载一次
+_PIPELINE = None
+_PROMPT_CACHE = None
+
+def load_pipeline(prompt_cache_path=None):
+    """
+    加载GroundingDINO管道，同一进程内只加载一次，并启用提示词编码缓存
+    Args:
+        prompt_cache_path: 提示词编码缓存文件，提供时缓存持久化到磁盘，新进程可以跳过文本编码
+    """
+    global _PIPELINE, _PROMPT_CACHE
+    if _PIPELINE is None:
+        with tracing.span("load_pipeline", "dino"):
+            model_dir = snapshot_download('AI-ModelScope/GroundingDINO')
+            _PIPELINE = pipeline('grounding-dino-task', model=model_dir)
+        # 以模型文件的哈希作为模型版本，权重或分词器更新后持久化的缓存自动失效
+        _PROMPT_CACHE = PromptEmbeddingCache(model_revision(model_dir), prompt_cache_path)
+        _PROMPT_CACHE.install(_PIPELINE)
+    return _PIPELINE
+
+def prompt_cache_report():
+    """
+    返回提示词编码缓存的统计信息，模型尚未加载时返回None
+    """
+    return _PROMPT_CACHE.report() if _PROMPT_CACHE is not None else None
+
+def detect_boxes(img, text_prompt="icon", box_threshold=0.25, text_threshold=0.25,
+                 image_data=None):
+    """
+    检测图片中与文本提示对应的目标；有常驻推理服务时交给服务处理，否则在本进程内加载模型
+    Args:
+        img: numpy数组格式的图片
+        text_prompt: 文本提示
+        box_threshold: 框置信度阈值
+        text_threshold: 文本置信度阈值
+        image_data: 已编码的图片数据(如截图得到的PNG)
+    Returns:
+        dict: {'boxes': 像素坐标的[[x1,y1,x2,y2],...], 'scores': [...], 'phrases': [...]}
+    """
+    # 延迟导入，避免循环依赖
+    import dino_server
+    client = dino_server.get_client()
+    if client is not None:
+        try:
+            with tracing.span("dino_server", "dino", prompt=text_prompt):
+                return client.detect(img, text_prompt, box_threshold, text_threshold, image_data)
+        except (OSError, EOFError) as e:
+            # 只有连接中断才放弃服务(之后按退避间隔重连)；服务端返回的单次处理错误直接抛出，
+            # 不在本进程加载完整模型
+            print(f"推理服务连接中断，改为本地推理: {str(e)}")
+            dino_server.reset_client()
+    
+    output = run_grounding_dino(load_pipeline(), img, text_prompt,
+                                box_threshold, text_threshold, image_data)
+    img_height, img_width = img.shape[:2]
+    return dino_server.parse_output(output, img_width, img_height)
+
+def build_phrase_prompt(phrases):
+    """
+    将多个短语拼接为GroundingDINO的多类别提示词，短语之间以" . "分隔
+    """
+    return " . ".join(p.strip().lower() for p in phrases) + " ."
+
+def _assign_phrase(label, phrases):
+    """
+    将模型输出的短语(可能只是提示词的一部分，如"close")归到最接近的输入短语
+    """
+    label = label.strip().lower()
+    if label in phrases:
+        return label
+    label_words = set(label.split())
+    best, best_score = None, 0.0
+    for phrase in phrases:
+        words = set(phrase.split())
+        overlap = len(words & label_words)
+        if overlap == 0:
+            continue
+        # 重合词数相同时，优先选择被覆盖比例更高(更短)的短语
+        score = overlap + overlap / len(words)
+        if score > best_score:
+            best, best_score = phrase, score
+    return best
+
+def detect_phrases(img, phrases, default_threshold=0.25, text_threshold=0.25,
+                   image_data=None, overlap_thresh=0.5):
+    """
+    一次前向推理同时检测多个短语(如图标、关闭按钮、跳过按钮、同意按钮)，图片只编码一次
+    Args:
+        img: numpy数组格式的图片
+        phrases: 短语列表，或{短语: 框置信度阈值}
+        default_threshold: 未单独指定阈值的短语使用的框置信度阈值
+        text_threshold: 文本置信度阈值
+        image_data: 已编码的图片数据(如截图得到的PNG)
+        overlap_thresh: 同一短语内的非极大值抑制阈值
+    Returns:
+        dict: {短语: [{'position': (x1,y1,x2,y2), 'score': float}, ...]}，每个短语的结果按得分从高到低排列
+    """
+    if not isinstance(phrases, dict):
+        phrases = {phrase: default_threshold for phrase in phrases}
+    thresholds = {p.strip().lower(): t for p, t in phrases.items()}
+    names = list(thresholds.keys())
+    
+    # 以最低阈值运行一次，之后再按各短语自己的阈值过滤
+    output = detect_boxes(img, build_phrase_prompt(names), min(thresholds.values()),
+                          text_threshold, image_data)
+    
+    boxes = np.array(output['boxes'], dtype=np.float64).reshape(-1, 4)
+    scores = np.array(output['scores'], dtype=np.float64).reshape(-1)
+    if len(scores) != len(boxes):
+        scores = np.ones(len(boxes))
+    labels = output['phrases']
+    if len(labels) != len(boxes):
+        if len(names) > 1 and len(boxes) > 0:
+            print("模型输出中没有短语标签，无法区分多个短语")
+        labels = [names[0]] * len(boxes) if len(names) == 1 else [""] * len(boxes)
+    
+    results = {name: [] for name in names}
+    assigned = [_assign_phrase(label, names) for label in labels]
+    keep = [k for k, name in enumerate(assigned)
+            if name is not None and scores[k] >= thresholds[name]]
+    if not keep:
+        return results
+    
+    # 同一短语内做非极大值抑制，不同短语的框互不影响
+    keep = np.array(keep)
+    pick = nms(boxes[keep], scores[keep], overlap_thresh,
+               classes=[assigned[k] for k in keep])
+    for k in keep[pick]:
+        results[assigned[k]].append({
+            'position': tuple(float(v) for v in boxes[k]),
+            'score': float(scores[k])
+        })
+    return results
+
+# 进程内共享的桌面布局缓存
+HOME_LAYOUT_CACHE = LayoutCache()
+
+def detect_home_icons(img, image_data=None, layout_cache=None):
+    """
+    检测桌面图标，桌面布局与缓存中的某一页相同时直接返回缓存的框
+    Args:
+        img: 桌面截图
+        image_data: 已编码的截图数据
+        layout_cache: 布局缓存，默认使用HOME_LAYOUT_CACHE
+    Returns:
+        过滤后的检测框
+    """
+    if layout_cache is None:
+        layout_cache = HOME_LAYOUT_CACHE
+    with tracing.span("layout_lookup", "decode"):
+        fingerprint, cached = layout_cache.lookup(img)
+    if cached is not None:
+        print(f"桌面布局未变化，使用缓存的 {len(cached)} 个图标")
+        return np.array(cached).reshape(-1, 4)
+    
+    # 运行检测(优先使用常驻推理服务)，截图的PNG数据直接作为输入
+    output = detect_boxes(img, "icon", 0.25, 0.25, image_data)
+    boxes_xyxy = np.array(output['boxes']).reshape(-1, 4)
+    
+    # 过滤嵌套框
+    filtered_boxes = filter_nested_boxes(boxes_xyxy)
+    layout_cache.store(fingerprint, filtered_boxes)
+    return filtered_boxes
+
+@tracing.traced()
+def detect_icons(img=None, save_debug=True, click=True, use_layout_cache=True, journal=None,
+                 raise_errors=False):
+    """
+    使用controller截图并检测图标
+    Args:
+        img: 已解码的截图，提供时不再截图
+        save_debug: 是否保存绘制了检测框的结果图片
+        click: 是否依次点击检测到的目标
+        use_layout_cache: 是否使用桌面布局缓存，同一页桌面只运行一次检测
+        journal: 遍历日志(CrawlJournal)，其中有未完成的遍历时直接使用保存的检测框并从中断处继续
+        raise_errors: 截图或检测失败时抛出异常而不是返回空列表，供任务队列区分失败和没有目标
+    Returns:
+        过滤后的检测框
+    """
+    try:
+        output_dir = "output"
+        screenshot_data = None
         
-        # 过滤嵌套框
-        filtered_boxes = filter_nested_boxes(boxes_xyxy)
+        if journal is not None:
+            saved_boxes = journal.detections()
+            if saved_boxes is not None and not journal.is_complete():
+                print(f"恢复未完成的遍历，使用保存的 {len(saved_boxes)} 个检测框")
+                filtered_boxes = np.array(saved_boxes).reshape(-1, 4)
+                if click:
+                    click_detected_boxes(filtered_boxes, journal)
+                return filtered_boxes
+            # 上次遍历已完成，重新检测并开始新的遍历
+            journal.reset()
         
-        # 绘制过滤后的框
-        for box in filtered_boxes:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        if img is None:
+            # 使用controller截图
+            screenshot_data = controller.capture_phone_screen()
+            if screenshot_data is None:
+                raise Exception("截图失败")
+                
+            # 将截图数据转换为numpy数组
+            nparr = np.frombuffer(screenshot_data, np.uint8)
+            with tracing.span("decode", "decode"):
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            if img is None:
+                raise Exception("无法解析截图数据")
         
-        # 保存结果
-        output_path = os.path.join(output_dir, f"grounding_dino_{timestamp}.png")          
-        cv2.imwrite(output_path, img)
-        print(f"检测结果已保存: {output_path}")
+        if use_layout_cache:
+            filtered_boxes = detect_home_icons(img, screenshot_data)
+        else:
+            # 运行检测(优先使用常驻推理服务)，截图的PNG数据直接作为输入
+            output = detect_boxes(img, "icon", 0.25, 0.25, screenshot_data)
+            boxes_xyxy = np.array(output['boxes']).reshape(-1, 4)
+            
+            # 过滤嵌套框
+            filtered_boxes = filter_nested_boxes(boxes_xyxy)
         
-        # 清理临时文件
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        if save_debug:
+            # 创建output文件夹
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            
+            # 在副本上绘制过滤后的框，不修改输入图片
+            debug_img = img.copy()
+            for box in filtered_boxes:
+                x1, y1, x2, y2 = map(int, box)
+                cv2.rectangle(debug_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            
+            # 保存结果
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            output_path = os.path.join(output_dir, f"grounding_dino_{timestamp}.png")
+            cv2.imwrite(output_path, debug_img)
+            print(f"检测结果已保存: {output_path}")
             
         # 在保存结果图片后，添加点击操作
-        if len(filtered_boxes) > 0:
-            print("\n开始执行点击操作...")
-            click_detected_boxes(filtered_boxes)
-        else:
+        if len(filtered_boxes) == 0:
             print("未检测到任何目标")
+        elif click:
+            print("\n开始执行点击操作...")
+            click_detected_boxes(filtered_boxes, journal)
             
         return filtered_boxes
         
     except Exception as e:
         print(f"检测过程发生错误: {str(e)}")
+        if raise_errors:
+            raise
         return []
 
 if __name__ == "__main__":
-    detect_icons()
+    # 遍历状态记录在output/crawl_journal.db中，中断后重新运行会从未完成的目标继续
+    detect_icons(journal=CrawlJournal())
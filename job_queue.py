@@ -0,0 +1,538 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import tracing
+# 持久化任务队列：用SQLite保存"启动应用、处理弹窗、检测、点击"等任务，多台设备的worker进程按优先级领取，
+# 失败后按指数退避重试；领取以租约方式进行，进程崩溃后租约到期任务重新排队，重启不会丢失或重复任务
+
+DEFAULT_QUEUE_PATH = os.path.join("output", "job_queue.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    device_id TEXT,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    job_key TEXT UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    created REAL NOT NULL,
+    available_at REAL NOT NULL,
+    lease_token TEXT,
+    lease_device TEXT,
+    lease_expires REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+CREATE TABLE IF NOT EXISTS runs (
+    job_id INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    device_id TEXT,
+    owner TEXT,
+    stolen INTEGER NOT NULL DEFAULT 0,
+    claimed REAL NOT NULL,
+    wait REAL NOT NULL,
+    finished REAL,
+    duration REAL,
+    status TEXT NOT NULL DEFAULT 'running',
+    PRIMARY KEY (job_id, attempt)
+);
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_expires REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = 300.0,
+                 steal_after: float = 60.0, backoff: float = 10.0, max_backoff: float = 600.0):
+        """
+        打开(或新建)任务队列
+        Args:
+            path: SQLite数据库文件，多个进程可以同时打开
+            lease_seconds: 任务租约时长(秒)，执行期间由worker定期续约；进程崩溃后租约到期，任务重新排队
+            steal_after: 指定给其他设备的任务等待超过该时间(秒)后，空闲设备可以代为执行
+            backoff: 第一次失败后的重试间隔(秒)，之后每次加倍
+            max_backoff: 重试间隔上限(秒)
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.steal_after = steal_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        # 每次写入都立即提交；多进程争用时等待写锁而不是报错
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _transaction(self, func):
+        # BEGIN IMMEDIATE立即取得写锁，多个进程同时领取时不会拿到同一个任务
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, kind: str, params: dict = None, priority: int = 0, device_id: str = None,
+                pinned: bool = False, key: str = None, max_attempts: int = 3, delay: float = 0.0):
+        """
+        添加任务
+        Args:
+            kind: 任务类型，见HANDLERS
+            params: 任务参数(可JSON序列化)
+            priority: 优先级，数值大的先执行
+            device_id: 指定执行的设备，None表示任意设备
+            pinned: 是否只能在指定设备上执行(不允许其他设备代为执行)
+            key: 任务唯一键，同一个键只会入队一次，重复提交(如重启后重新运行提交脚本)时被忽略
+            max_attempts: 最多执行次数
+            delay: 延迟多少秒后才可执行
+        Returns:
+            int: 任务ID；key已存在时返回已有任务的ID
+        """
+        now = time.time()
+
+        def insert(conn):
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (kind, params, priority, device_id, pinned, job_key, "
+                "max_attempts, created, available_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(params or {}, ensure_ascii=False), priority, device_id,
+                 int(pinned), key, max_attempts, now, now + delay))
+            if cursor.rowcount == 0:
+                return conn.execute("SELECT id FROM jobs WHERE job_key=?", (key,)).fetchone()[0]
+            return cursor.lastrowid
+        return self._transaction(insert)
+
+    def acquire_device(self, device_id: str, owner: str) -> bool:
+        """
+        取得设备租约，同一台设备同时只由一个worker操作
+        Args:
+            device_id: 设备ID
+            owner: worker标识
+        Returns:
+            bool: 是否取得(租约由其他仍在运行的worker持有时返回False)
+        """
+        now = time.time()
+
+        def acquire(conn):
+            rows = conn.execute("SELECT owner, lease_expires FROM devices WHERE device_id=?",
+                                (device_id,)).fetchall()
+            if rows and rows[0][0] != owner and rows[0][1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO devices (device_id, owner, lease_expires) VALUES (?, ?, ?)",
+                         (device_id, owner, now + self.lease_seconds))
+            return True
+        return self._transaction(acquire)
+
+    def release_device(self, device_id: str, owner: str):
+        self._execute("DELETE FROM devices WHERE device_id=? AND owner=?", (device_id, owner))
+
+    def _requeue_expired(self, conn, now: float):
+        # 租约到期的任务(执行它的进程已崩溃或卡死)：还有次数的重新排队，否则记为失败
+        expired = conn.execute(
+            "SELECT id, attempts, max_attempts FROM jobs WHERE status='running' AND lease_expires<?",
+            (now,)).fetchall()
+        for job_id, attempts, max_attempts in expired:
+            conn.execute("UPDATE runs SET status='expired', finished=? WHERE job_id=? AND attempt=?",
+                         (now, job_id, attempts))
+            if attempts >= max_attempts:
+                conn.execute("UPDATE jobs SET status='failed', finished=?, error=?, lease_token=NULL "
+                             "WHERE id=?", (now, "租约到期，已达最大执行次数", job_id))
+            else:
+                conn.execute("UPDATE jobs SET status='pending', available_at=?, lease_token=NULL "
+                             "WHERE id=?", (now, job_id))
+        conn.execute("DELETE FROM devices WHERE lease_expires<?", (now,))
+
+    def claim(self, device_id: str, owner: str):
+        """
+        领取一个任务：优先级高的先领；同优先级时依次为指定给本设备的、未指定设备的、
+        可以代为执行的其他设备的任务(等待超过steal_after，或其设备当前没有worker)
+        Args:
+            device_id: 本设备ID
+            owner: worker标识
+        Returns:
+            dict: 任务(含'token'，完成和续约时需要提供)；没有可执行的任务时返回None
+        """
+        now = time.time()
+
+        def claim(conn):
+            self._requeue_expired(conn, now)
+            rows = conn.execute(
+                "SELECT id, kind, params, priority, device_id, attempts, max_attempts, available_at "
+                "FROM jobs WHERE status='pending' AND available_at<=? AND ("
+                "device_id IS NULL OR device_id=? OR (pinned=0 AND (available_at<=? OR device_id NOT IN "
+                "(SELECT device_id FROM devices WHERE lease_expires>?)))) "
+                "ORDER BY priority DESC, CASE WHEN device_id=? THEN 0 WHEN device_id IS NULL THEN 1 "
+                "ELSE 2 END, available_at, id LIMIT 1",
+                (now, device_id, now - self.steal_after, now, device_id)).fetchall()
+            if not rows:
+                return None
+            job_id, kind, params, priority, job_device, attempts, max_attempts, available_at = rows[0]
+            token = uuid.uuid4().hex
+            attempt = attempts + 1
+            stolen = job_device is not None and job_device != device_id
+            conn.execute("UPDATE jobs SET status='running', attempts=?, lease_token=?, lease_device=?, "
+                         "lease_expires=? WHERE id=?",
+                         (attempt, token, device_id, now + self.lease_seconds, job_id))
+            conn.execute("INSERT OR REPLACE INTO runs (job_id, attempt, device_id, owner, stolen, claimed, wait) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, attempt, device_id, owner, int(stolen), now, max(0.0, now - available_at)))
+            return {'id': job_id, 'kind': kind, 'params': json.loads(params), 'priority': priority,
+                    'device_id': job_device, 'attempt': attempt, 'max_attempts': max_attempts,
+                    'stolen': stolen, 'token': token}
+        return self._transaction(claim)
+
+    def heartbeat(self, job: dict) -> bool:
+        """
+        续约任务和设备
+        Returns:
+            bool: 租约是否仍有效(已到期并被重新排队时返回False)
+        """
+        expires = time.time() + self.lease_seconds
+
+        def renew(conn):
+            updated = conn.execute("UPDATE jobs SET lease_expires=? WHERE id=? AND lease_token=? "
+                                   "AND status='running'", (expires, job['id'], job['token'])).rowcount
+            conn.execute("UPDATE devices SET lease_expires=? WHERE device_id=(SELECT lease_device FROM jobs "
+                         "WHERE id=?)", (expires, job['id']))
+            return updated == 1
+        return self._transaction(renew)
+
+    def _finish_run(self, conn, job: dict, status: str, now: float):
+        conn.execute("UPDATE runs SET status=?, finished=?, duration=?-claimed WHERE job_id=? AND attempt=?",
+                     (status, now, now, job['id'], job['attempt']))
+
+    def complete(self, job: dict, result=None) -> bool:
+        """
+        记录任务完成；只有持有当前租约的worker能完成任务，租约到期后任务已被别人领取时结果被丢弃
+        Returns:
+            bool: 是否记录成功
+        """
+        now = time.time()
+
+        def complete(conn):
+            updated = conn.execute(
+                "UPDATE jobs SET status='done', finished=?, result=?, error=NULL, lease_token=NULL "
+                "WHERE id=? AND lease_token=? AND status='running'",
+                (now, json.dumps(result, ensure_ascii=False, default=str), job['id'], job['token'])).rowcount
+            if updated:
+                self._finish_run(conn, job, 'done', now)
+            return updated == 1
+        return self._transaction(complete)
+
+    def fail(self, job: dict, error: str) -> bool:
+        """
+        记录任务失败：还有次数时按指数退避延后重试，否则记为失败
+        Returns:
+            bool: 是否记录成功
+        """
+        now = time.time()
+
+        def fail(conn):
+            rows = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id=? AND lease_token=? "
+                                "AND status='running'", (job['id'], job['token'])).fetchall()
+            if not rows:
+                return False
+            attempts, max_attempts = rows[0]
+            self._finish_run(conn, job, 'failed', now)
+            if attempts >= max_attempts:
+                conn.execute("UPDATE jobs SET status='failed', finished=?, error=?, lease_token=NULL "
+                             "WHERE id=?", (now, error, job['id']))
+            else:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+                conn.execute("UPDATE jobs SET status='pending', available_at=?, error=?, lease_token=NULL "
+                             "WHERE id=?", (now + delay, error, job['id']))
+            return True
+        return self._transaction(fail)
+
+    def get(self, job_id: int) -> dict:
+        """
+        查询任务状态
+        """
+        rows = self._execute("SELECT id, kind, params, priority, device_id, status, attempts, result, error "
+                             "FROM jobs WHERE id=?", (job_id,))
+        if not rows:
+            return None
+        job_id, kind, params, priority, device_id, status, attempts, result, error = rows[0]
+        return {'id': job_id, 'kind': kind, 'params': json.loads(params), 'priority': priority,
+                'device_id': device_id, 'status': status, 'attempts': attempts,
+                'result': json.loads(result) if result else None, 'error': error}
+
+    def metrics(self, window: float = 3600.0) -> dict:
+        """
+        统计队列状态、吞吐量和排队延迟
+        Args:
+            window: 统计吞吐量和延迟的时间窗口(秒)
+        Returns:
+            dict: {'pending', 'running', 'done', 'failed', 'ready'(已到可执行时间的排队任务数),
+                   'throughput_per_min', 'wait_avg', 'wait_p50', 'wait_p95', 'run_avg',
+                   'retries', 'stolen', 'expired', 'per_device'}
+        """
+        now = time.time()
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        ready = self._execute("SELECT COUNT(*) FROM jobs WHERE status='pending' AND available_at<=?",
+                              (now,))[0][0]
+        runs = self._execute("SELECT device_id, attempt, stolen, wait, duration, status, claimed FROM runs "
+                             "WHERE claimed>=?", (now - window,))
+        waits = sorted(run[3] for run in runs)
+        durations = [run[4] for run in runs if run[5] == 'done']
+        done_recent = self._execute("SELECT COUNT(*) FROM runs WHERE status='done' AND finished>=?",
+                                    (now - window,))[0][0]
+        per_device = {}
+        for device_id, _, _, _, duration, status, _ in runs:
+            stats = per_device.setdefault(device_id, {'done': 0, 'failed': 0, 'busy_seconds': 0.0})
+            if status in ('done', 'failed'):
+                stats[status] += 1
+            stats['busy_seconds'] += duration or 0.0
+
+        def percentile(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+        return {
+            'pending': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'ready': ready,
+            # 吞吐量按窗口内实际有任务执行的时间计算，队列刚启动时不会被整个窗口摊薄
+            'throughput_per_min': done_recent / max(1.0, now - min(run[6] for run in runs)) * 60 if runs else 0.0,
+            'wait_avg': sum(waits) / len(waits) if waits else 0.0,
+            'wait_p50': percentile(waits, 0.5),
+            'wait_p95': percentile(waits, 0.95),
+            'run_avg': sum(durations) / len(durations) if durations else 0.0,
+            'retries': sum(1 for run in runs if run[1] > 1),
+            'stolen': sum(1 for run in runs if run[2]),
+            'expired': sum(1 for run in runs if run[5] == 'expired'),
+            'per_device': per_device
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _run_handle_app_startup(params: dict, device_id: str):
+    import controller
+    from grounding_dino import handle_app_startup
+    if params.get('package'):
+        if not controller.launch_app(params['package']):
+            raise Exception(f"启动应用失败: {params['package']}")
+    stats = handle_app_startup(**params.get('options', {}))
+    # handle_app_startup只打印错误并返回统计；没有截到图或未能正常结束时记为失败，按退避重试
+    if stats.get('error'):
+        raise Exception(f"处理启动项出错: {stats['error']}")
+    if stats['frames'] == 0:
+        raise Exception("未能截图")
+    if not stats['settled']:
+        raise Exception(f"启动项处理未完成(OCR {stats['ocr_runs']} 次, 点击 {stats['clicks']} 次)")
+    return stats
+
+
+def _run_detect_icons(params: dict, device_id: str):
+    from crawl_journal import CrawlJournal
+    from grounding_dino import detect_icons
+    # 每个任务使用自己的遍历日志，重试时从上次中断的目标继续
+    journal = CrawlJournal(crawl_id=params.get('crawl_id', f"job_{params['job_id']}"), device_id=device_id)
+    try:
+        boxes = detect_icons(save_debug=params.get('save_debug', True), click=params.get('click', True),
+                             journal=journal, raise_errors=True)
+        summary = journal.summary()
+        if summary['pending']:
+            raise Exception(f"还有 {summary['pending']} 个目标未完成")
+        return dict(summary, boxes=len(boxes))
+    finally:
+        journal.close()
+
+
+def _run_test_detection(params: dict, device_id: str):
+    from appQuery import test_detection
+    return test_detection(raise_errors=True)
+
+
+# 任务类型 -> 执行函数(参数, 设备ID)，返回值作为任务结果保存；抛出异常表示失败
+HANDLERS = {
+    'handle_app_startup': _run_handle_app_startup,
+    'detect_icons': _run_detect_icons,
+    'test_detection': _run_test_detection,
+}
+
+
+class Worker:
+    def __init__(self, job_queue: JobQueue, device_id: str, handlers: dict = None, poll_interval: float = 2.0):
+        """
+        单台设备的worker：取得设备租约后循环领取并执行任务，执行期间在后台续约
+        controller和各流程默认操作ANDROID_SERIAL指定的设备，每台设备应在单独的进程中运行worker
+        Args:
+            job_queue: 任务队列
+            device_id: 设备ID
+            handlers: 任务类型 -> 执行函数，默认为HANDLERS
+            poll_interval: 没有任务时的轮询间隔(秒)
+        """
+        self.queue = job_queue
+        self.device_id = device_id
+        self.handlers = HANDLERS if handlers is None else handlers
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{device_id}"
+        self.stats = {'done': 0, 'failed': 0, 'lost': 0}
+
+    def _heartbeat(self, job: dict, stop: threading.Event):
+        while not stop.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(job):
+                print(f"任务 {job['id']} 的租约已失效")
+                return
+
+    def run_one(self, job: dict):
+        """
+        执行一个已领取的任务并记录结果
+        """
+        handler = self.handlers.get(job['kind'])
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop), daemon=True)
+        heartbeat.start()
+        print(f"\n执行任务 {job['id']}: {job['kind']} (第 {job['attempt']} 次"
+              f"{', 代其他设备执行' if job['stolen'] else ''})")
+        try:
+            if handler is None:
+                raise Exception(f"未知任务类型: {job['kind']}")
+            with tracing.tags(app=job['params'].get('package'), job=job['id']), \
+                    tracing.span("job", "flow", kind=job['kind'], attempt=job['attempt']):
+                result = handler(dict(job['params'], job_id=job['id']), self.device_id)
+            ok = self.queue.complete(job, result)
+            self.stats['done' if ok else 'lost'] += 1
+        except Exception as e:
+            print(f"任务 {job['id']} 失败: {str(e)}")
+            ok = self.queue.fail(job, str(e))
+            self.stats['failed' if ok else 'lost'] += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+        if not ok:
+            print(f"任务 {job['id']} 的租约已被重新分配，结果未记录")
+
+    def run(self, max_jobs: int = None, exit_when_idle: bool = False):
+        """
+        循环执行任务
+        Args:
+            max_jobs: 最多执行的任务数，None表示不限
+            exit_when_idle: 队列中没有可执行的任务时是否退出
+        Returns:
+            dict: {'done', 'failed', 'lost'(租约失效、结果未记录的任务数)}
+        """
+        if not self.queue.acquire_device(self.device_id, self.owner):
+            print(f"设备 {self.device_id} 已由其他worker占用")
+            return self.stats
+        try:
+            count = 0
+            while max_jobs is None or count < max_jobs:
+                job = self.queue.claim(self.device_id, self.owner)
+                if job is None:
+                    if exit_when_idle:
+                        break
+                    # 空闲时同样续约设备，其他worker才不会把本设备的任务当作无人执行
+                    self.queue.acquire_device(self.device_id, self.owner)
+                    time.sleep(self.poll_interval)
+                    continue
+                self.run_one(job)
+                count += 1
+        except KeyboardInterrupt:
+            print("worker已停止，正在执行的任务将在租约到期后重新排队")
+        finally:
+            self.queue.release_device(self.device_id, self.owner)
+        return self.stats
+
+
+def list_devices() -> list:
+    """
+    列出adb已连接的设备
+    """
+    try:
+        result = subprocess.run(["adb", "devices"], capture_output=True, text=True)
+        return [line.split("\t")[0] for line in result.stdout.splitlines()[1:]
+                if line.endswith("\tdevice")]
+    except Exception as e:
+        print(f"获取设备列表失败: {str(e)}")
+        return []
+
+
+def print_metrics(metrics: dict):
+    print(f"任务: 排队 {metrics['pending']} 个(可执行 {metrics['ready']} 个), 执行中 {metrics['running']} 个, "
+          f"完成 {metrics['done']} 个, 失败 {metrics['failed']} 个")
+    print(f"吞吐量 {metrics['throughput_per_min']:.2f} 个/分钟, 排队延迟 平均 {metrics['wait_avg']:.1f} 秒 "
+          f"p50 {metrics['wait_p50']:.1f} 秒 p95 {metrics['wait_p95']:.1f} 秒, 平均执行 {metrics['run_avg']:.1f} 秒")
+    print(f"重试 {metrics['retries']} 次, 代执行 {metrics['stolen']} 次, 租约到期 {metrics['expired']} 次")
+    for device_id, stats in metrics['per_device'].items():
+        print(f"  {device_id}: 完成 {stats['done']} 个, 失败 {stats['failed']} 个, 忙碌 {stats['busy_seconds']:.0f} 秒")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="持久化任务队列")
+    parser.add_argument("--db", default=DEFAULT_QUEUE_PATH, help="队列数据库文件")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="添加任务")
+    enqueue.add_argument("kind", choices=sorted(HANDLERS))
+    enqueue.add_argument("--params", default="{}", help="JSON格式的任务参数，如{\"package\": \"com.example\"}")
+    enqueue.add_argument("--priority", type=int, default=0)
+    enqueue.add_argument("--device", help="指定设备")
+    enqueue.add_argument("--pinned", action="store_true", help="只能在指定设备上执行")
+    enqueue.add_argument("--key", help="任务唯一键，重复提交时忽略")
+    enqueue.add_argument("--max-attempts", type=int, default=3)
+    worker = commands.add_parser("worker", help="在一台设备上执行任务")
+    worker.add_argument("--device", required=True)
+    worker.add_argument("--exit-when-idle", action="store_true")
+    run = commands.add_parser("run", help="为每台设备启动一个worker进程")
+    run.add_argument("--devices", help="逗号分隔的设备ID，默认为adb已连接的所有设备")
+    run.add_argument("--exit-when-idle", action="store_true")
+    commands.add_parser("stats", help="输出队列统计")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        job_queue = JobQueue(args.db)
+        job_id = job_queue.enqueue(args.kind, json.loads(args.params), args.priority, args.device,
+                                   args.pinned, args.key, args.max_attempts)
+        print(f"任务已入队: {job_id}")
+    elif args.command == "worker":
+        # adb和controller默认操作ANDROID_SERIAL指定的设备
+        os.environ["ANDROID_SERIAL"] = args.device
+        stats = Worker(JobQueue(args.db), args.device).run(exit_when_idle=args.exit_when_idle)
+        print(f"worker结束: 完成 {stats['done']} 个, 失败 {stats['failed']} 个, 结果未记录 {stats['lost']} 个")
+    elif args.command == "run":
+        devices = args.devices.split(",") if args.devices else list_devices()
+        if not devices:
+            raise SystemExit("没有可用的设备")
+        extra = ["--exit-when-idle"] if args.exit_when_idle else []
+        processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--db", args.db,
+                                       "worker", "--device", device] + extra,
+                                      env=dict(os.environ, ANDROID_SERIAL=device))
+                     for device in devices]
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.wait()
+        print_metrics(JobQueue(args.db).metrics())
+    else:
+        print_metrics(JobQueue(args.db).metrics())
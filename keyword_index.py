@@ -0,0 +1,309 @@
+import re
+from collections import Counter
+# OCR关键词容错匹配：在关键词列表上建立字符倒排索引，用有界编辑距离给出带置信度的匹配
+
+# 关键词中支持的通配写法，与detect_text_buttons原有的正则写法保持一致
+_WILDCARD_ANY = "."      # 任意单个字符
+_WILDCARD_STAR = ".*"    # 任意长度字符串
+_REGEX_SPECIAL = set("\\^$+?{}[]()|")
+
+# 启动弹窗的关键词(handle_app_startup使用，benchmark.py以此测量匹配耗时)
+STARTUP_KEYWORDS = [
+    "跳过.*",
+    "确认",
+    "始终允许",
+    "同意.*继续",
+    "确定",
+    "是",
+    "进入",
+    "X",
+    "同意"
+]
+
+
+def _tokenize(keyword: str):
+    """
+    将关键词拆分为匹配单元
+    Args:
+        keyword: 关键词，支持'.'和'.*'通配
+    Returns:
+        list: 每项为普通字符、'.'或'.*'；包含其他正则语法时返回None
+    """
+    tokens = []
+    i = 0
+    while i < len(keyword):
+        ch = keyword[i]
+        if ch in _REGEX_SPECIAL:
+            return None
+        if ch == _WILDCARD_ANY:
+            if i + 1 < len(keyword) and keyword[i + 1] == "*":
+                tokens.append(_WILDCARD_STAR)
+                i += 2
+                continue
+            tokens.append(_WILDCARD_ANY)
+        elif ch == "*":
+            return None
+        else:
+            tokens.append(ch)
+        i += 1
+    return tokens
+
+
+def bounded_edit_distance(tokens, text: str, max_distance: int, indel_cost: int = 1):
+    """
+    计算关键词单元与文字之间的编辑距离，超过上限时提前结束
+    Args:
+        tokens: _tokenize得到的匹配单元
+        text: OCR识别出的文字
+        max_distance: 距离上限
+        indel_cost: 插入/删除的代价，短关键词只允许替换时设为max_distance+1
+    Returns:
+        int: 编辑距离，超过上限时返回max_distance+1
+    """
+    limit = max_distance + 1
+    n = len(text)
+    # prev[j]表示前i个单元与text[:j]的最小代价
+    prev = [min(j * indel_cost, limit) for j in range(n + 1)]
+    for token in tokens:
+        cur = [0] * (n + 1)
+        if token == _WILDCARD_STAR:
+            # '.*'可以吸收任意多个字符，不产生代价
+            cur[0] = prev[0]
+            for j in range(1, n + 1):
+                cur[j] = min(prev[j], cur[j - 1])
+        else:
+            cur[0] = min(prev[0] + indel_cost, limit)
+            for j in range(1, n + 1):
+                cost = 0 if token == _WILDCARD_ANY or token == text[j - 1] else 1
+                cur[j] = min(prev[j - 1] + cost,
+                             prev[j] + indel_cost,
+                             cur[j - 1] + indel_cost,
+                             limit)
+        if min(cur) >= limit:
+            return limit
+        prev = cur
+    return prev[n]
+
+
+class KeywordIndex:
+    def __init__(self, keywords, max_distance: int = 1, indel_min_length: int = 4,
+                 fuzzy_min_length: int = 3):
+        """
+        建立关键词容错索引
+        Args:
+            keywords: 关键词列表，支持'.'和'.*'通配
+            max_distance: 允许的最大编辑距离，0表示只做精确匹配
+            indel_min_length: 普通字符数不少于该值的关键词才允许插入/删除，
+                              更短的关键词只容忍替换，避免"不同意"匹配到"同意"
+            fuzzy_min_length: 可容错的普通字符数少于该值的关键词只做精确匹配，
+                              避免"同步"匹配到"同意"、"否定"匹配到"确定"
+        """
+        self.keywords = list(keywords)
+        self.max_distance = max_distance
+        self.indel_min_length = indel_min_length
+        self.fuzzy_min_length = fuzzy_min_length
+        self._patterns = [re.compile(f"^{keyword}$") for keyword in self.keywords]
+
+        # 每个关键词的匹配单元、允许距离、长度范围
+        self._entries = []
+        # 字符 -> [(关键词序号, 该字符在关键词中出现的次数)]
+        self._postings = {}
+        # 不依赖字符重合即可成为候选的关键词
+        self._always = []
+
+        for idx, keyword in enumerate(self.keywords):
+            tokens = _tokenize(keyword)
+            if tokens is None:
+                # 含复杂正则的关键词只做精确匹配
+                continue
+            # 含'.*'的关键词，第一个'.*'之前的部分必须精确匹配：
+            # 否则"跳过.*"只剩一个字需要对上，"跳转"、"经过"都会被当成跳过按钮
+            prefix = tokens[:tokens.index(_WILDCARD_STAR)] if _WILDCARD_STAR in tokens else []
+            rest = tokens[len(prefix):]
+            literals = Counter(t for t in rest if len(t) == 1 and t != _WILDCARD_ANY)
+            literal_len = sum(literals.values())
+            # 短关键词(如"是"、"同意")错一个字就是另一个词，只做精确匹配
+            if literal_len < fuzzy_min_length:
+                continue
+            allowed = min(max_distance, literal_len // 2)
+            if allowed <= 0:
+                continue
+            indel_cost = 1 if literal_len >= indel_min_length else allowed + 1
+            fixed_len = sum(1 for t in tokens if t != _WILDCARD_STAR)
+            has_star = _WILDCARD_STAR in tokens
+            min_len = fixed_len - (allowed if indel_cost == 1 else 0)
+            max_len = None if has_star else fixed_len + (allowed if indel_cost == 1 else 0)
+            entry_id = len(self._entries)
+            self._entries.append({
+                'index': idx,
+                'prefix': prefix,
+                'tokens': rest,
+                'literal_len': literal_len + len(prefix),
+                'allowed': allowed,
+                'indel_cost': indel_cost,
+                'min_len': min_len,
+                'max_len': max_len,
+                'required': literal_len - allowed
+            })
+            if literal_len - allowed <= 0:
+                self._always.append(entry_id)
+            for ch, count in literals.items():
+                self._postings.setdefault(ch, []).append((entry_id, count))
+
+    def _candidates(self, text: str):
+        """
+        用字符重合数过滤候选关键词：每次编辑最多破坏一个字符的重合
+        """
+        overlap = {}
+        for ch, count in Counter(text).items():
+            for entry_id, kw_count in self._postings.get(ch, ()):
+                overlap[entry_id] = overlap.get(entry_id, 0) + min(count, kw_count)
+
+        candidates = [e for e, v in overlap.items() if v >= self._entries[e]['required']]
+        candidates.extend(e for e in self._always if e not in overlap)
+        return candidates
+
+    def match(self, text: str):
+        """
+        查找与文字最匹配的关键词
+        Args:
+            text: OCR识别出的文字
+        Returns:
+            dict: {'keyword': str, 'distance': int, 'score': float}，无匹配时返回None
+        """
+        # 精确匹配优先，保持与原有正则匹配一致的结果
+        for keyword, pattern in zip(self.keywords, self._patterns):
+            if pattern.match(text):
+                return {'keyword': keyword, 'distance': 0, 'score': 1.0}
+
+        if self.max_distance <= 0 or not self._entries:
+            return None
+
+        best = None
+        for entry_id in self._candidates(text):
+            entry = self._entries[entry_id]
+            if len(text) < entry['min_len']:
+                continue
+            if entry['max_len'] is not None and len(text) > entry['max_len']:
+                continue
+            prefix = entry['prefix']
+            if len(text) < len(prefix) or any(t != _WILDCARD_ANY and t != ch for t, ch in zip(prefix, text)):
+                continue
+            distance = bounded_edit_distance(entry['tokens'], text[len(prefix):],
+                                             entry['allowed'], entry['indel_cost'])
+            if distance > entry['allowed']:
+                continue
+            key = (distance, entry['index'])
+            if best is None or key < best[0]:
+                best = (key, entry)
+
+        if best is None:
+            return None
+        (distance, _), entry = best
+        return {
+            'keyword': self.keywords[entry['index']],
+            'distance': distance,
+            'score': 1.0 - distance / max(entry['literal_len'], 1)
+        }
+
+
+# 按关键词列表缓存索引，避免每帧重复建立
+_INDEX_CACHE = {}
+
+
+def get_keyword_index(keywords, max_distance: int = 1) -> KeywordIndex:
+    """
+    获取(或建立)关键词列表对应的索引
+    Args:
+        keywords: 关键词列表
+        max_distance: 允许的最大编辑距离
+    Returns:
+        KeywordIndex: 关键词索引
+    """
+    key = (tuple(keywords), max_distance)
+    index = _INDEX_CACHE.get(key)
+    if index is None:
+        index = KeywordIndex(keywords, max_distance)
+        _INDEX_CACHE[key] = index
+    return index
+
+
+def match_ocr_results(results, keywords, max_distance: int = 0):
+    """
+    在OCR识别结果中查找与关键词匹配的文字，并转换坐标格式
+    Args:
+        results: CnOcr.ocr的输出，每项包含'text'和四个角点的'position'
+        keywords: 关键词列表
+        max_distance: 容忍的OCR错字数(编辑距离)，0表示只做精确匹配
+    Returns:
+        list: 每项格式为{'text': str, 'position': (x1,y1,x2,y2), 'keyword': str, 'score': float}
+    """
+    # 关键词索引按关键词列表缓存，每帧只做查询
+    index = get_keyword_index(keywords, max_distance)
+
+    matched_texts = []
+    for result in results:
+        text = result['text'].strip()  # 去除首尾空白
+        box = result['position']
+
+        # 检查是否匹配关键词(精确匹配优先，其次是编辑距离内的容错匹配)
+        match = index.match(text)
+        if match is not None:
+            # 转换坐标格式为(x1,y1,x2,y2)
+            x1 = min(box[0][0], box[3][0])
+            y1 = min(box[0][1], box[1][1])
+            x2 = max(box[1][0], box[2][0])
+            y2 = max(box[2][1], box[3][1])
+
+            matched_texts.append({
+                'text': text,
+                'position': (int(x1), int(y1), int(x2), int(y2)),
+                'keyword': match['keyword'],
+                'score': match['score']
+            })
+    return matched_texts
+
+
+# 回归用例：(关键词列表, 文字, 期望匹配的关键词或None)；修改匹配规则后运行 python keyword_index.py 检查
+REGRESSION_CASES = [
+    (["跳过.*"], "跳过", "跳过.*"),
+    (["跳过.*"], "跳过 5", "跳过.*"),
+    (["跳过.*"], "跳转", None),
+    (["跳过.*"], "跳舞视频", None),
+    (["跳过.*"], "经过", None),
+    (["跳过.*"], "不过这是一段很长的文字", None),
+    (["同意"], "同步", None),
+    (["同意"], "不同意", None),
+    (["确定"], "否定", None),
+    (["进入"], "进度", None),
+    (["同意.*继续"], "同意并继续", "同意.*继续"),
+    (["同意.*继续"], "不同意并继续", None),
+    (["始终允许"], "始终充许", "始终允许"),
+    (["是"], "否", None),
+]
+
+
+def check_regressions(max_distance: int = 1, min_score: float = 0.0):
+    """
+    运行回归用例
+    Args:
+        max_distance: 允许的最大编辑距离
+        min_score: 低于该置信度的匹配视为未匹配，与调用方的点击门限一致
+    Returns:
+        list: 不符合预期的用例，每项为(关键词列表, 文字, 期望, 实际)
+    """
+    failures = []
+    for keywords, text, expected in REGRESSION_CASES:
+        match = get_keyword_index(keywords, max_distance).match(text)
+        actual = match['keyword'] if match is not None and match['score'] >= min_score else None
+        if actual != expected:
+            failures.append((keywords, text, expected, actual))
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_regressions(max_distance=1, min_score=0.75)
+    for keywords, text, expected, actual in failures:
+        print(f"关键词 {keywords} 匹配 \"{text}\": 期望 {expected}，实际 {actual}")
+    print(f"回归用例 {len(REGRESSION_CASES)} 个，失败 {len(failures)} 个")
+    raise SystemExit(1 if failures else 0)
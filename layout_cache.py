@@ -0,0 +1,95 @@
+import base64
+import json
+import os
+import time
+import numpy as np
+from screen_fingerprint import dhash, hamming, thumbnail, max_pixel_diff
+# 桌面布局缓存：以桌面截图的感知指纹为键保存过滤后的图标框，布局不变时不必重新运行GroundingDINO
+
+
+class LayoutCache:
+    def __init__(self, path: str = None, max_distance: int = 10, max_pixel_change: int = 24,
+                 max_entries: int = 64):
+        """
+        初始化布局缓存
+        Args:
+            path: 持久化文件，None表示只保存在内存中
+            max_distance: 指纹汉明距离不超过该值才可能是同一页面(快速筛选)
+            max_pixel_change: 缩略图任一像素的变化超过该值视为布局变化；翻页、安装新应用都会使缓存自动失效
+            max_entries: 最多保存的页面数，超出时淘汰最久未使用的页面
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.max_pixel_change = max_pixel_change
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # 指纹 -> {'boxes': [...], 'thumb': 缩略图, 'used': 最近使用时间}
+        self._entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for key, entry in data.items():
+                    shape = entry['thumb_shape']
+                    entry['thumb'] = np.frombuffer(base64.b64decode(entry['thumb']),
+                                                   np.uint8).reshape(shape)
+                    self._entries[int(key, 16)] = entry
+            except (OSError, ValueError, KeyError) as e:
+                print(f"读取布局缓存失败: {str(e)}")
+
+    def lookup(self, img):
+        """
+        查找与截图相同页面的缓存
+        Args:
+            img: 截图
+        Returns:
+            tuple: (指纹, 缓存的框列表或None)，指纹为(哈希, 缩略图)，原样传给store
+        """
+        fingerprint = (dhash(img), thumbnail(img))
+        candidates = sorted((hamming(fingerprint[0], key), key) for key in self._entries)
+        for distance, key in candidates:
+            if distance > self.max_distance:
+                break
+            entry = self._entries[key]
+            if (entry['thumb'].shape == fingerprint[1].shape and
+                    max_pixel_diff(entry['thumb'], fingerprint[1]) <= self.max_pixel_change):
+                self.hits += 1
+                entry['used'] = time.time()
+                return fingerprint, entry['boxes']
+        self.misses += 1
+        return fingerprint, None
+
+    def store(self, fingerprint: tuple, boxes):
+        """
+        保存页面的检测结果
+        Args:
+            fingerprint: lookup返回的指纹
+            boxes: 过滤后的检测框 [[x1,y1,x2,y2],...]
+        """
+        key, thumb = fingerprint
+        self._entries[key] = {
+            'boxes': [[float(v) for v in box] for box in boxes],
+            'thumb': thumb,
+            'used': time.time()
+        }
+        if len(self._entries) > self.max_entries:
+            oldest = min(self._entries, key=lambda k: self._entries[k]['used'])
+            del self._entries[oldest]
+        if self.path:
+            self.save()
+
+    def save(self):
+        """
+        写入持久化文件
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({format(k, "x"): {
+                'boxes': v['boxes'],
+                'thumb': base64.b64encode(v['thumb'].tobytes()).decode("ascii"),
+                'thumb_shape': list(v['thumb'].shape),
+                'used': v['used']
+            } for k, v in self._entries.items()}, f)
+        os.replace(tmp_path, self.path)
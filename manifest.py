@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import time
+# 批处理清单：记录每个输入文件的内容指纹、检测器版本和参数，重复运行时只处理新增或变化的文件
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    计算文件内容的sha1
+    Args:
+        path: 文件路径
+        chunk_size: 每次读取的字节数
+    Returns:
+        str: 十六进制摘要
+    """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class BatchManifest:
+    def __init__(self, output_dir: str, detector: str, version: str = "1",
+                 params: dict = None, save_every: int = 10):
+        """
+        加载(或新建)输出目录下的批处理清单
+        Args:
+            output_dir: 输出结果目录，清单保存在其中
+            detector: 检测器名称，不同检测器共用一个输出目录时互不影响
+            version: 检测器版本，变化后所有文件都会重新处理
+            params: 检测参数，变化后所有文件都会重新处理
+            save_every: 每完成多少个文件落盘一次，中断后可以从最近一次保存处继续
+        """
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.detector = detector
+        self.signature = json.dumps({'version': version, 'params': params or {}},
+                                    sort_keys=True, ensure_ascii=False)
+        self.save_every = save_every
+        self._pending = 0
+        self._data = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取清单失败，将重新处理所有文件: {str(e)}")
+                self._data = {}
+
+        section = self._data.get(detector)
+        if section is None or section.get('signature') != self.signature:
+            # 检测器版本或参数变化，旧记录全部失效
+            section = {'signature': self.signature, 'files': {}}
+            self._data[detector] = section
+        self._files = section['files']
+
+    def _fingerprint(self, path: str, record: dict = None) -> dict:
+        """
+        获取文件指纹：大小和修改时间未变时直接沿用已记录的摘要
+        """
+        stat = os.stat(path)
+        fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if (record is not None and record.get('size') == stat.st_size
+                and record.get('mtime_ns') == stat.st_mtime_ns):
+            fingerprint['sha1'] = record.get('sha1')
+        else:
+            fingerprint['sha1'] = file_digest(path)
+        return fingerprint
+
+    def needs_processing(self, input_path: str) -> bool:
+        """
+        判断文件是否需要(重新)处理
+        Args:
+            input_path: 输入文件路径
+        Returns:
+            bool: 新文件、内容变化、上次未完成或输出丢失时返回True
+        """
+        key = os.path.basename(input_path)
+        record = self._files.get(key)
+        if record is None or record.get('status') != 'done':
+            return True
+
+        output_path = record.get('output')
+        if output_path and not os.path.exists(output_path):
+            return True
+
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return True
+        if record.get('size') == stat.st_size and record.get('mtime_ns') == stat.st_mtime_ns:
+            return False
+
+        # 修改时间变了但内容可能没变(例如重新拷贝)，用摘要确认
+        fingerprint = self._fingerprint(input_path)
+        if fingerprint['sha1'] == record.get('sha1'):
+            record.update(fingerprint)
+            return False
+        return True
+
+    def mark_done(self, input_path: str, output_path: str = None, result=None):
+        """
+        记录文件处理完成
+        Args:
+            input_path: 输入文件路径
+            output_path: 输出文件路径
+            result: 可选的检测结果(需可JSON序列化)
+        """
+        key = os.path.basename(input_path)
+        record = self._fingerprint(input_path, self._files.get(key))
+        record.update({
+            'status': 'done',
+            'output': output_path,
+            'finished_at': time.time()
+        })
+        if result is not None:
+            record['result'] = result
+        self._files[key] = record
+        self._pending += 1
+        if self._pending >= self.save_every:
+            self.save()
+
+    def mark_failed(self, input_path: str, error: str):
+        """
+        记录文件处理失败(无法读取或处理出错)，下次运行会重试
+        Args:
+            input_path: 输入文件路径
+            error: 错误信息
+        """
+        key = os.path.basename(input_path)
+        self._files[key] = {'status': 'failed', 'error': error, 'finished_at': time.time()}
+        self._pending += 1
+        if self._pending >= self.save_every:
+            self.save()
+
+    def results(self) -> dict:
+        """
+        返回已记录的检测结果 {文件名: result}
+        """
+        return {name: record['result'] for name, record in self._files.items()
+                if record.get('status') == 'done' and 'result' in record}
+
+    def save(self):
+        """
+        原子地写入清单文件，写入中途崩溃不会损坏已有清单
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._pending = 0
@@ -0,0 +1,207 @@
+import base64
+import json
+import os
+from collections import deque
+import numpy as np
+import controller
+from screen_fingerprint import HASH_SIZE, hamming, is_similar
+# 页面导航图：以截图指纹为节点、以操作(点击、返回、回到主页)为边记录页面之间的跳转，
+# 需要回到某个已知页面时按最短路径操作，不必反复按返回键再截图确认
+
+BACK = ("back",)
+HOME = ("home",)
+
+
+def tap(x: int, y: int) -> tuple:
+    """
+    点击操作
+    """
+    return ("tap", int(x), int(y))
+
+
+def _action_key(action: tuple) -> str:
+    return ":".join(str(v) for v in action)
+
+
+def _parse_action(key: str) -> tuple:
+    parts = key.split(":")
+    return (parts[0],) + tuple(int(v) for v in parts[1:])
+
+
+class NavigationGraph:
+    def __init__(self, path: str = None, threshold: float = 0.95, max_nodes: int = 256):
+        """
+        初始化导航图
+        Args:
+            path: 持久化文件，提供且存在时加载
+            threshold: 判断两张截图为同一页面的相似度阈值，见screen_fingerprint.is_similar
+            max_nodes: 最多记录的页面数，超出后不再添加新页面
+        """
+        self.path = path
+        self.threshold = threshold
+        self.max_nodes = max_nodes
+        # 节点编号 -> 指纹(哈希, 缩略图)
+        self.nodes = {}
+        # 节点编号 -> {操作: {目标节点编号: 观察次数}}
+        self.edges = {}
+        # 当前所在页面，以及最近执行、尚未观察到结果的操作(出发节点, 操作, 预期节点, 出发节点是否经截图确认)
+        self.current = None
+        self._pending = None
+        self._next_id = 0
+        self.stats = {'path_moves': 0, 'fallback_moves': 0}
+        if path and os.path.exists(path):
+            try:
+                self._load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"读取导航图失败: {str(e)}")
+
+    def locate(self, fp: tuple, add: bool = True):
+        """
+        查找与指纹相同的页面
+        Args:
+            fp: 截图指纹
+            add: 找不到时是否作为新页面加入
+        Returns:
+            int: 节点编号；找不到且不添加时返回None
+        """
+        max_distance = int((1 - self.threshold) * HASH_SIZE * HASH_SIZE)
+        # 先用哈希距离筛选，只对候选页面计算SSIM
+        candidates = sorted((hamming(fp[0], node_fp[0]), node) for node, node_fp in self.nodes.items())
+        for distance, node in candidates:
+            if distance > max_distance:
+                break
+            if is_similar(self.nodes[node], fp, self.threshold):
+                return node
+        if not add or len(self.nodes) >= self.max_nodes:
+            return None
+        node = self._next_id
+        self._next_id += 1
+        self.nodes[node] = fp
+        self.edges[node] = {}
+        return node
+
+    def add_edge(self, source: int, action: tuple, target: int):
+        """
+        记录一次跳转：在source页面执行action后到达target页面
+        """
+        targets = self.edges.setdefault(source, {}).setdefault(_action_key(action), {})
+        targets[target] = targets.get(target, 0) + 1
+
+    def observe(self, fp: tuple):
+        """
+        记录当前截图：若之前执行过操作，则记下该操作的跳转
+        Args:
+            fp: 当前截图的指纹
+        Returns:
+            int: 当前页面的节点编号(页面数已满且为新页面时为None)
+        """
+        node = self.locate(fp)
+        if self._pending is not None and node is not None:
+            source, action, expected, confirmed = self._pending
+            # 连续执行多步时出发页面只是推测的，到达预期页面才记下最后一步，避免记下错误的跳转
+            if source is not None and (confirmed or expected == node):
+                self.add_edge(source, action, node)
+        self._pending = None
+        self.current = node
+        return node
+
+    def perform(self, action: tuple, device_id: str = None, expected: int = None):
+        """
+        执行操作，下一次observe时记录跳转；连续执行多个操作时，上一步的预期页面作为这一步的出发页面
+        Args:
+            action: BACK、HOME或tap(x, y)
+            device_id: 设备ID
+            expected: 预期到达的页面(按路径执行时)
+        """
+        if action[0] == "back":
+            controller.press_back(device_id)
+        elif action[0] == "home":
+            controller.press_home(device_id)
+        elif action[0] == "tap":
+            controller.click_position(action[1], action[2], device_id)
+        else:
+            raise ValueError(f"未知操作: {action}")
+        if self.current is not None:
+            self._pending = (self.current, action, expected, True)
+        else:
+            source = self._pending[2] if self._pending is not None else None
+            self._pending = (source, action, expected, False)
+        self.current = None
+
+    def _best_target(self, node: int, key: str):
+        targets = self.edges.get(node, {}).get(key)
+        if not targets:
+            return None
+        return max(targets.items(), key=lambda item: item[1])[0]
+
+    def shortest_path(self, source: int, target: int, max_depth: int = 8):
+        """
+        广度优先搜索最少操作的路径；每个操作取观察次数最多的跳转
+        Args:
+            source: 出发页面
+            target: 目标页面
+            max_depth: 最多操作数
+        Returns:
+            list: [(操作, 到达页面), ...]；不可达时返回None
+        """
+        if source is None or target is None:
+            return None
+        if source == target:
+            return []
+        previous = {source: None}
+        queue = deque([(source, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            if depth >= max_depth:
+                continue
+            # 返回键优先，其次是回到主页，最后是点击
+            for key in sorted(self.edges.get(node, {}), key=lambda k: (k != "back", k != "home", k)):
+                nxt = self._best_target(node, key)
+                if nxt is None or nxt in previous:
+                    continue
+                previous[nxt] = (node, _parse_action(key))
+                if nxt == target:
+                    path = []
+                    while previous[nxt] is not None:
+                        prev, action = previous[nxt]
+                        path.append((action, nxt))
+                        nxt = prev
+                    return path[::-1]
+                queue.append((nxt, depth + 1))
+        return None
+
+    def save(self, path: str = None):
+        """
+        保存导航图到JSON文件
+        """
+        path = path or self.path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            'threshold': self.threshold,
+            'nodes': {str(node): {'hash': format(fp[0], "x"),
+                                  'thumb': base64.b64encode(fp[1].tobytes()).decode("ascii"),
+                                  'thumb_shape': list(fp[1].shape)}
+                      for node, fp in self.nodes.items()},
+            'edges': {str(node): {key: {str(t): c for t, c in targets.items()}
+                                  for key, targets in actions.items()}
+                      for node, actions in self.edges.items()}
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _load(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for node, entry in data['nodes'].items():
+            thumb = np.frombuffer(base64.b64decode(entry['thumb']), np.uint8).reshape(entry['thumb_shape'])
+            self.nodes[int(node)] = (int(entry['hash'], 16), thumb)
+        self.edges = {int(node): {key: {int(t): c for t, c in targets.items()}
+                                  for key, targets in actions.items()}
+                      for node, actions in data['edges'].items()}
+        for node in self.nodes:
+            self.edges.setdefault(node, {})
+        self._next_id = max(self.nodes, default=-1) + 1
@@ -0,0 +1,360 @@
+import queue
+import threading
+import time
+import clock
+import tracing
+# 多级流水线：每级有自己的线程池，级间用有界队列连接，读盘、解码、检测、写盘可以同时进行
+
+# 队列结束标记
+_STOP = object()
+
+
+class StageStats:
+    def __init__(self, name: str, workers: int):
+        """
+        单级流水线的统计信息
+        Args:
+            name: 级名称
+            workers: 线程数
+        """
+        self.name = name
+        self.workers = workers
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.start = None
+        self.end = None
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float, ok: bool = True):
+        with self._lock:
+            now = time.perf_counter()
+            if self.start is None:
+                self.start = now - elapsed
+            self.end = now
+            self.busy += elapsed
+            if ok:
+                self.count += 1
+            else:
+                self.errors += 1
+
+    def summary(self, wall_time: float) -> dict:
+        """
+        汇总吞吐量和线程利用率
+        Args:
+            wall_time: 整条流水线的运行时间
+        """
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.count,
+            'errors': self.errors,
+            'busy_seconds': self.busy,
+            'throughput': self.count / wall_time if wall_time > 0 else 0.0,
+            'utilization': self.busy / (wall_time * self.workers) if wall_time > 0 else 0.0
+        }
+
+
+class StagedPipeline:
+    def __init__(self, queue_size: int = 8):
+        """
+        初始化流水线
+        Args:
+            queue_size: 级间队列的容量，下游处理不过来时上游会阻塞，避免占用过多内存
+        """
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = []
+        self.wall_time = 0.0
+
+    def add_stage(self, name: str, func, workers: int = 1):
+        """
+        添加一级处理
+        Args:
+            name: 级名称
+            func: 处理函数，输入上一级的输出；返回None时该项被丢弃
+            workers: 该级的线程数
+        Returns:
+            StagedPipeline: 自身，便于链式调用
+        """
+        self.stages.append((name, func, max(1, workers)))
+        return self
+
+    def _worker(self, func, stats, in_queue, out_queue, remaining, lock, next_workers):
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                break
+            start = time.perf_counter()
+            try:
+                with tracing.span(stats.name, "pipeline"):
+                    result = func(item)
+                stats.record(time.perf_counter() - start)
+            except Exception as e:
+                stats.record(time.perf_counter() - start, ok=False)
+                print(f"流水线[{stats.name}]处理失败: {str(e)}")
+                continue
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+        # 本级最后一个线程退出时通知下一级结束
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and out_queue is not None:
+            for _ in range(next_workers):
+                out_queue.put(_STOP)
+
+    def run(self, items):
+        """
+        运行流水线直到所有输入处理完毕
+        Args:
+            items: 输入项(可迭代对象)，由单独的线程按需读取
+        Returns:
+            list: 每级的统计信息，见StageStats.summary
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self.stats = [StageStats(name, workers) for name, _, workers in self.stages]
+        threads = []
+        start = time.perf_counter()
+
+        for idx, (name, func, workers) in enumerate(self.stages):
+            out_queue = queues[idx + 1] if idx + 1 < len(self.stages) else None
+            next_workers = self.stages[idx + 1][2] if out_queue is not None else 0
+            remaining = [workers]
+            lock = threading.Lock()
+            for n in range(workers):
+                # 各级在自己的线程中运行，带上调用方线程的追踪标签
+                thread = threading.Thread(
+                    target=tracing.bind(self._worker),
+                    args=(func, self.stats[idx], queues[idx], out_queue, remaining, lock, next_workers),
+                    name=f"{name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        # 输入端：有界队列满时阻塞，实现按需预取
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_STOP)
+
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.perf_counter() - start
+        return self.report()
+
+    def report(self) -> list:
+        """
+        返回每级的吞吐量统计
+        """
+        return [stats.summary(self.wall_time) for stats in self.stats]
+
+    def print_report(self):
+        """
+        打印每级的吞吐量统计
+        """
+        print(f"流水线总耗时: {self.wall_time:.2f} 秒")
+        for s in self.report():
+            print(f"[{s['stage']}] 线程数: {s['workers']}, 完成: {s['items']}, 失败: {s['errors']}, "
+                  f"吞吐量: {s['throughput']:.2f} 项/秒, 利用率: {s['utilization'] * 100:.0f}%")
+
+
+class FramePrefetcher:
+    def __init__(self, capture, prepare=None):
+        """
+        截图预取(双缓冲)：后台线程截取并预处理下一帧，调用方处理当前帧时下一帧已在截取；
+        安装了虚拟时钟(会话回放)时不启动后台线程，get()推进到预约的时间后在调用方线程中截图，
+        截图次数只取决于流程本身，回放结果是确定的
+        Args:
+            capture: 截图函数，无参数，返回截图数据(失败时返回None)
+            prepare: 预处理函数，输入截图数据，在后台线程中执行(如解码、计算指纹)，结果放在帧的'prepared'中
+        """
+        self._capture = capture
+        self._prepare = prepare
+        self._cond = threading.Condition()
+        # 每次执行动作后加一，动作之前开始截取的帧不再使用
+        self._epoch = 0
+        # 下一次截图应开始的时间，None表示没有待截取的帧
+        self._due = None
+        # 调用方希望拿到新帧的时间，在此之前的等待是有意的(如等待界面响应)，不计入等待耗时
+        self._target = None
+        # 正在截取的帧所属的epoch，None表示空闲
+        self._busy_epoch = None
+        self._ready = None
+        self._closed = False
+        # 预约截图时调用方线程的追踪标签，后台截图和预处理的事件带上这些标签
+        self._tags = {}
+        # 截图+预处理的平均耗时，用于提前开始截图
+        self._latency = 0.0
+        self.capture_stats = StageStats("capture", 1)
+        self.prepare_stats = StageStats("prepare", 1)
+        self.wait_seconds = 0.0
+        self.frames = 0
+        self.stale = 0
+        self.stale_seconds = 0.0
+        self._start = clock.now()
+        self._sync = clock.is_virtual()
+        self._thread = None
+        if not self._sync:
+            self._thread = threading.Thread(target=self._loop, name="frame-prefetch", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = clock.now()
+                    if self._due is not None and now >= self._due:
+                        break
+                    self._cond.wait(None if self._due is None else self._due - now)
+                if self._closed:
+                    return
+                self._due = None
+                epoch = self._busy_epoch = self._epoch
+                tags = self._tags
+
+            with tracing.tags(**tags):
+                frame, latency = self._fetch()
+
+            with self._cond:
+                self._busy_epoch = None
+                self._latency = latency if self.frames == 0 else 0.7 * self._latency + 0.3 * latency
+                self.frames += 1
+                if epoch == self._epoch:
+                    self._ready = frame
+                else:
+                    # 截取期间执行了动作，这一帧已经过时
+                    self.stale += 1
+                    self.stale_seconds += latency
+                self._cond.notify_all()
+
+    def _fetch(self):
+        """
+        截取并预处理一帧
+        Returns:
+            tuple: (帧, 截图+预处理耗时)
+        """
+        frame = {'data': None, 'prepared': None, 'captured_at': clock.now()}
+        start = clock.now()
+        try:
+            frame['data'] = self._capture()
+            self.capture_stats.record(clock.now() - start, ok=frame['data'] is not None)
+        except Exception as e:
+            self.capture_stats.record(clock.now() - start, ok=False)
+            print(f"预取截图失败: {str(e)}")
+        if frame['data'] is not None and self._prepare is not None:
+            prepare_start = clock.now()
+            try:
+                with tracing.span("prepare_frame", "decode"):
+                    frame['prepared'] = self._prepare(frame['data'])
+                self.prepare_stats.record(clock.now() - prepare_start)
+            except Exception as e:
+                self.prepare_stats.record(clock.now() - prepare_start, ok=False)
+                print(f"预处理截图失败: {str(e)}")
+        latency = clock.now() - start
+        return frame, latency
+
+    def schedule(self, delay: float = 0.0):
+        """
+        预约一帧：按平均耗时提前开始截图，使新帧在delay秒后恰好就绪
+        Args:
+            delay: 希望多少秒后拿到新帧(例如点击后等待界面响应的时间)
+        """
+        with self._cond:
+            self._ready = None
+            self._tags = tracing.current_tags()
+            now = clock.now()
+            self._target = now + delay
+            self._due = now + max(0.0, delay - self._latency)
+            self._cond.notify_all()
+
+    def invalidate(self):
+        """
+        执行点击等动作后调用：丢弃已就绪的帧和正在截取的帧
+        """
+        with self._cond:
+            self._epoch += 1
+            self._ready = None
+            self._due = None
+            self._target = None
+
+    def get(self, timeout: float = 10.0):
+        """
+        获取下一帧，没有预约时立即截图
+        Args:
+            timeout: 最长等待时间(秒)
+        Returns:
+            dict: {'data': 截图数据, 'prepared': 预处理结果, 'captured_at': 开始截图的时间}，超时返回None
+        """
+        if self._sync:
+            return self._get_sync()
+        start = clock.now()
+        with tracing.span("wait_frame", "wait"), self._cond:
+            if self._ready is None and self._due is None and self._busy_epoch != self._epoch:
+                self._tags = tracing.current_tags()
+                self._due = self._target = start
+                self._cond.notify_all()
+            target = self._target if self._target is not None else start
+            deadline = start + timeout
+            while self._ready is None and not self._closed:
+                remaining = deadline - clock.now()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            frame, self._ready = self._ready, None
+            self._target = None
+        self.wait_seconds += max(0.0, clock.now() - max(start, target))
+        return frame
+
+    def _get_sync(self):
+        """
+        虚拟时钟下获取帧：等到预约的时间后直接截图
+        """
+        with tracing.span("wait_frame", "wait"):
+            target = self._target
+            self._target = None
+            if target is not None:
+                clock.sleep(target - clock.now())
+            frame, latency = self._fetch()
+            self._latency = latency
+            self.frames += 1
+        return frame
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def report(self) -> dict:
+        """
+        汇总预取的效果：截图和预处理的总耗时中，调用方实际等待的部分越少，重叠越充分；
+        过时丢弃的帧不计入
+        Returns:
+            dict: {'frames', 'stale', 'capture_seconds', 'prepare_seconds', 'wait_seconds',
+                   'hidden_seconds', 'overlap'}
+        """
+        produce = max(0.0, self.capture_stats.busy + self.prepare_stats.busy - self.stale_seconds)
+        hidden = max(0.0, produce - self.wait_seconds)
+        return {
+            'frames': self.frames,
+            'stale': self.stale,
+            'capture_seconds': self.capture_stats.busy,
+            'prepare_seconds': self.prepare_stats.busy,
+            'wait_seconds': self.wait_seconds,
+            'hidden_seconds': hidden,
+            'overlap': hidden / produce if produce > 0 else 0.0
+        }
+
+    def print_report(self):
+        r = self.report()
+        print(f"截图预取: {r['frames']} 帧(过时丢弃 {r['stale']} 帧), 截图 {r['capture_seconds']:.2f} 秒, "
+              f"预处理 {r['prepare_seconds']:.2f} 秒, 等待 {r['wait_seconds']:.2f} 秒, "
+              f"被隐藏 {r['hidden_seconds']:.2f} 秒({r['overlap'] * 100:.0f}%)")
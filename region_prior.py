@@ -0,0 +1,130 @@
+import json
+import os
+import cv2
+import numpy as np
+# 关闭按钮位置先验：统计历史匹配位置在屏幕网格中的分布，匹配时优先搜索高概率区域
+
+
+class RegionPrior:
+    def __init__(self, cols: int = 12, rows: int = 24):
+        """
+        初始化位置先验
+        Args:
+            cols: 屏幕横向划分的格子数
+            rows: 屏幕纵向划分的格子数
+        """
+        self.cols = cols
+        self.rows = rows
+        self.counts = np.zeros((rows, cols), dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return float(self.counts.sum())
+
+    def update(self, box, frame_shape, weight: float = 1.0):
+        """
+        记录一次匹配位置(在线更新)
+        Args:
+            box: 匹配框(x1,y1,x2,y2)
+            frame_shape: 截图尺寸(height, width, ...)
+            weight: 该次记录的权重
+        """
+        height, width = frame_shape[:2]
+        x1, y1, x2, y2 = box[:4]
+        # 以框覆盖的格子计数，避免大框只落在一个格子里
+        c1 = int(np.clip(x1 / width * self.cols, 0, self.cols - 1))
+        c2 = int(np.clip((x2 - 1) / width * self.cols, 0, self.cols - 1))
+        r1 = int(np.clip(y1 / height * self.rows, 0, self.rows - 1))
+        r2 = int(np.clip((y2 - 1) / height * self.rows, 0, self.rows - 1))
+        cells = (r2 - r1 + 1) * (c2 - c1 + 1)
+        self.counts[r1:r2 + 1, c1:c2 + 1] += weight / cells
+
+    def regions(self, frame_shape, mass: float = 0.9, pad: int = 0):
+        """
+        获取覆盖大部分历史匹配的高概率区域
+        Args:
+            frame_shape: 截图尺寸(height, width, ...)
+            mass: 需要覆盖的历史匹配比例
+            pad: 每个区域向外扩展的像素数，通常取最大模板尺寸，保证区域边缘的目标能被完整匹配
+        Returns:
+            list: 区域列表，每项格式为(x1,y1,x2,y2)；没有历史数据时返回空列表
+        """
+        total = self.total
+        if total <= 0:
+            return []
+
+        # 按计数从高到低选取格子，直到覆盖指定比例
+        flat = self.counts.ravel()
+        order = np.argsort(-flat, kind="stable")
+        cumulative = np.cumsum(flat[order])
+        count = int(np.searchsorted(cumulative, mass * total) + 1)
+        mask = np.zeros(flat.shape, dtype=np.uint8)
+        mask[order[:count]] = 1
+        mask = mask.reshape(self.rows, self.cols)
+
+        # 相邻的格子合并为一个矩形区域
+        height, width = frame_shape[:2]
+        cell_w = width / self.cols
+        cell_h = height / self.rows
+        num, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        regions = []
+        for label in range(1, num):
+            c, r, w, h = stats[label, :4]
+            x1 = max(0, int(c * cell_w) - pad)
+            y1 = max(0, int(r * cell_h) - pad)
+            x2 = min(width, int(np.ceil((c + w) * cell_w)) + pad)
+            y2 = min(height, int(np.ceil((r + h) * cell_h)) + pad)
+            regions.append((x1, y1, x2, y2))
+        return regions
+
+    def save(self, path: str):
+        """
+        保存先验到文件
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'cols': self.cols, 'rows': self.rows,
+                       'counts': np.round(self.counts, 4).tolist()}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        从文件加载先验
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        prior = cls(data['cols'], data['rows'])
+        prior.counts = np.array(data['counts'], dtype=np.float64)
+        return prior
+
+    @classmethod
+    def load_or_create(cls, path: str, cols: int = 12, rows: int = 24):
+        """
+        文件存在时加载先验，否则新建一个空的先验
+        """
+        if path and os.path.exists(path):
+            try:
+                return cls.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"读取位置先验失败，重新统计: {str(e)}")
+        return cls(cols, rows)
+
+    @classmethod
+    def from_results(cls, results, frame_shape, cols: int = 12, rows: int = 24):
+        """
+        从已保存的检测结果建立先验
+        Args:
+            results: {文件名: [匹配结果]}，匹配结果为(x1,y1,x2,y2)或带'position'的字典，
+                     例如BatchManifest.results()的返回值
+            frame_shape: 截图尺寸(height, width, ...)
+        Returns:
+            RegionPrior: 位置先验
+        """
+        prior = cls(cols, rows)
+        for matches in results.values():
+            for match in matches:
+                box = match['position'] if isinstance(match, dict) else match
+                prior.update(box, frame_shape)
+        return prior
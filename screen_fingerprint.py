@@ -0,0 +1,154 @@
+import cv2
+import numpy as np
+# 屏幕指纹：把截图缩成很小的灰度图后计算感知哈希，用整数的汉明距离快速判断两个画面是否相同
+
+# 状态栏占屏幕高度的比例，时钟、电量变化不应影响指纹
+STATUS_BAR_RATIO = 0.04
+# 底部导航栏占屏幕高度的比例，默认不屏蔽；导航栏会随应用变色或显示输入法切换按钮时可设为0.05左右
+NAV_BAR_RATIO = 0.0
+# 默认哈希边长，指纹为HASH_SIZE*HASH_SIZE位
+HASH_SIZE = 16
+
+
+def _masked_gray(img: np.ndarray, status_bar_ratio: float, nav_bar_ratio: float) -> np.ndarray:
+    """
+    去掉状态栏和导航栏并转为灰度
+    """
+    height = img.shape[0]
+    top = int(height * status_bar_ratio)
+    bottom = height - int(height * nav_bar_ratio)
+    img = img[top:bottom]
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def dhash(img: np.ndarray, hash_size: int = HASH_SIZE, status_bar_ratio: float = STATUS_BAR_RATIO,
+          nav_bar_ratio: float = NAV_BAR_RATIO) -> int:
+    """
+    计算差值哈希(dHash)：比较缩略图中相邻像素的明暗
+    Args:
+        img: BGR或灰度截图
+        hash_size: 哈希边长，结果为hash_size*hash_size位
+        status_bar_ratio: 忽略顶部状态栏的高度比例
+        nav_bar_ratio: 忽略底部导航栏的高度比例
+    Returns:
+        int: 指纹
+    """
+    gray = _masked_gray(img, status_bar_ratio, nav_bar_ratio)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    两个指纹之间不同的位数
+    """
+    return (a ^ b).bit_count()
+
+
+def thumbnail(img: np.ndarray, size=(32, 64), status_bar_ratio: float = STATUS_BAR_RATIO,
+              nav_bar_ratio: float = NAV_BAR_RATIO) -> np.ndarray:
+    """
+    生成灰度缩略图，用于发现局部变化(例如桌面上新增一个图标)，这类变化对哈希的影响很小
+    Args:
+        img: BGR或灰度截图
+        size: 缩略图尺寸(宽, 高)
+        status_bar_ratio: 忽略顶部状态栏的高度比例
+        nav_bar_ratio: 忽略底部导航栏的高度比例
+    Returns:
+        np.ndarray: uint8灰度缩略图
+    """
+    gray = _masked_gray(img, status_bar_ratio, nav_bar_ratio)
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+def max_pixel_diff(thumb1: np.ndarray, thumb2: np.ndarray) -> int:
+    """
+    两张缩略图逐像素差的最大值
+    """
+    return int(np.abs(thumb1.astype(np.int16) - thumb2.astype(np.int16)).max())
+
+
+def ssim(thumb1: np.ndarray, thumb2: np.ndarray) -> float:
+    """
+    两张缩略图的结构相似度(SSIM)，对整体亮度变化不敏感，对布局变化敏感
+    Args:
+        thumb1, thumb2: 相同尺寸的灰度缩略图
+    Returns:
+        float: 平均SSIM，1表示完全相同
+    """
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    a = thumb1.astype(np.float32)
+    b = thumb2.astype(np.float32)
+    blur = lambda x: cv2.GaussianBlur(x, (7, 7), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a * mu_a
+    var_b = blur(b * b) - mu_b * mu_b
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2) /
+                ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)))
+    return float(ssim_map.mean())
+
+
+def fingerprint(img: np.ndarray, status_bar_ratio: float = STATUS_BAR_RATIO,
+                nav_bar_ratio: float = NAV_BAR_RATIO) -> tuple:
+    """
+    截图指纹：(差值哈希, 灰度缩略图)；缩略图只有2KB，可以长期保存，比较时不再需要原图
+    Args:
+        img: BGR或灰度截图，也可以是以cv2.IMREAD_REDUCED_GRAYSCALE_*解码的小图
+        status_bar_ratio: 忽略顶部状态栏的高度比例
+        nav_bar_ratio: 忽略底部导航栏的高度比例
+    """
+    return (dhash(img, status_bar_ratio=status_bar_ratio, nav_bar_ratio=nav_bar_ratio),
+            thumbnail(img, status_bar_ratio=status_bar_ratio, nav_bar_ratio=nav_bar_ratio))
+
+
+def decode_fingerprint(data: bytes, status_bar_ratio: float = STATUS_BAR_RATIO,
+                       nav_bar_ratio: float = NAV_BAR_RATIO):
+    """
+    直接从截图数据计算指纹：以1/4分辨率灰度解码，比完整解码快得多
+    Args:
+        data: PNG等编码的截图数据
+    Returns:
+        tuple: 指纹，解码失败时返回None
+    """
+    small = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if small is None:
+        return None
+    return fingerprint(small, status_bar_ratio, nav_bar_ratio)
+
+
+def same_screen(fp1: tuple, fp2: tuple, max_distance: int = 4, max_pixel_change: int = 24,
+                min_ssim: float = None) -> bool:
+    """
+    根据指纹判断两张截图是否是同一画面
+    Args:
+        fp1, fp2: fingerprint()的返回值
+        max_distance: 哈希汉明距离上限
+        max_pixel_change: 缩略图像素变化上限，None表示不检查
+        min_ssim: 缩略图SSIM下限，None表示不检查
+    Returns:
+        bool: 各项都在阈值内时返回True
+    """
+    if fp1 is None or fp2 is None or fp1[1].shape != fp2[1].shape:
+        return False
+    if hamming(fp1[0], fp2[0]) > max_distance:
+        return False
+    if max_pixel_change is not None and max_pixel_diff(fp1[1], fp2[1]) > max_pixel_change:
+        return False
+    if min_ssim is not None and ssim(fp1[1], fp2[1]) < min_ssim:
+        return False
+    return True
+
+
+def is_similar(fp1: tuple, fp2: tuple, threshold: float = 0.95) -> bool:
+    """
+    按相似度阈值判断两个指纹是否为同一页面：哈希相同位的比例和缩略图SSIM都不低于阈值
+    Args:
+        fp1, fp2: fingerprint()的返回值
+        threshold: 相似度阈值(0~1)
+    """
+    bits = HASH_SIZE * HASH_SIZE
+    return same_screen(fp1, fp2, max_distance=int((1 - threshold) * bits),
+                       max_pixel_change=None, min_ssim=threshold)
@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import zipfile
+import clock
+import controller
+import tracing
+# 会话录制与离线回放：录制真实运行时的截图和操作，回放时用录制的截图代替controller的adb操作，
+# 没有手机和ADB的机器上也能确定性地测试和衡量handle_app_startup、detect_icons、test_detection
+
+# 录制和回放的controller函数 -> 事件类型
+_ACTIONS = {
+    'click_position': "tap",
+    'press_home': "home",
+    'press_back': "back",
+    'press_recent': "recent",
+    'launch_app': "launch",
+}
+# 录制和回放的controller查询函数(不改变设备状态，不作为分段的操作)
+_QUERIES = ["dumpsys_foreground"]
+# 回放时替换的全部controller函数
+_REPLACED = ["capture_phone_screen"] + list(_ACTIONS) + _QUERIES + ["shell_available"]
+EVENTS_NAME = "events.jsonl"
+META_NAME = "meta.json"
+
+
+class SessionRecorder:
+    def __init__(self, path: str):
+        """
+        录制会话：截图和操作仍由真实设备执行，同时写入会话文件
+        Args:
+            path: 会话文件(zip)；内容相同的截图只保存一份
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        self._frames = set()
+        self._events = []
+        self._originals = {}
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def _record(self, event: dict):
+        event['t'] = round(time.time() - self._start, 3)
+        with self._lock:
+            self._events.append(event)
+
+    def _capture(self, device_id: str = None):
+        data = self._originals['capture_phone_screen'](device_id)
+        if data is None:
+            self._record({'type': "capture", 'frame': None})
+            return None
+        # PNG本身已压缩，按内容去重即可让静止画面只占一份空间
+        name = f"frames/{hashlib.sha1(data).hexdigest()}.png"
+        with self._lock:
+            if name not in self._frames:
+                self._frames.add(name)
+                self._zip.writestr(name, data)
+        self._record({'type': "capture", 'frame': name})
+        return data
+
+    def _wrap_action(self, func_name: str):
+        original = self._originals[func_name]
+        action = _ACTIONS[func_name]
+
+        def wrapper(*args, **kwargs):
+            result = original(*args, **kwargs)
+            event = {'type': action}
+            if action == "tap":
+                event['x'], event['y'] = int(args[0]), int(args[1])
+            elif action == "launch":
+                event['package'] = args[0] if args else kwargs.get('package')
+            self._record(event)
+            return result
+        return wrapper
+
+    def _wrap_query(self, func_name: str):
+        original = self._originals[func_name]
+
+        def wrapper(*args, **kwargs):
+            result = original(*args, **kwargs)
+            self._record({'type': "query", 'name': func_name, 'output': result})
+            return result
+        return wrapper
+
+    def start(self):
+        """
+        替换controller的截图、操作和查询函数，开始录制
+        """
+        for name in ["capture_phone_screen"] + list(_ACTIONS) + _QUERIES:
+            self._originals[name] = getattr(controller, name)
+        controller.capture_phone_screen = self._capture
+        for name in _ACTIONS:
+            setattr(controller, name, self._wrap_action(name))
+        for name in _QUERIES:
+            setattr(controller, name, self._wrap_query(name))
+        return self
+
+    def stop(self):
+        """
+        恢复controller函数并写入事件列表
+        """
+        for name, func in self._originals.items():
+            setattr(controller, name, func)
+        self._originals = {}
+        with self._lock:
+            self._zip.writestr(EVENTS_NAME, "".join(
+                json.dumps(event, ensure_ascii=False) + "\n" for event in self._events))
+            self._zip.writestr(META_NAME, json.dumps({
+                'created': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._start)),
+                'events': len(self._events),
+                'frames': len(self._frames)
+            }, ensure_ascii=False))
+            self._zip.close()
+        print(f"会话已保存: {self.path}(事件 {len(self._events)} 个, 截图 {len(self._frames)} 张)")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ReplayDevice:
+    def __init__(self, path: str, strict: bool = False, virtual_clock: bool = True, tap_tolerance: int = 20):
+        """
+        回放设备：按录制的操作顺序提供截图
+        录制的事件以操作为界分成若干段，执行第k个操作后截图返回第k段录制的截图，
+        截图次数多于录制时重复该段最后一张(画面静止)，少于录制时剩余截图被跳过
+        Args:
+            path: SessionRecorder录制的会话文件
+            strict: 操作与录制不一致时是否抛出异常，否则只计数
+            virtual_clock: 是否安装虚拟时钟(clock.install)：流程中的等待(tracing.sleep/clock.sleep)立即返回并推进
+                           虚拟时间，截图预取改为在调用方线程中同步截图，每段的截图次数只取决于操作顺序和画面内容；
+                           只影响经过clock模块的计时，不修改time模块，其他线程(如SQLite、追踪)不受影响
+            tap_tolerance: 点击坐标与录制相差不超过该像素数视为同一操作
+        """
+        self.path = path
+        self.strict = strict
+        self.virtual_clock = virtual_clock
+        self._clock = None
+        self._previous_clock = None
+        self.tap_tolerance = tap_tolerance
+        self._zip = zipfile.ZipFile(path, "r")
+        with self._zip.open(EVENTS_NAME) as f:
+            events = [json.loads(line) for line in f.read().decode("utf-8").splitlines() if line.strip()]
+
+        # segments[k]: 第k个操作之后的截图；queries[k]: 第k个操作之后的查询结果；actions[k]: 第k+1个操作
+        self.segments = [[]]
+        self.queries = [{}]
+        self.actions = []
+        for event in events:
+            if event['type'] == "capture":
+                self.segments[-1].append(event['frame'])
+            elif event['type'] == "query":
+                self.queries[-1].setdefault(event['name'], []).append(event['output'])
+            else:
+                self.actions.append(event)
+                self.segments.append([])
+                self.queries.append({})
+        # 录制时有成功的前台查询才视为adb可用，否则回放时只做画面稳定判断
+        self._shell_available = any(output is not None for segment in self.queries
+                                    for output in segment.get("dumpsys_foreground", []))
+        self._query_cursor = {}
+        self._frame_cache = {}
+        self._segment = 0
+        self._cursor = 0
+        self._last_frame = None
+        self._lock = threading.Lock()
+        self._originals = {}
+        self.stats = {'captures': 0, 'actions': 0, 'mismatches': 0}
+
+    def _read_frame(self, name):
+        if name is None:
+            return None
+        if name not in self._frame_cache:
+            self._frame_cache[name] = self._zip.read(name)
+        return self._frame_cache[name]
+
+    def capture_phone_screen(self, device_id: str = None):
+        """
+        返回当前段的下一张录制截图
+        """
+        with tracing.span("capture", "adb", replay=True), self._lock:
+            self.stats['captures'] += 1
+            segment = self.segments[min(self._segment, len(self.segments) - 1)]
+            if self._cursor < len(segment):
+                self._last_frame = segment[self._cursor]
+                self._cursor += 1
+            return self._read_frame(self._last_frame)
+
+    def _query(self, name: str):
+        """
+        返回当前段的下一个录制的查询结果，用完后重复该段最后一个(状态不再变化)
+        """
+        with self._lock:
+            outputs = self.queries[min(self._segment, len(self.queries) - 1)].get(name, [])
+            cursor = self._query_cursor.get(name, 0)
+            if cursor < len(outputs):
+                self._query_cursor[name] = cursor + 1
+                return outputs[cursor]
+            return outputs[-1] if outputs else None
+
+    def dumpsys_foreground(self, device_id: str = None):
+        return self._query("dumpsys_foreground")
+
+    def shell_available(self, device_id: str = None):
+        return self._shell_available
+
+    def _action(self, action: str, x: int = None, y: int = None, package: str = None):
+        with tracing.span({'tap': "tap", 'launch': "launch_app"}.get(action, "keyevent"), "adb",
+                          action=action, replay=True), self._lock:
+            self.stats['actions'] += 1
+            expected = self.actions[self._segment] if self._segment < len(self.actions) else None
+            matched = expected is not None and expected['type'] == action
+            if matched and action == "tap":
+                matched = (abs(expected['x'] - x) <= self.tap_tolerance and
+                           abs(expected['y'] - y) <= self.tap_tolerance)
+            elif matched and action == "launch":
+                matched = expected.get('package') == package
+            if not matched:
+                self.stats['mismatches'] += 1
+                detail = (x, y) if x is not None else package or ''
+                message = f"回放操作与录制不一致: 执行 {action}{detail}, 录制为 {expected}"
+                if self.strict:
+                    raise Exception(message)
+                print(message)
+            self._segment += 1
+            self._cursor = 0
+            self._query_cursor = {}
+        return True
+
+    def click_position(self, x: int, y: int, device_id: str = None):
+        return self._action("tap", int(x), int(y))
+
+    def press_home(self, device_id: str = None):
+        return self._action("home")
+
+    def press_back(self, device_id: str = None):
+        return self._action("back")
+
+    def press_recent(self, device_id: str = None):
+        return self._action("recent")
+
+    def launch_app(self, package: str, device_id: str = None):
+        return self._action("launch", package=package)
+
+    def install(self):
+        """
+        用回放设备替换controller的截图、操作和查询函数
+        """
+        for name in _REPLACED:
+            self._originals[name] = getattr(controller, name)
+            setattr(controller, name, getattr(self, name))
+        if self.virtual_clock:
+            # 跳过的等待计入虚拟时钟，依赖耗时判断的逻辑(如画面静止多久)仍能正常推进
+            self._clock = clock.VirtualClock()
+            self._previous_clock = clock.install(self._clock)
+        return self
+
+    def restore(self):
+        """
+        恢复controller函数和时钟
+        """
+        for name in _REPLACED:
+            if name in self._originals:
+                setattr(controller, name, self._originals[name])
+        if self._clock is not None:
+            clock.install(self._previous_clock)
+        self._originals = {}
+        self._zip.close()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.restore()
+
+    def report(self) -> dict:
+        """
+        回放统计：截图次数、操作次数、与录制不一致的操作数、未执行的录制操作数、跳过的等待时间
+        """
+        skipped = self._clock.slept if self._clock is not None else 0.0
+        return dict(self.stats, skipped_sleep=skipped, remaining_actions=max(0, len(self.actions) - self._segment))
+
+
+def _run_flow(flow: str):
+    """
+    运行需要回放的流程(延迟导入，只加载用到的模型)
+    """
+    if flow == "handle_app_startup":
+        from grounding_dino import handle_app_startup
+        return handle_app_startup()
+    if flow == "detect_icons":
+        from grounding_dino import detect_icons
+        return detect_icons(save_debug=False)
+    if flow == "test_detection":
+        from appQuery import test_detection
+        return test_detection()
+    raise ValueError(f"未知流程: {flow}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="录制或回放会话")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("session", help="会话文件(zip)")
+    parser.add_argument("--flow", default="handle_app_startup",
+                        choices=["handle_app_startup", "detect_icons", "test_detection"])
+    parser.add_argument("--strict", action="store_true", help="操作与录制不一致时报错(用于回归测试)")
+    parser.add_argument("--real-sleep", action="store_true", help="回放时保留实际等待")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        with SessionRecorder(args.session):
+            _run_flow(args.flow)
+    else:
+        start = time.perf_counter()
+        with ReplayDevice(args.session, strict=args.strict, virtual_clock=not args.real_sleep) as device:
+            _run_flow(args.flow)
+            report = device.report()
+        report['wall_seconds'] = time.perf_counter() - start
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if args.strict and (report['mismatches'] or report['remaining_actions']):
+            raise SystemExit(1)
@@ -2,51 +2,42 @@ from cnocr import CnOcr
 import numpy as np
 import cv2
 import os
-import re  # 添加正则表达式模块
+from keyword_index import match_ocr_results
+from manifest import BatchManifest
+from frame_store import iter_frames
+import tracing
 
-def detect_text_buttons(image, keywords=None):
+# 文字检测逻辑的版本号，修改检测逻辑后递增，批处理清单会据此重新处理所有图片
+TEXT_DETECTOR_VERSION = "1"
+
+def detect_text_buttons(image, keywords=None, max_distance=0):
     """
     检测图片中的文字，并返回与关键词匹配的位置信息
     支持使用'.'作为通配符匹配任意字符
     Args:
         image: numpy数组格式的图片
         keywords: 要搜索的关键词列表，默认为["跳过","同意.继续"]
+        max_distance: 容忍的OCR错字数(编辑距离)，0表示只做精确匹配
     Returns:
-        list: 包含关键词位置信息的列表，每项格式为 {'text': str, 'position': (x1,y1,x2,y2)}
+        list: 包含关键词位置信息的列表，每项格式为
+              {'text': str, 'position': (x1,y1,x2,y2), 'keyword': str, 'score': float}
     """
     try:
         if keywords is None:
             keywords = ["跳过", "同意.继续"]  # 示例：匹配"同意并继续"、"同意和继续"等
             
         # 初始化识别器
-        ocr = CnOcr()
+        with tracing.span("ocr_init", "ocr"):
+            ocr = CnOcr()
         
         # 执行文字识别
-        results = ocr.ocr(image)
+        with tracing.span("ocr", "ocr") as span:
+            results = ocr.ocr(image)
+            span.set(lines=len(results))
         
-        # 存储匹配的结果
-        matched_texts = []
-        
-        # 处理识别结果
-        for result in results:
-            text = result['text'].strip()  # 去除首尾空白
-            box = result['position']
-            
-            # 检查是否匹配关键词
-            for keyword in keywords:
-                # 直接使用keyword作为正则表达式模式
-                if re.match(f"^{keyword}$", text):
-                    # 转换坐标格式为(x1,y1,x2,y2)
-                    x1 = min(box[0][0], box[3][0])
-                    y1 = min(box[0][1], box[1][1])
-                    x2 = max(box[1][0], box[2][0])
-                    y2 = max(box[2][1], box[3][1])
-                    
-                    matched_texts.append({
-                        'text': text,
-                        'position': (int(x1), int(y1), int(x2), int(y2))
-                    })
-                    break
+        # 匹配关键词并转换坐标
+        with tracing.span("match_keywords", "ocr"):
+            matched_texts = match_ocr_results(results, keywords, max_distance)
         
         return matched_texts
         
@@ -58,13 +49,16 @@ def detect_text_buttons(image, keywords=None):
 下面的代码为上面函数的测试代码，之后可以将下面的代码删除掉
 '''
 
-def process_all_images(input_dir="imgs/ads", output_dir="output/ads"):
+def process_all_images(input_dir="imgs/ads", output_dir="output/ads", incremental=True, frame_store=None):
     """
     处理指定目录下的所有图片
     Args:
         input_dir: 输入图片目录
         output_dir: 输出结果目录
+        incremental: 是否只处理新增或变化的图片(依据输出目录中的清单)
+        frame_store: 帧存储目录(如"imgs/ads.frames")，提供时图片只解码一次，之后从存储中读取
     """
+    manifest = None
     try:
         # 创建输出目录
         if not os.path.exists(output_dir):
@@ -76,57 +70,81 @@ def process_all_images(input_dir="imgs/ads", output_dir="output/ads"):
         
         print(f"找到 {len(image_files)} 个图片文件")
         
+        keywords = [
+            "跳过.*",
+            "确认",
+            "始终允许",
+            "同意.继续",
+            "确定",
+            "是",
+            "进入",
+            "X",
+            "同意"
+        ]
+        
+        if incremental:
+            manifest = BatchManifest(output_dir, "text_buttons", TEXT_DETECTOR_VERSION,
+                                     {'keywords': keywords})
+            image_files = [f for f in image_files
+                           if manifest.needs_processing(os.path.join(input_dir, f))]
+            print(f"其中 {len(image_files)} 个需要处理")
+        
         # 处理每个图片
-        for image_file in image_files:
-            input_path = os.path.join(input_dir, image_file)
+        for image_file, input_path, img in iter_frames(input_dir, image_files, frame_store):
             print(f"\n处理图片: {input_path}")
             
-            # 读取图片
-            img = cv2.imread(input_path)
+            # 读取图片(使用帧存储时不再解码)
             if img is None:
                 print(f"无法读取图片: {input_path}")
+                if manifest is not None:
+                    manifest.mark_failed(input_path, "无法读取图片")
                 continue
                 
-            # 执行文字检测
-            keywords = [
-                "跳过.*",
-                "确认",
-                "始终允许",
-                "同意.继续",
-                "确定",
-                "是",
-                "进入",
-                "X",
-                "同意"
-            ]
-            text_results = detect_text_buttons(img, keywords)
-            
-            # 在图片上绘制检测结果
-            for result in text_results:
-                # 获取位置信息
-                x1, y1, x2, y2 = result['position']
+            try:
+                # 执行文字检测
+                with tracing.span("detect_text_buttons", "flow", image=image_file):
+                    text_results = detect_text_buttons(img, keywords)
                 
-                # 只绘制矩形框，不添加文字标签
-                cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            
-            # 保存结果
-            output_path = os.path.join(output_dir, f"detected_{image_file}")
-            cv2.imwrite(output_path, img)
-            print(f"检测结果已保存: {output_path}")
-            print(f"检测到的文字:")
-            for result in text_results:
-                print(f"文字: {result['text']}, 位置: {result['position']}")
+                # 在图片上绘制检测结果
+                for result in text_results:
+                    # 获取位置信息
+                    x1, y1, x2, y2 = result['position']
+                    
+                    # 只绘制矩形框，不添加文字标签
+                    cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                
+                # 保存结果
+                output_path = os.path.join(output_dir, f"detected_{image_file}")
+                cv2.imwrite(output_path, img)
+                if manifest is not None:
+                    manifest.mark_done(input_path, output_path, text_results)
+                print(f"检测结果已保存: {output_path}")
+                print(f"检测到的文字:")
+                for result in text_results:
+                    print(f"文字: {result['text']}, 位置: {result['position']}")
+            except Exception as e:
+                # 单张图片出错时记录失败并继续处理其余图片，下次运行重试
+                print(f"处理图片失败: {input_path}: {str(e)}")
+                if manifest is not None:
+                    manifest.mark_failed(input_path, str(e))
             
     except Exception as e:
         print(f"批量处理过程发生错误: {str(e)}")
+    finally:
+        # 中途出错时也保存已完成的部分，下次运行从断点继续
+        if manifest is not None:
+            manifest.save()
 
-def process_all_text(input_dir="imgs/ads", output_dir="output/ads"):
+def process_all_text(input_dir="imgs/ads", output_dir="output/ads", incremental=True, frame_store=None):
     """
     处理指定目录下的所有图片，标注所有识别到的文字
     Args:
         input_dir: 输入图片目录
         output_dir: 输出结果目录
+        incremental: 是否只处理新增或变化的图片(依据输出目录中的清单)
+        frame_store: 帧存储目录(如"imgs/ads.frames")，提供时图片只解码一次，之后从存储中读取
     """
+    manifest = None
     try:
         # 创建输出目录
         if not os.path.exists(output_dir):
@@ -138,48 +156,66 @@ def process_all_text(input_dir="imgs/ads", output_dir="output/ads"):
         
         print(f"找到 {len(image_files)} 个图片文件")
         
+        if incremental:
+            manifest = BatchManifest(output_dir, "all_text", TEXT_DETECTOR_VERSION)
+            image_files = [f for f in image_files
+                           if manifest.needs_processing(os.path.join(input_dir, f))]
+            print(f"其中 {len(image_files)} 个需要处理")
+        
         # 初始化识别器
-        ocr = CnOcr()
+        with tracing.span("ocr_init", "ocr"):
+            ocr = CnOcr()
         
         # 处理每个图片
-        for image_file in image_files:
-            input_path = os.path.join(input_dir, image_file)
+        for image_file, input_path, img in iter_frames(input_dir, image_files, frame_store):
             print(f"\n处理图片: {input_path}")
             
-            # 读取图片
-            img = cv2.imread(input_path)
+            # 读取图片(使用帧存储时不再解码)
             if img is None:
                 print(f"无法读取图片: {input_path}")
+                if manifest is not None:
+                    manifest.mark_failed(input_path, "无法读取图片")
                 continue
                 
-            # 执行文字检测
-            results = ocr.ocr(img)
-            
-            # 在图片上绘制所有检测结果
-            for result in results:
-                # 获取位置信息
-                box = result['position']  # 格式为[[x1,y1], [x2,y1], [x2,y2], [x1,y2]]
-                text = result['text']
+            try:
+                # 执行文字检测
+                with tracing.span("ocr", "ocr", image=image_file):
+                    results = ocr.ocr(img)
                 
-                # 转换坐标格式为(x1,y1,x2,y2)
-                x1 = min(box[0][0], box[3][0])
-                y1 = min(box[0][1], box[1][1])
-                x2 = max(box[1][0], box[2][0])
-                y2 = max(box[2][1], box[3][1])
+                # 在图片上绘制所有检测结果
+                for result in results:
+                    # 获取位置信息
+                    box = result['position']  # 格式为[[x1,y1], [x2,y1], [x2,y2], [x1,y2]]
+                    text = result['text']
+                    
+                    # 转换坐标格式为(x1,y1,x2,y2)
+                    x1 = min(box[0][0], box[3][0])
+                    y1 = min(box[0][1], box[1][1])
+                    x2 = max(box[1][0], box[2][0])
+                    y2 = max(box[2][1], box[3][1])
+                    
+                    # 绘制矩形框
+                    cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
                 
-                # 绘制矩形框
-                cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-            
-            # 保存结果
-            output_path = os.path.join(output_dir, f"all_text_{image_file}")
-            cv2.imwrite(output_path, img)
-            print(f"检测结果已保存: {output_path}")
-            print(f"检测到的文字:")
-            for result in results:
-                print(f"文字: {result['text']}")
+                # 保存结果
+                output_path = os.path.join(output_dir, f"all_text_{image_file}")
+                cv2.imwrite(output_path, img)
+                if manifest is not None:
+                    manifest.mark_done(input_path, output_path, [r['text'] for r in results])
+                print(f"检测结果已保存: {output_path}")
+                print(f"检测到的文字:")
+                for result in results:
+                    print(f"文字: {result['text']}")
+            except Exception as e:
+                print(f"处理图片失败: {input_path}: {str(e)}")
+                if manifest is not None:
+                    manifest.mark_failed(input_path, str(e))
             
     except Exception as e:
         print(f"批量处理过程发生错误: {str(e)}")
+    finally:
+        if manifest is not None:
+            manifest.save()
 
 if __name__ == "__main__":
     # 原有的按关键词检测
@@ -1,6 +1,22 @@
 import cv2
 import numpy as np
 import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from manifest import BatchManifest, file_digest
+from box_utils import nms
+from region_prior import RegionPrior
+from pipeline import StagedPipeline
+from frame_store import FrameStore, iter_frames
+import tracing
+
+# 模板匹配逻辑的版本号，修改匹配逻辑后递增，批处理清单会据此重新处理所有图片
+CROSS_DETECTOR_VERSION = "2"
+
+# 合并匹配框时的重叠阈值(交集占较低分框自身面积的比例)
+MATCH_OVERLAP_THRESH = 0.3
 
 def preprocess_image(image):
     """
@@ -10,126 +26,563 @@ def preprocess_image(image):
     Returns:
         处理后的图片
     """
-    # 转换为灰度图
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # 使用边缘检测
-    edges = cv2.Canny(gray, 50, 150)
-    
-    # 使用高斯模糊减少噪声
-    blurred = cv2.GaussianBlur(edges, (5, 5), 0)
+    with tracing.span("preprocess", "match"):
+        # 转换为灰度图
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        # 使用边缘检测
+        edges = cv2.Canny(gray, 50, 150)
+        
+        # 使用高斯模糊减少噪声
+        blurred = cv2.GaussianBlur(edges, (5, 5), 0)
     
     return blurred
 
-def find_template_matches(image, template, threshold=0.45):
+# 多尺度匹配使用的模板缩放范围
+DEFAULT_SCALES = np.linspace(0.5, 1.5, 20)
+
+def find_template_matches(image, template, threshold=0.45, mode="exhaustive", workers=None,
+                          return_scores=False, prior=None, **pyramid_options):
     """
     在图片中查找与模板匹配的区域，使用多尺度匹配
     Args:
         image: 要搜索的图片
-        template: 模板图片
+        template: 模板图片，也可以是预处理好的TemplateBank
         threshold: 匹配阈值
+        mode: "exhaustive"在原图上逐尺度全图匹配；"pyramid"先在缩小图上粗搜再在原图局部精修
+        workers: 并行匹配的线程数，None或1表示顺序执行
+        return_scores: 是否在每个匹配后附带匹配得分
+        prior: RegionPrior位置先验，提供时先只在高概率区域内匹配，找不到再搜索全图
+        pyramid_options: 传给find_template_matches_pyramid的参数
     Returns:
-        list: 匹配位置列表，每项格式为(x1,y1,x2,y2)
+        list: 匹配位置列表，按得分从高到低排列，每项格式为(x1,y1,x2,y2)，
+              return_scores为True时为(x1,y1,x2,y2,score)
     """
+    if prior is not None:
+        if not isinstance(template, TemplateBank):
+            template = TemplateBank({'template': template})
+        return [list(m['position']) + [m['score']] if return_scores else list(m['position'])
+                for m in match_with_prior(image, template, prior, threshold, workers=workers)]
+    if isinstance(template, TemplateBank):
+        return [list(m['position']) + [m['score']] if return_scores else list(m['position'])
+                for m in template.match(image, threshold, workers=workers)]
+    if mode == "pyramid":
+        return find_template_matches_pyramid(image, template, threshold,
+                                             return_scores=return_scores, **pyramid_options)
+    
     # 预处理图片和模板
     processed_image = preprocess_image(image)
     processed_template = preprocess_image(template)
     
-    matches = []
-    
     # 定义缩放范围
-    scales = np.linspace(0.5, 1.5, 20)
+    scales = DEFAULT_SCALES
     
-    # 在不同尺度下进行匹配
+    # 调整模板大小
+    resized_templates = []
     for scale in scales:
-        # 调整模板大小
         width = int(processed_template.shape[1] * scale)
         height = int(processed_template.shape[0] * scale)
-        resized_template = cv2.resize(processed_template, (width, height))
-        
+        resized_templates.append(cv2.resize(processed_template, (width, height)))
+    
+    # 在不同尺度下进行匹配
+    results = _run_match_jobs(processed_image, resized_templates, threshold, workers)
+    boxes = np.concatenate([r[0] for r in results])
+    scores = np.concatenate([r[1] for r in results])
+    
+    # 合并重叠的框
+    return _merge_matches(boxes, scores, return_scores)
+
+def _merge_matches(boxes, scores, return_scores=False):
+    """
+    按得分做非极大值抑制，转换为列表形式的结果
+    """
+    if len(boxes) == 0:
+        return []
+    pick = nms(boxes, scores, MATCH_OVERLAP_THRESH, metric="overlap")
+    if return_scores:
+        return [[int(v) for v in boxes[k]] + [float(scores[k])] for k in pick]
+    return [[int(v) for v in boxes[k]] for k in pick]
+
+# 按线程数缓存的线程池，避免每帧创建线程
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+def _get_executor(workers):
+    """
+    获取指定线程数的共享线程池(多个线程同时调用时只创建一个)
+    """
+    with _EXECUTORS_LOCK:
+        executor = _EXECUTORS.get(workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="template-match")
+            _EXECUTORS[workers] = executor
+        return executor
+
+def extract_peaks(result, threshold, width, height):
+    """
+    从匹配得分图中提取局部极大值，代替把所有超过阈值的位置都当作候选
+    Args:
+        result: cv2.matchTemplate输出的得分图
+        threshold: 匹配阈值
+        width: 模板宽度
+        height: 模板高度
+    Returns:
+        tuple: (boxes, scores)，boxes为Nx4的(x1,y1,x2,y2)数组
+    """
+    # 邻域取模板尺寸的一半：同一目标附近的高分位置只保留最高的一个
+    kernel = np.ones((max(3, height // 2 | 1), max(3, width // 2 | 1)), np.uint8)
+    local_max = cv2.dilate(result, kernel)
+    ys, xs = np.nonzero((result >= threshold) & (result >= local_max))
+    scores = result[ys, xs].astype(np.float64)
+    boxes = np.stack([xs, ys, xs + width, ys + height], axis=1).astype(np.int64)
+    return boxes, scores
+
+def _match_one(processed_image, resized_template, threshold):
+    """
+    在一个尺度上执行模板匹配
+    Returns:
+        tuple: (boxes, scores)，得分图上超过阈值的局部极大值
+    """
+    height, width = resized_template.shape[:2]
+    if width > processed_image.shape[1] or height > processed_image.shape[0]:
+        return np.zeros((0, 4), np.int64), np.zeros(0)
+    
+    with tracing.span("match_template", "match", template=f"{width}x{height}"):
         # 执行模板匹配
         result = cv2.matchTemplate(processed_image, resized_template, cv2.TM_CCOEFF_NORMED)
         
-        # 找到所有匹配位置
-        locations = np.where(result >= threshold)
-        
-        # 转换匹配位置为坐标
-        for pt in zip(*locations[::-1]):
-            x1, y1 = pt
-            x2, y2 = (x1 + width, y1 + height)
-            matches.append((x1, y1, x2, y2))
+        # 提取局部极大值作为匹配位置
+        return extract_peaks(result, threshold, width, height)
+
+def _run_match_jobs(processed_image, resized_templates, threshold, workers=None):
+    """
+    对每个(模板, 尺度)执行匹配；cv2.matchTemplate执行时会释放GIL，多个任务可以在线程池中并行，
+    所有任务共享同一张只读的预处理图片
+    Returns:
+        list: 与resized_templates顺序一一对应的匹配结果，合并顺序与并行与否无关
+    """
+    if not workers or workers <= 1 or len(resized_templates) <= 1:
+        return [_match_one(processed_image, t, threshold) for t in resized_templates]
+    
+    executor = _get_executor(workers)
+    # map按提交顺序返回结果，保证合并结果是确定的
+    # 匹配在线程池中执行，带上调用方线程的追踪标签
+    return list(executor.map(tracing.bind(lambda t: _match_one(processed_image, t, threshold)),
+                             resized_templates))
+
+def _top_locations(result, count, width, height, min_score):
+    """
+    取匹配结果中得分最高的若干位置，每取一个就屏蔽其邻域，避免同一处被重复选中
+    Returns:
+        list: [(score, x, y), ...]
+    """
+    result = result.copy()
+    found = []
+    for _ in range(count):
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        if not np.isfinite(max_val) or max_val < min_score:
+            break
+        x, y = max_loc
+        found.append((float(max_val), x, y))
+        x1, y1 = max(0, x - width // 2), max(0, y - height // 2)
+        result[y1:y + height // 2 + 1, x1:x + width // 2 + 1] = -1
+    return found
+
+def find_template_matches_pyramid(image, template, threshold=0.45, factor=0.5, top_k=8,
+                                  coarse_ratio=0.8, margin=4, scale_radius=1, return_scores=False):
+    """
+    由粗到细的多尺度模板匹配：先在缩小的边缘图上匹配所有尺度，只保留得分最高的候选位置和尺度，
+    再在原图上候选位置附近的小窗口内按相邻尺度精修
+    Args:
+        image: 要搜索的图片
+        template: 模板图片
+        threshold: 匹配阈值(作用于原图精修结果)
+        factor: 粗搜时的缩小比例
+        top_k: 保留的候选数量
+        coarse_ratio: 粗搜阈值相对threshold的比例，缩小后得分普遍偏低
+        margin: 精修窗口在候选框外扩展的像素数(原图尺度)
+        scale_radius: 精修时在候选尺度两侧各额外尝试的尺度个数
+        return_scores: 是否在每个匹配后附带匹配得分
+    Returns:
+        list: 匹配位置列表，格式与find_template_matches相同
+    """
+    processed_image = preprocess_image(image)
+    processed_template = preprocess_image(template)
+    img_h, img_w = processed_image.shape[:2]
+    tpl_h, tpl_w = processed_template.shape[:2]
+    scales = DEFAULT_SCALES
+    
+    # 粗搜：在缩小图上匹配所有尺度
+    small_image = cv2.resize(processed_image, None, fx=factor, fy=factor,
+                             interpolation=cv2.INTER_AREA)
+    candidates = []
+    for scale_idx, scale in enumerate(scales):
+        small_w = max(1, int(tpl_w * scale * factor))
+        small_h = max(1, int(tpl_h * scale * factor))
+        if small_w > small_image.shape[1] or small_h > small_image.shape[0]:
+            continue
+        small_template = cv2.resize(processed_template, (small_w, small_h),
+                                    interpolation=cv2.INTER_AREA)
+        with tracing.span("coarse_match", "match", scale=float(scale)):
+            result = cv2.matchTemplate(small_image, small_template, cv2.TM_CCOEFF_NORMED)
+        for score, x, y in _top_locations(result, top_k, small_w, small_h,
+                                          threshold * coarse_ratio):
+            candidates.append((score, scale_idx, x, y))
+    
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    candidates = candidates[:top_k]
+    
+    # 精修：在原图候选位置附近的窗口内，用候选尺度及相邻尺度匹配
+    boxes = []
+    scores = []
+    resized_cache = {}
+    for _, scale_idx, x, y in candidates:
+        for idx in range(max(0, scale_idx - scale_radius),
+                         min(len(scales), scale_idx + scale_radius + 1)):
+            width = int(tpl_w * scales[idx])
+            height = int(tpl_h * scales[idx])
+            if idx not in resized_cache:
+                resized_cache[idx] = cv2.resize(processed_template, (width, height))
+            
+            # 粗搜坐标映射回原图，窗口额外覆盖缩放带来的量化误差
+            pad = margin + int(np.ceil(1 / factor))
+            x1 = max(0, int(x / factor) - pad)
+            y1 = max(0, int(y / factor) - pad)
+            x2 = min(img_w, int(x / factor) + width + pad)
+            y2 = min(img_h, int(y / factor) + height + pad)
+            if x2 - x1 < width or y2 - y1 < height:
+                continue
+            
+            window = processed_image[y1:y2, x1:x2]
+            window_boxes, window_scores = _match_one(window, resized_cache[idx], threshold)
+            boxes.append(window_boxes + np.array([x1, y1, x1, y1]))
+            scores.append(window_scores)
+    
+    if not boxes:
+        return []
     
     # 合并重叠的框
-    if matches:
-        matches = non_max_suppression(matches)
+    return _merge_matches(np.concatenate(boxes), np.concatenate(scores), return_scores)
+
+def _box_iou(box1, box2):
+    """
+    计算两个(x1,y1,x2,y2)框的交并比
+    """
+    ix = max(0, min(box1[2], box2[2]) - max(box1[0], box2[0]))
+    iy = max(0, min(box1[3], box2[3]) - max(box1[1], box2[1]))
+    inter = ix * iy
+    union = ((box1[2] - box1[0]) * (box1[3] - box1[1]) +
+             (box2[2] - box2[0]) * (box2[3] - box2[1]) - inter)
+    return inter / union if union > 0 else 0.0
+
+def compare_search_modes(image, template, threshold=0.45, iou_thresh=0.5, **pyramid_options):
+    """
+    以全图逐尺度匹配为基准，评估金字塔搜索的召回率和加速比
+    Args:
+        image: 要搜索的图片
+        template: 模板图片
+        threshold: 匹配阈值
+        iou_thresh: 两个框视为同一目标的交并比阈值
+        pyramid_options: 传给find_template_matches_pyramid的参数
+    Returns:
+        dict: 两种模式的耗时、匹配数量，以及金字塔模式的召回率和精确率
+    """
+    start = time.perf_counter()
+    exhaustive = find_template_matches(image, template, threshold)
+    exhaustive_time = time.perf_counter() - start
     
-    return matches
+    start = time.perf_counter()
+    pyramid = find_template_matches_pyramid(image, template, threshold, **pyramid_options)
+    pyramid_time = time.perf_counter() - start
+    
+    recalled = sum(1 for ref in exhaustive
+                   if any(_box_iou(ref, box) >= iou_thresh for box in pyramid))
+    precise = sum(1 for box in pyramid
+                  if any(_box_iou(ref, box) >= iou_thresh for ref in exhaustive))
+    
+    return {
+        'exhaustive_time': exhaustive_time,
+        'pyramid_time': pyramid_time,
+        'speedup': exhaustive_time / pyramid_time if pyramid_time > 0 else float('inf'),
+        'exhaustive_matches': len(exhaustive),
+        'pyramid_matches': len(pyramid),
+        'recall': recalled / len(exhaustive) if exhaustive else 1.0,
+        'precision': precise / len(pyramid) if pyramid else 1.0
+    }
 
-def non_max_suppression(boxes, overlap_thresh=0.3):
+def non_max_suppression(boxes, overlap_thresh=MATCH_OVERLAP_THRESH, scores=None):
     """
     非极大值抑制，合并重叠的框
     Args:
         boxes: 边界框列表，格式为[(x1,y1,x2,y2),...]
         overlap_thresh: 重叠阈值
+        scores: 每个框的得分，未提供时以框的右下角y坐标排序(与旧版本一致)
     Returns:
-        list: 合并后的边界框列表
+        list: 合并后的边界框列表，按得分从高到低排列
     """
     if len(boxes) == 0:
         return []
     
     boxes = np.array(boxes)
+    if scores is None:
+        scores = boxes[:, 3]
+    pick = nms(boxes, scores, overlap_thresh, metric="overlap")
+    return boxes[pick].tolist()
+
+class TemplateBank:
+    def __init__(self, templates, scales=None):
+        """
+        预处理一组关闭按钮模板，并预先生成每个尺度下的边缘图
+        Args:
+            templates: {模板名: 模板图片}
+            scales: 模板缩放范围，默认DEFAULT_SCALES
+        """
+        self.scales = np.asarray(DEFAULT_SCALES if scales is None else scales, dtype=np.float64)
+        self.names = list(templates.keys())
+        # edge_maps[i][j]为第i个模板在第j个尺度下的预处理结果
+        self.edge_maps = []
+        for name in self.names:
+            processed = preprocess_image(templates[name])
+            resized = []
+            for scale in self.scales:
+                width = int(processed.shape[1] * scale)
+                height = int(processed.shape[0] * scale)
+                resized.append(cv2.resize(processed, (width, height)))
+            self.edge_maps.append(resized)
+        self.signature = None
     
-    # 计算所有框的面积
-    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    @staticmethod
+    def _template_paths(template_path):
+        """
+        模板路径可以是单个图片，也可以是存放多个模板的目录
+        """
+        if os.path.isdir(template_path):
+            image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
+            return [os.path.join(template_path, f) for f in sorted(os.listdir(template_path))
+                    if any(f.lower().endswith(ext) for ext in image_extensions)]
+        return [template_path]
     
-    # 按照框的右下角y坐标排序
-    idxs = np.argsort(boxes[:, 3])
+    @classmethod
+    def from_path(cls, template_path, scales=None, cache_path=None):
+        """
+        从图片或目录加载模板；指定cache_path时优先读取缓存，模板变化后自动重建缓存
+        Args:
+            template_path: 模板图片路径或模板目录
+            scales: 模板缩放范围
+            cache_path: 预处理结果的缓存文件(.npz)
+        Returns:
+            TemplateBank: 模板库
+        """
+        paths = cls._template_paths(template_path)
+        scales = np.asarray(DEFAULT_SCALES if scales is None else scales, dtype=np.float64)
+        signature = json.dumps({
+            'version': CROSS_DETECTOR_VERSION,
+            'templates': [[os.path.basename(p), file_digest(p)] for p in paths],
+            'scales': [round(float(v), 6) for v in scales]
+        })
+        
+        if cache_path and os.path.exists(cache_path):
+            try:
+                bank = cls.load(cache_path)
+                if bank.signature == signature:
+                    return bank
+                print("模板缓存已过期，重新生成")
+            except Exception as e:
+                print(f"读取模板缓存失败: {str(e)}")
+        
+        templates = {}
+        for path in paths:
+            template = cv2.imread(path)
+            if template is None:
+                raise Exception(f"无法读取模板图片: {path}")
+            templates[os.path.basename(path)] = template
+        if not templates:
+            raise Exception(f"没有找到模板图片: {template_path}")
+        
+        bank = cls(templates, scales)
+        bank.signature = signature
+        if cache_path:
+            bank.save(cache_path)
+        return bank
     
-    pick = []
-    while len(idxs) > 0:
-        # 取出最后一个框
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
+    def save(self, cache_path):
+        """
+        将预处理好的边缘图保存到缓存文件
+        """
+        arrays = {f"t{i}_s{j}": edge
+                  for i, edge_maps in enumerate(self.edge_maps)
+                  for j, edge in enumerate(edge_maps)}
+        meta = json.dumps({'names': self.names, 'signature': self.signature})
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        np.savez_compressed(cache_path, meta=np.array(meta), scales=self.scales, **arrays)
+    
+    @classmethod
+    def load(cls, cache_path):
+        """
+        从缓存文件加载模板库
+        """
+        with np.load(cache_path) as data:
+            meta = json.loads(str(data['meta']))
+            bank = cls.__new__(cls)
+            bank.scales = data['scales']
+            bank.names = meta['names']
+            bank.signature = meta['signature']
+            bank.edge_maps = [[data[f"t{i}_s{j}"] for j in range(len(bank.scales))]
+                              for i in range(len(bank.names))]
+        return bank
+    
+    @property
+    def max_size(self):
+        """
+        所有模板在所有尺度下的最大边长
+        """
+        return max(max(edge.shape[:2]) for edge_maps in self.edge_maps for edge in edge_maps)
+    
+    def match(self, image, threshold=0.45, processed_image=None, workers=None, regions=None):
+        """
+        在图片中匹配模板库中的所有模板，图片只预处理一次
+        Args:
+            image: 要搜索的图片
+            threshold: 匹配阈值
+            processed_image: 已经预处理过的图片，提供时忽略image
+            workers: 并行匹配的线程数，None或1表示顺序执行
+            regions: 只在这些区域[(x1,y1,x2,y2),...]内匹配，None表示全图
+        Returns:
+            list: 按得分从高到低排列，每项格式为
+                  {'position': (x1,y1,x2,y2), 'score': 得分, 'template': 模板名, 'scale': 缩放比例}
+        """
+        if processed_image is None:
+            processed_image = preprocess_image(image)
+        
+        if regions is None:
+            regions = [(0, 0, processed_image.shape[1], processed_image.shape[0])]
         
-        # 找出所有框与当前框的重叠区域
-        xx1 = np.maximum(boxes[i, 0], boxes[idxs[:last], 0])
-        yy1 = np.maximum(boxes[i, 1], boxes[idxs[:last], 1])
-        xx2 = np.minimum(boxes[i, 2], boxes[idxs[:last], 2])
-        yy2 = np.minimum(boxes[i, 3], boxes[idxs[:last], 3])
+        # 所有(模板, 尺度)组合展开为一组匹配任务
+        jobs = [(i, j) for i in range(len(self.edge_maps)) for j in range(len(self.scales))]
+        edges = [self.edge_maps[i][j] for i, j in jobs]
         
-        # 计算重叠区域的宽度和高度
-        w = np.maximum(0, xx2 - xx1)
-        h = np.maximum(0, yy2 - yy1)
+        boxes = []
+        scores = []
+        labels = []
+        for x1, y1, x2, y2 in regions:
+            with tracing.span("template_bank_match", "match", region=[x1, y1, x2, y2], jobs=len(jobs)):
+                results = _run_match_jobs(processed_image[y1:y2, x1:x2], edges, threshold, workers)
+            for job, (job_boxes, job_scores) in zip(jobs, results):
+                boxes.append(job_boxes + np.array([x1, y1, x1, y1]))
+                scores.append(job_scores)
+                labels.extend([job] * len(job_scores))
+        boxes = np.concatenate(boxes)
+        scores = np.concatenate(scores)
         
-        # 计算重叠区域的面积
-        overlap = (w * h) / area[idxs[:last]]
+        if len(boxes) == 0:
+            return []
         
-        # 删除重叠度高的框
-        idxs = np.delete(idxs, np.concatenate(([last],
-            np.where(overlap > overlap_thresh)[0])))
+        # 不同模板之间同样互相抑制，同一位置只报告得分最高的模板
+        pick = nms(boxes, scores, MATCH_OVERLAP_THRESH, metric="overlap")
+        return [{
+            'position': tuple(int(v) for v in boxes[k]),
+            'score': float(scores[k]),
+            'template': self.names[labels[k][0]],
+            'scale': float(self.scales[labels[k][1]])
+        } for k in pick]
+
+def match_with_prior(image, bank, prior, threshold=0.45, workers=None, mass=0.9, update=True):
+    """
+    先在位置先验的高概率区域内匹配，没有结果超过阈值时再搜索全图
+    Args:
+        image: 要搜索的图片
+        bank: TemplateBank模板库
+        prior: RegionPrior位置先验
+        threshold: 匹配阈值
+        workers: 并行匹配的线程数
+        mass: 高概率区域需要覆盖的历史匹配比例
+        update: 是否用本次匹配结果在线更新先验
+    Returns:
+        list: 与TemplateBank.match相同的匹配结果
+    """
+    processed_image = preprocess_image(image)
     
-    return boxes[pick].tolist()
+    matches = []
+    regions = prior.regions(image.shape, mass, pad=bank.max_size)
+    if regions:
+        matches = bank.match(None, threshold, processed_image, workers, regions)
+    if not matches:
+        matches = bank.match(None, threshold, processed_image, workers)
+    
+    if update:
+        for match in matches:
+            prior.update(match['position'], image.shape)
+    return matches
+
+def build_region_prior(template_path="imgs/cross.jpg", input_dir="imgs/cross",
+                       prior_path="output/cross/region_prior.json", threshold=0.45):
+    """
+    对历史截图做全图匹配，统计关闭按钮的位置分布并保存为位置先验
+    已有检测结果时也可以用RegionPrior.from_results直接建立，不必重新匹配
+    Args:
+        template_path: 模板图片路径或模板目录
+        input_dir: 历史截图目录
+        prior_path: 位置先验保存路径
+        threshold: 匹配阈值
+    Returns:
+        RegionPrior: 位置先验
+    """
+    bank = TemplateBank.from_path(template_path)
+    prior = RegionPrior()
+    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
+    for image_file in os.listdir(input_dir):
+        if not any(image_file.lower().endswith(ext) for ext in image_extensions):
+            continue
+        img = cv2.imread(os.path.join(input_dir, image_file))
+        if img is None:
+            continue
+        for match in bank.match(img, threshold):
+            prior.update(match['position'], img.shape)
+    prior.save(prior_path)
+    print(f"位置先验已保存: {prior_path}")
+    return prior
 
 def process_cross_detection(template_path="imgs/cross.jpg", 
                           input_dir="imgs/cross", 
-                          output_dir="output/cross"):
+                          output_dir="output/cross",
+                          incremental=True,
+                          mode="exhaustive",
+                          template_cache=None,
+                          workers=None,
+                          prior_path=None,
+                          frame_store=None):
     """
     处理所有图片，查找与模板匹配的区域
     Args:
-        template_path: 模板图片路径
+        template_path: 模板图片路径，也可以是存放多个模板的目录
         input_dir: 输入图片目录
         output_dir: 输出结果目录
+        incremental: 是否只处理新增或变化的图片(依据输出目录中的清单)
+        mode: 匹配模式，"exhaustive"或"pyramid"(仅支持单个模板)
+        template_cache: 模板库预处理结果的缓存文件
+        workers: 并行匹配的线程数，None或1表示顺序执行
+        prior_path: 位置先验文件，提供时优先在高概率区域内匹配，并在运行结束后保存更新后的先验
+        frame_store: 帧存储目录(如"imgs/cross.frames")，提供时图片只解码一次，之后从存储中读取
     """
+    manifest = None
+    prior = None
     try:
         # 创建输出目录
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
             
-        # 读取模板图片
-        template = cv2.imread(template_path)
-        if template is None:
-            raise Exception(f"无法读取模板图片: {template_path}")
+        # 读取模板图片：金字塔模式直接使用单个模板，否则一次性预处理整个模板库
+        if mode == "pyramid":
+            template = cv2.imread(template_path)
+            if template is None:
+                raise Exception(f"无法读取模板图片: {template_path}")
+            template_signature = file_digest(template_path)
+        else:
+            template = TemplateBank.from_path(template_path, cache_path=template_cache)
+            template_signature = template.signature
+            print(f"已加载 {len(template.names)} 个模板")
+            if prior_path:
+                prior = RegionPrior.load_or_create(prior_path)
             
         # 获取所有图片文件
         image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
@@ -138,33 +591,198 @@ def process_cross_detection(template_path="imgs/cross.jpg",
         
         print(f"找到 {len(image_files)} 个图片文件")
         
+        if incremental:
+            # 模板内容也作为参数，更换模板后重新处理
+            params = {'template': template_signature, 'mode': mode}
+            if prior is not None:
+                # 使用位置先验时可能只在高概率区域内找到匹配，结果与全图匹配不同；两种模式共用同一份清单
+                # 和输出图片，开启/关闭先验或更换先验文件后清单失效，整个目录重新处理。
+                # 先验文件每次运行后都会更新，按路径而不是内容区分，否则每次都要全部重新处理
+                params['prior'] = os.path.abspath(prior_path)
+            manifest = BatchManifest(output_dir, "cross", CROSS_DETECTOR_VERSION, params)
+            image_files = [f for f in image_files
+                           if manifest.needs_processing(os.path.join(input_dir, f))]
+            print(f"其中 {len(image_files)} 个需要处理")
+        
         # 处理每个图片
-        for image_file in image_files:
-            input_path = os.path.join(input_dir, image_file)
+        for image_file, input_path, img in iter_frames(input_dir, image_files, frame_store):
             print(f"\n处理图片: {input_path}")
             
-            # 读取图片
-            img = cv2.imread(input_path)
+            # 读取图片(使用帧存储时不再解码)
             if img is None:
                 print(f"无法读取图片: {input_path}")
+                if manifest is not None:
+                    manifest.mark_failed(input_path, "无法读取图片")
                 continue
                 
-            # 查找匹配
-            matches = find_template_matches(img, template)
-            
-            # 在原始图片上绘制匹配结果
-            for (x1, y1, x2, y2) in matches:
-                cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), 
-                            (0, 255, 0), 2)
-            
-            # 保存结果
-            output_path = os.path.join(output_dir, f"detected_{image_file}")
-            cv2.imwrite(output_path, img)
-            print(f"检测结果已保存: {output_path}")
-            print(f"找到 {len(matches)} 个匹配")
+            try:
+                # 查找匹配
+                with tracing.span("find_cross", "flow", image=image_file):
+                    if prior is not None:
+                        matches = match_with_prior(img, template, prior, workers=workers)
+                    elif isinstance(template, TemplateBank):
+                        matches = template.match(img, workers=workers)
+                    else:
+                        matches = [{'position': tuple(box[:4]), 'score': box[4],
+                                    'template': os.path.basename(template_path)}
+                                   for box in find_template_matches(img, template, mode=mode,
+                                                                    return_scores=True)]
+                
+                # 在原始图片上绘制匹配结果
+                for match in matches:
+                    x1, y1, x2, y2 = match['position']
+                    cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), 
+                                (0, 255, 0), 2)
+                
+                # 保存结果
+                output_path = os.path.join(output_dir, f"detected_{image_file}")
+                with tracing.span("write", "io", image=image_file):
+                    cv2.imwrite(output_path, img)
+                if manifest is not None:
+                    manifest.mark_done(input_path, output_path,
+                                       [{'position': list(m['position']), 'score': m['score'],
+                                         'template': m['template']} for m in matches])
+                print(f"检测结果已保存: {output_path}")
+                print(f"找到 {len(matches)} 个匹配")
+                for match in matches:
+                    print(f"模板: {match['template']}, 位置: {match['position']}, 得分: {match['score']:.2f}")
+            except Exception as e:
+                # 单张图片出错时记录失败并继续处理其余图片，下次运行重试
+                print(f"处理图片失败: {input_path}: {str(e)}")
+                if manifest is not None:
+                    manifest.mark_failed(input_path, str(e))
             
     except Exception as e:
         print(f"处理过程发生错误: {str(e)}")
+    finally:
+        # 中途出错时也保存已完成的部分，下次运行从断点继续
+        if manifest is not None:
+            manifest.save()
+        if prior is not None:
+            prior.save(prior_path)
+
+def process_cross_detection_pipelined(template_path="imgs/cross.jpg",
+                                      input_dir="imgs/cross",
+                                      output_dir="output/cross",
+                                      incremental=True,
+                                      template_cache=None,
+                                      decode_workers=2,
+                                      detect_workers=2,
+                                      queue_size=8,
+                                      results_path=None,
+                                      frame_store=None):
+    """
+    以流水线方式批量检测关闭按钮：读取解码、模板匹配、绘制写盘分别在各自的线程池中进行，
+    级间使用有界队列，磁盘、解码和匹配可以同时工作
+    Args:
+        template_path: 模板图片路径，也可以是存放多个模板的目录
+        input_dir: 输入图片目录
+        output_dir: 输出结果目录
+        incremental: 是否只处理新增或变化的图片(依据输出目录中的清单)
+        template_cache: 模板库预处理结果的缓存文件
+        decode_workers: 读取解码线程数
+        detect_workers: 模板匹配线程数，所有线程共享同一个预处理好的模板库
+        queue_size: 级间队列容量
+        results_path: 检测结果JSONL文件，默认为输出目录下的results.jsonl
+        frame_store: 帧存储目录，提供时先把新增或变化的图片加入存储，读取级直接从内存映射中取图
+    Returns:
+        list: 每级的吞吐量统计
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if results_path is None:
+        results_path = os.path.join(output_dir, "results.jsonl")
+    
+    bank = TemplateBank.from_path(template_path, cache_path=template_cache)
+    print(f"已加载 {len(bank.names)} 个模板")
+    
+    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
+    image_files = [f for f in os.listdir(input_dir)
+                   if any(f.lower().endswith(ext) for ext in image_extensions)]
+    print(f"找到 {len(image_files)} 个图片文件")
+    
+    manifest = None
+    if incremental:
+        manifest = BatchManifest(output_dir, "cross", CROSS_DETECTOR_VERSION,
+                                 {'template': bank.signature, 'mode': "exhaustive"})
+        image_files = [f for f in image_files
+                       if manifest.needs_processing(os.path.join(input_dir, f))]
+        print(f"其中 {len(image_files)} 个需要处理")
+    
+    store = None
+    if frame_store:
+        store = FrameStore(frame_store)
+        print(f"帧存储新解码 {store.sync(input_dir, image_files)} 帧")
+    
+    def decode(image_file):
+        input_path = os.path.join(input_dir, image_file)
+        if store is not None:
+            img = store.get(image_file, copy=True)
+        else:
+            img = cv2.imread(input_path)
+        if img is None:
+            print(f"无法读取图片: {input_path}")
+            # 失败的项继续传给写盘级，由唯一的写盘线程记录到清单
+            return {'file': image_file, 'input': input_path, 'error': "无法读取图片"}
+        return {'file': image_file, 'input': input_path, 'image': img}
+    
+    def detect(item):
+        if 'error' in item:
+            return item
+        start = time.perf_counter()
+        try:
+            item['matches'] = bank.match(item['image'])
+        except Exception as e:
+            print(f"匹配失败: {item['input']}: {str(e)}")
+            item['error'] = str(e)
+        item['detect_ms'] = (time.perf_counter() - start) * 1000
+        return item
+    
+    results_file = open(results_path, "a", encoding="utf-8")
+    
+    def write(item):
+        if 'error' in item:
+            if manifest is not None:
+                manifest.mark_failed(item['input'], item['error'])
+            return None
+        img = item['image']
+        for match in item['matches']:
+            x1, y1, x2, y2 = match['position']
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        output_path = os.path.join(output_dir, f"detected_{item['file']}")
+        cv2.imwrite(output_path, img)
+        
+        matches = [{'position': list(m['position']), 'score': m['score'],
+                    'template': m['template']} for m in item['matches']]
+        record = {
+            'file': item['file'],
+            'output': output_path,
+            'image_size': [img.shape[1], img.shape[0]],
+            'matches': matches,
+            'detect_ms': round(item['detect_ms'], 2),
+            'time': time.time()
+        }
+        results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        results_file.flush()
+        # 写盘只有一个线程，清单不需要加锁
+        if manifest is not None:
+            manifest.mark_done(item['input'], output_path, matches)
+        return item['file']
+    
+    pipe = (StagedPipeline(queue_size)
+            .add_stage("decode", decode, decode_workers)
+            .add_stage("detect", detect, detect_workers)
+            .add_stage("write", write, 1))
+    try:
+        pipe.run(image_files)
+    finally:
+        results_file.close()
+        if manifest is not None:
+            manifest.save()
+    
+    pipe.print_report()
+    print(f"检测结果已写入: {results_path}")
+    return pipe.report()
 
 if __name__ == "__main__":
     process_cross_detection()
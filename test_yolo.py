@@ -4,10 +4,11 @@ from ultralytics import YOLO
 import time
 import numpy as np
 import controller
+from screen_fingerprint import fingerprint, decode_fingerprint, is_similar
 
 def compare_screenshots(img1: np.ndarray, img2: np.ndarray, threshold: float = 0.95) -> bool:
     """
-    比较两个截图是否相似
+    比较两个截图是否相似：比较去掉状态栏后的感知哈希和缩略图SSIM，时钟等变化不影响结果
     Args:
         img1: 第一个截图
         img2: 第二个截图
@@ -16,13 +17,7 @@ def compare_screenshots(img1: np.ndarray, img2: np.ndarray, threshold: float = 0
         bool: 是否相似
     """
     try:
-        # 确保两个图片尺寸相同
-        if img1.shape != img2.shape:
-            return False
-        
-        # 计算图片相似度
-        similarity = cv2.matchTemplate(img1, img2, cv2.TM_CCOEFF_NORMED)[0][0]
-        return similarity >= threshold
+        return is_similar(fingerprint(img1), fingerprint(img2), threshold)
         
     except Exception as e:
         print(f"比较截图失败: {str(e)}")
@@ -32,26 +27,27 @@ def ensure_back_to_initial_page(initial_img: np.ndarray, device_id: str = None,
     """
     确保返回到初始页面
     Args:
-        initial_img: 初始页面的截图
+        initial_img: 初始页面的截图，或其指纹(fingerprint()的返回值)
         device_id: 设备ID
         max_attempts: 最大尝试次数
     Returns:
         bool: 是否成功返回初始页面
     """
+    # 初始页面的指纹只计算一次
+    initial_fp = initial_img if isinstance(initial_img, tuple) else fingerprint(initial_img)
     for i in range(max_attempts):
         # 获取当前页面截图
         current_screenshot_data = controller.capture_phone_screen(device_id)
         if current_screenshot_data is None:
             continue
             
-        # 转换为numpy数组
-        nparr = np.frombuffer(current_screenshot_data, np.uint8)
-        current_img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if current_img is None:
+        # 以低分辨率灰度解码并计算指纹，不需要完整解码
+        current_fp = decode_fingerprint(current_screenshot_data)
+        if current_fp is None:
             continue
         
         # 比较当前页面与初始页面
-        if compare_screenshots(initial_img, current_img):
+        if is_similar(initial_fp, current_fp):
             print("已返回初始页面")
             return True
             
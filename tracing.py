@@ -0,0 +1,289 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import clock
+# 时间线追踪：在截图、解码、OCR、模板匹配、YOLO、GroundingDINO、点击、按键和等待等环节记录耗时区间，
+# 输出Chrome trace格式的JSON(可用chrome://tracing或ui.perfetto.dev打开)，查看一次遍历的时间花在哪里；
+# 未开启时span()直接返回空操作对象，几乎没有开销
+
+TRACE_ENV = "APPAUTO_TRACE"
+DEFAULT_TRACE_DIR = os.path.join("output", "traces")
+
+_tracer = None
+_local = threading.local()
+
+
+class _NullSpan:
+    """
+    未开启追踪时使用的空操作区间
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name: str, cat: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = clock.now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = clock.now()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.complete(self.name, self.cat, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        """
+        在区间结束前补充参数，例如检测到的框数
+        """
+        self.args.update(args)
+
+
+class Tracer:
+    def __init__(self, path: str, device_id: str = None, app: str = None, max_events: int = 200000):
+        """
+        初始化追踪记录
+        Args:
+            path: 输出的trace文件
+            device_id: 设备ID，写入进程名和每个事件的参数
+            app: 当前测试的应用，写入每个事件的参数，可用tags()按线程修改
+            max_events: 最多记录的事件数，超出后丢弃并计数，避免长时间运行占用过多内存
+        """
+        self.path = path
+        self.tags = {k: v for k, v in (('device', device_id), ('app', app)) if v}
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+        self.pid = os.getpid()
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._origin = clock.now()
+        self._created = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _tid(self) -> int:
+        # 线程ID较大，映射为从1开始的小编号，并记录线程名
+        ident = threading.get_ident()
+        tid = self._threads.get(ident)
+        if tid is None:
+            with self._lock:
+                tid = self._threads.setdefault(ident, len(self._threads) + 1)
+                self.events.append({'ph': "M", 'name': "thread_name", 'pid': self.pid, 'tid': tid,
+                                    'args': {'name': threading.current_thread().name}})
+        return tid
+
+    def _add(self, event: dict):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        event['pid'] = self.pid
+        event['tid'] = self._tid()
+        tags = getattr(_local, "tags", None)
+        event['args'] = {**self.tags, **tags, **event['args']} if tags else {**self.tags, **event['args']}
+        self.events.append(event)
+
+    def _us(self, t: float) -> float:
+        return round((t - self._origin) * 1e6, 1)
+
+    def complete(self, name: str, cat: str, start: float, end: float, args: dict):
+        """
+        记录一个已结束的区间(Chrome trace的"X"事件)
+        """
+        self._add({'ph': "X", 'name': name, 'cat': cat, 'ts': self._us(start),
+                   'dur': round((end - start) * 1e6, 1), 'args': args})
+
+    def instant(self, name: str, cat: str, args: dict):
+        """
+        记录一个时间点事件，如画面变化、检测到弹窗
+        """
+        self._add({'ph': "i", 's': "t", 'name': name, 'cat': cat,
+                   'ts': self._us(clock.now()), 'args': args})
+
+    def save(self, path: str = None) -> str:
+        """
+        写入trace文件
+        Returns:
+            str: 文件路径
+        """
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            process_name = "appAuto" + (f" {self.tags['device']}" if 'device' in self.tags else "")
+            events = [{'ph': "M", 'name': "process_name", 'pid': self.pid, 'tid': 0,
+                       'args': {'name': process_name}}] + list(self.events)
+            data = {
+                'traceEvents': events,
+                'displayTimeUnit': "ms",
+                'otherData': dict(self.tags, created=self._created, dropped=self.dropped)
+            }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def start(path: str = None, device_id: str = None, app: str = None, max_events: int = 200000) -> Tracer:
+    """
+    开始记录；已在记录时先保存之前的记录
+    Args:
+        path: 输出文件，默认为output/traces/trace_<时间>_<设备>.json
+        device_id: 设备ID
+        app: 应用名
+        max_events: 最多记录的事件数
+    Returns:
+        Tracer: 追踪记录
+    """
+    global _tracer
+    if _tracer is not None:
+        stop()
+    if path is None:
+        suffix = f"_{device_id}" if device_id else ""
+        path = os.path.join(DEFAULT_TRACE_DIR,
+                            f"trace_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}{suffix}.json")
+    _tracer = Tracer(path, device_id, app, max_events)
+    return _tracer
+
+
+def stop():
+    """
+    停止记录并写入trace文件
+    Returns:
+        str: 文件路径，未在记录时返回None
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    try:
+        path = tracer.save()
+        print(f"trace已保存: {path}(事件 {len(tracer.events)} 个，丢弃 {tracer.dropped} 个)")
+        return path
+    except Exception as e:
+        print(f"保存trace失败: {str(e)}")
+        return None
+
+
+def span(name: str, cat: str = "", **args):
+    """
+    记录一个耗时区间，用法: with span("ocr", "ocr"): ...
+    Args:
+        name: 区间名称
+        cat: 分类，如adb、decode、ocr、match、yolo、dino、sleep
+        **args: 附加参数
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, cat, args)
+
+
+def instant(name: str, cat: str = "", **args):
+    """
+    记录一个时间点事件
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.instant(name, cat, args)
+
+
+def traced(name: str = None, cat: str = "flow"):
+    """
+    装饰器：函数的每次调用记录为一个区间
+    Args:
+        name: 区间名称，默认为函数名
+        cat: 分类
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sleep(seconds: float, reason: str = ""):
+    """
+    等待(clock.sleep，回放时推进虚拟时钟)并记录等待区间；等待在遍历中往往占大头，单独列出便于判断能否缩短
+    Args:
+        seconds: 等待时间
+        reason: 等待原因，如"等待应用启动"
+    """
+    with span("sleep", "sleep", seconds=seconds, reason=reason):
+        clock.sleep(seconds)
+
+
+@contextlib.contextmanager
+def tags(**values):
+    """
+    在当前线程内为之后的事件附加标签，如with tags(app="target_3"): ...
+    标签只对当前线程有效，交给线程池或后台线程的工作需用bind()或current_tags()带上
+    """
+    previous = getattr(_local, "tags", None)
+    _local.tags = dict(previous or {}, **{k: v for k, v in values.items() if v is not None})
+    try:
+        yield
+    finally:
+        _local.tags = previous
+
+
+def current_tags() -> dict:
+    """
+    返回当前线程的标签(副本)，安排后台工作时记下，在后台线程中以tags(**标签)恢复
+    """
+    return dict(getattr(_local, "tags", None) or {})
+
+
+def bind(func):
+    """
+    将当前线程的标签绑定到函数上，函数在其他线程(如线程池)中执行时事件仍带有这些标签
+    Args:
+        func: 要交给其他线程执行的函数
+    Returns:
+        在执行时恢复标签的函数；当前线程没有标签时直接返回func
+    """
+    captured = current_tags()
+    if not captured:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tags(**captured):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# 设置环境变量APPAUTO_TRACE即可为整个进程开启记录：值为1时使用默认路径，否则作为输出文件路径
+if os.environ.get(TRACE_ENV):
+    _value = os.environ[TRACE_ENV]
+    start(None if _value == "1" else _value, device_id=os.environ.get("ANDROID_SERIAL"))
+    atexit.register(stop)